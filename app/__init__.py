@@ -1,30 +1,96 @@
-import json
+import logging
 import os
+import threading
 import uuid
 from functools import partial
 from pathlib import Path
 
-from flask import Flask, request, jsonify
-from app.src.pipelines import LookupPipeline, FuzzyMatchPipeline, BM25OkapiPipeline, BiencoderPipeline
+from flask import Flask, request, jsonify, send_file
+from app.src.pipelines import LookupPipeline, FuzzyMatchPipeline, BM25OkapiPipeline, BiencoderPipeline, CascadePipeline
 from app.src.format import PassthroughFormatter
+from app.src.negation.lexicons import LEXICONS as NEGEX_LEXICONS
+from app.config import (
+    PRELOAD_PIPELINES, MICROBATCH_MAX_LATENCY_MS, MICROBATCH_MAX_TEXTS,
+    PIPELINE_CACHE_MAX_RAM_MB, PIPELINE_CACHE_MAX_VRAM_MB,
+    INFERENCE_MAX_CONCURRENCY, INFERENCE_MAX_QUEUE, INFERENCE_RETRY_AFTER_S,
+    PROFILING_ENABLED, PROFILE_DIR, PROFILE_KEEP, PROFILE_SAMPLE_INTERVAL_MS,
+    RESULT_CACHE_DIR, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_S,
+)
+from app.concurrency import InferenceLimiter, LimitedPredictor, Overloaded
+from app.incremental import predict_incremental
+from app.metrics import collect_timings, gauge, render_prometheus, timed
+from app.microbatch import MicroBatcher
+from app.parallelism import configure_parallelism
+from app.pipeline_cache import PipelineCache
+from app.profiling import MODES as PROFILE_MODES, ProfileStore
+from app.result_cache import DISK_NAME as RESULT_CACHE_NAME, CachedPredictor, ResultCache
+from app.serialization import FORMATS as OUTPUT_FORMATS, FastJSONProvider, wait, write_files, write_jsonl
+from app.src.model_store import model_store
 from typing import Sequence
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+# Environment/registry settings only; servers and batch workers pass their own
+# per-process defaults (see gunicorn.conf.py and app/batch.py).
+configure_parallelism()
 method2pipeline = {
     'lookup': LookupPipeline,
     'levenshtein': partial(FuzzyMatchPipeline, method='levenshtein'),
-    'jaro-winkler': partial(FuzzyMatchPipeline, method='jaro_winkler'),
-    'token-sort-ratio': partial(FuzzyMatchPipeline, method='token_sort_ratio'),
-    'token-set-ratio': partial(FuzzyMatchPipeline, method='token_set_ratio'),
+    'jaro-winkler': partial(FuzzyMatchPipeline, method='jaro-winkler'),
+    'token-sort-ratio': partial(FuzzyMatchPipeline, method='token-sort-ratio'),
+    'token-set-ratio': partial(FuzzyMatchPipeline, method='token-set-ratio'),
     'bm25': BM25OkapiPipeline,
-    'biencoder': partial(BiencoderPipeline, ner_version=2),
+    'biencoder': BiencoderPipeline,
+    'cascade': CascadePipeline,
 }
 
+# Methods whose negation comes from a NER model rather than the rule-based tagger
+MODEL_NEGATION_METHODS = {'biencoder', 'cascade'}
+
 cdm2formatter = {
     'none': PassthroughFormatter
 }
 
-_pipeline_cache: dict = {}
+_batcher_cache: dict = {}
+_batcher_lock = threading.Lock()
+_limiter = InferenceLimiter(
+    max_concurrency=INFERENCE_MAX_CONCURRENCY,
+    max_queue=INFERENCE_MAX_QUEUE,
+    retry_after=INFERENCE_RETRY_AFTER_S,
+)
+
+
+def _drop_batcher(key, pipeline):
+    with _batcher_lock:
+        batcher = _batcher_cache.pop(key, None)
+    if batcher is not None:
+        batcher.close()
+
+
+_profiles = ProfileStore(PROFILE_DIR, keep=PROFILE_KEEP)
+_result_cache = (
+    ResultCache(Path(RESULT_CACHE_DIR) / RESULT_CACHE_NAME, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_s=RESULT_CACHE_TTL_S)
+    if RESULT_CACHE_DIR else None
+)
+_pipeline_cache = PipelineCache(
+    max_ram_bytes=PIPELINE_CACHE_MAX_RAM_MB * 2**20,
+    max_vram_bytes=PIPELINE_CACHE_MAX_VRAM_MB * 2**20,
+    on_evict=_drop_batcher,
+)
+
+gauge("inference_admitted_requests", "Requests currently running or queued for an inference slot", lambda: _limiter.admitted)
+gauge("model_store_resident_ram_bytes", "Estimated RAM held by resident models", lambda: model_store.nbytes()[0])
+gauge("model_store_resident_vram_bytes", "Estimated VRAM held by resident models", lambda: model_store.nbytes()[1])
+
+# Set once every pipeline in PRELOAD_PIPELINES is loaded (see warmup / app.wsgi).
+# With nothing to preload, the lazy development server is ready immediately.
+_ready = threading.Event()
+if not PRELOAD_PIPELINES:
+    _ready.set()
+_warmup_lock = threading.Lock()
+_warmup_started = False
 
 
 # ---------------------------------------------------------------------------
@@ -48,8 +114,8 @@ def _extract_pipeline_params(data: dict):
         return None, "'entities' must be a non-empty list of strings."
 
     negation = data.get('negation', False)
-    if negation and method != 'biencoder':
-        return None, f"'negation' is only supported with method 'biencoder', got '{method}'."
+    if negation and method not in MODEL_NEGATION_METHODS and data['lang'] not in NEGEX_LEXICONS:
+        return None, f"'negation' with method '{method}' needs a negation lexicon; none for language {data['lang']!r}. Available: {sorted(NEGEX_LEXICONS)}"
 
     return {
         'method': method,
@@ -59,15 +125,120 @@ def _extract_pipeline_params(data: dict):
     }, None
 
 
+def _extract_previous(data: dict, single: bool, n_texts: int):
+    """Validate the optional 'previous' results of incremental re-annotation.
+    Returns (list of {"text", "annotations"} or None per text, None), (None, None)
+    when absent, or (None, error_str) on failure.
+    """
+    if data.get('previous') is None:
+        return None, None
+    raw = [data['previous']] if single else data['previous']
+    if not isinstance(raw, list) or len(raw) != n_texts:
+        return None, "'previous' must be a previous result (single text) or a list of results or nulls, one per text."
+    previous = []
+    for item in raw:
+        if item is None:
+            previous.append(None)
+            continue
+        if not isinstance(item, dict):
+            return None, "Each item of 'previous' must be a previous result object or null."
+        # A previous response carries its text in its metadata
+        text = item.get('text', (item.get('metadata') or {}).get('text'))
+        annotations = item.get('annotations')
+        if not isinstance(text, str) or not isinstance(annotations, list):
+            return None, "Each previous result needs its 'annotations' list and its text ('text' or 'metadata.text')."
+        if not all(isinstance(a, dict) and isinstance(a.get('start'), int) and isinstance(a.get('end'), int) for a in annotations):
+            return None, "Previous annotations must be objects with integer 'start' and 'end'."
+        previous.append({'text': text, 'annotations': annotations})
+    return previous, None
+
+
+def _extract_profile_mode(data: dict):
+    """Validate the optional 'profile' flag.
+    Returns (mode or None, None) on success or (None, error_str) on failure.
+    """
+    profile = data.get('profile', False)
+    if not profile:
+        return None, None
+    if not PROFILING_ENABLED:
+        return None, "Profiling is disabled on this server (set PROFILING_ENABLED=1)."
+    mode = 'cprofile' if profile is True else profile
+    if mode not in PROFILE_MODES:
+        return None, f"'profile' must be true or one of {list(PROFILE_MODES)}."
+    return mode, None
+
+
+def _extract_output_format(data: dict):
+    """Validate the optional 'output_format' field.
+    Returns (format, None) on success or (None, error_str) on failure.
+    """
+    output_format = data.get('output_format', 'json')
+    if output_format not in OUTPUT_FORMATS:
+        return None, f"'output_format' must be one of {list(OUTPUT_FORMATS)}."
+    return output_format, None
+
+
 def _build_pipeline(method, lang, entities, negation):
     key = (method, lang, frozenset(entities), negation)
-    if key not in _pipeline_cache:
-        pipeline_cls = method2pipeline[method]
-        if method == 'biencoder':
-            _pipeline_cache[key] = pipeline_cls(lang=lang, entities=entities, negation=negation)
-        else:
-            _pipeline_cache[key] = pipeline_cls(lang=lang, entities=entities)
-    return _pipeline_cache[key]
+    factory = partial(method2pipeline[method], lang=lang, entities=entities, negation=negation)
+    return _pipeline_cache.get(key, factory)
+
+
+def _build_predictor(method, lang, entities, negation):
+    """Return the object whose ``predict`` serves requests for these params:
+    the cached pipeline behind the inference semaphore, fronted by its
+    MicroBatcher when micro-batching is on."""
+    pipeline = LimitedPredictor(_build_pipeline(method, lang, entities, negation), _limiter)
+    if MICROBATCH_MAX_LATENCY_MS <= 0:
+        return pipeline
+    key = (method, lang, frozenset(entities), negation)
+    # Under the lock: two first requests must not each start a batcher
+    with _batcher_lock:
+        batcher = _batcher_cache.get(key)
+        if batcher is None:
+            batcher = _batcher_cache[key] = MicroBatcher(
+                pipeline,
+                max_latency_ms=MICROBATCH_MAX_LATENCY_MS,
+                max_batch_texts=MICROBATCH_MAX_TEXTS,
+                name=f"{method}/{lang}/{'+'.join(sorted(entities))}" + ("/negation" if negation else ""),
+            )
+    return batcher
+
+
+def warmup(specs: list[dict]) -> None:
+    """Build and load every pipeline described in *specs*, then mark the service ready.
+
+    Each spec is validated like an API request body. Raises ``ValueError`` on an
+    invalid spec so that a misconfigured server fails at startup, not on the
+    first request.
+    """
+    for spec in specs:
+        params, err = _extract_pipeline_params(spec)
+        if err:
+            raise ValueError(f"Invalid preload spec {spec!r}: {err}")
+        _build_pipeline(**params)
+    _ready.set()
+
+
+def _background_warmup() -> None:
+    try:
+        warmup(PRELOAD_PIPELINES)
+    except Exception:
+        logger.exception("Warm-up of PRELOAD_PIPELINES failed; /ready stays 503")
+
+
+@app.before_request
+def _start_warmup():
+    """Warm up in the background on the first request (readiness probes
+    included) of a server that did not import app.wsgi, e.g. ``flask run``."""
+    global _warmup_started
+    if _ready.is_set():
+        return
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_background_warmup, name="warmup", daemon=True).start()
 
 
 def _sanitize_inputs(
@@ -93,35 +264,122 @@ def _sanitize_inputs(
     return texts, metadatas, None
 
 
-def _run_pipeline(pipeline, texts: list, metadatas: Sequence[dict | None]) -> list:
+def _run_pipeline(pipeline, texts: list, metadatas: Sequence[dict | None], previous: list | None = None) -> list:
     formatter = cdm2formatter['none']()
-    annotations = pipeline.predict(texts=texts)
-    return [
-        formatter.serialize(text, ann, meta)
-        for text, ann, meta in zip(texts, annotations, metadatas)
-    ]
-
-
-def _write_to_dir(results: list[dict], output_dir: Path, filenames: list[str]) -> list:
-    """Write one JSON file per result into output_dir. Returns list of written paths."""
-    written = []
-    for result, fname in zip(results, filenames):
-        out_path = output_dir / fname
-        with open(out_path, 'w', encoding='utf-8') as fh:
-            json.dump(result, fh, ensure_ascii=False, indent=2)
-        written.append(out_path)
-    return written
+    if previous is None:
+        annotations = pipeline.predict(texts=texts)
+    else:
+        annotations = predict_incremental(pipeline, texts, previous)
+    with timed("format"):
+        return [
+            formatter.serialize(text, ann, meta)
+            for text, ann, meta in zip(texts, annotations, metadatas)
+        ]
+
+
+def _annotate(params: dict, texts: list, metadatas: Sequence[dict | None], profile: str | None = None, previous: list | None = None):
+    """Run one request through its pipeline, incrementally for the texts with a
+    *previous* result. Returns (results, profile_id or None)."""
+    with _limiter.admit():
+        if profile is None:
+            if _result_cache is None:
+                predictor = _build_predictor(**params)
+            else:
+                predictor = CachedPredictor(partial(_build_predictor, **params), _result_cache, _result_cache.namespace(**params))
+            return _run_pipeline(predictor, texts, metadatas, previous), None
+        # Bypass the micro-batcher and the result cache: the profiled call must run on this thread, alone
+        pipeline = LimitedPredictor(_build_pipeline(**params), _limiter)
+        return _profiles.profile(
+            partial(_run_pipeline, pipeline, texts, metadatas, previous),
+            mode=profile,
+            sample_interval=PROFILE_SAMPLE_INTERVAL_MS / 1000,
+        )
+
+
+def _write_to_dir(results: list[dict], output_dir: Path, filenames: list[str], output_format: str = 'json') -> list:
+    """Write one JSON file per result into output_dir, or with output_format 'jsonl'
+    a single <uuid>.jsonl file with one result per line. Returns list of written paths."""
+    with timed("json_write"):
+        if output_format == 'jsonl':
+            return [write_jsonl(results, output_dir / f"{uuid.uuid4().hex}.jsonl")]
+        return wait(write_files(results, output_dir, filenames))
+
+
+def _respond(payload, timings: dict | None = None, profile_id: str | None = None):
+    """jsonify *payload*; with *timings*, add them as a ``Server-Timing`` header (milliseconds)."""
+    with timed("json_response"):
+        response = jsonify(payload)
+    if profile_id is not None:
+        response.headers["X-Profile-Id"] = profile_id
+    if timings is not None:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()
+        )
+    return response
 
 
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
 
+@app.errorhandler(Overloaded)
+def overloaded(exc: Overloaded):
+    response = jsonify({"error": str(exc)})
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response, 503
+
+
 @app.route("/", methods=["GET"])
 def health():
     return "OK", 200
 
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once the preloaded pipelines are warm, 503 before."""
+    if _ready.is_set():
+        return "OK", 200
+    return "Warming up", 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint: stage latencies, counters and gauges of this process."""
+    return render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.route("/admin/pipelines", methods=["GET"])
+def admin_pipelines():
+    """Cached pipelines (LRU order), their resident memory, and the shared resources behind them."""
+    return jsonify(_pipeline_cache.describe())
+
+
+@app.route("/admin/profiles", methods=["GET"])
+def admin_profiles():
+    """Stored request profiles, newest first."""
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled on this server (set PROFILING_ENABLED=1)."}), 404
+    return jsonify(_profiles.describe())
+
+
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+@app.route("/admin/profiles/<profile_id>/<kind>", methods=["GET"])
+def admin_profile(profile_id: str, kind: str = "json"):
+    """One stored profile: its summary (default), or the raw ``pstats`` / ``collapsed`` file."""
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled on this server (set PROFILING_ENABLED=1)."}), 404
+    if kind not in ("json", "pstats", "collapsed"):
+        return jsonify({"error": "Profile file must be one of 'pstats', 'collapsed'."}), 400
+    path = _profiles.path(profile_id, kind)
+    if path is None:
+        return jsonify({"error": f"No {kind} profile with id {profile_id!r}."}), 404
+    if kind == "json":
+        return send_file(path, mimetype="application/json")
+    if kind == "collapsed":
+        return send_file(path, mimetype="text/plain")
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=path.name)
+
+
 @app.route('/annotate', methods=['POST'])
 def annotate():
     """Annotate a single text or a list of texts.
@@ -134,8 +392,12 @@ def annotate():
         lang       : str                           — language code (e.g. "es")
         method     : str                           — pipeline method
         entities   : list[str]                     — non-empty list of entity types to detect
-        negation   : bool  (default false)         — negation/uncertainty detection (biencoder only)
+        negation   : bool  (default false)         — negation/uncertainty detection (model-based for biencoder, rule-based otherwise)
         output_dir : str   (optional)              — if set, results are written as JSON files into this directory
+        output_format : str (default "json")       — with output_dir: "json" (one file per result) or "jsonl" (one <uuid>.jsonl file, one result per line)
+        timings    : bool  (default false)         — if true, a per-stage breakdown is returned in the Server-Timing header
+        profile    : bool | "cprofile" | "sample"  — profile this request (needs PROFILING_ENABLED); see /admin/profiles
+        previous   : dict | list[dict | None]      — previous result of each text (same parameters), to re-annotate only its edited sentences
     """
     data = request.json
     if not isinstance(data, dict):
@@ -169,17 +431,30 @@ def annotate():
     if err:
         return jsonify({"error": err}), 400
 
-    pipeline = _build_pipeline(**params)
-    results = _run_pipeline(pipeline, texts, metadatas)
+    profile, err = _extract_profile_mode(data)
+    if err:
+        return jsonify({"error": err}), 400
 
-    if output_dir := data.get('output_dir', None):
-        output_dir = Path(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        filenames = [f"{uuid.uuid4().hex}.json" for _ in results]
-        written = _write_to_dir(results, output_dir, filenames)
-        return jsonify({"output_dir": str(output_dir), "files_written": [str(p) for p in written], "count": len(written)})
-    
-    return jsonify(results[0] if single else results)
+    previous, err = _extract_previous(data, single, len(texts))
+    if err:
+        return jsonify({"error": err}), 400
+
+    output_format, err = _extract_output_format(data)
+    if err:
+        return jsonify({"error": err}), 400
+
+    with collect_timings() as collected:
+        timings = collected if data.get('timings') else None
+        results, profile_id = _annotate(params, texts, metadatas, profile, previous)
+
+        if output_dir := data.get('output_dir', None):
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            filenames = [f"{uuid.uuid4().hex}.json" for _ in results]
+            written = _write_to_dir(results, output_dir, filenames, output_format)
+            return _respond({"output_dir": str(output_dir), "files_written": [str(p) for p in written], "count": len(results)}, timings, profile_id)
+
+        return _respond(results[0] if single else results, timings, profile_id)
 
 
 @app.route('/annotate_dir', methods=['POST'])
@@ -191,8 +466,11 @@ def annotate_dir():
         lang       : str
         method     : str
         entities   : list[str]   — non-empty list of entity types to detect
-        negation   : bool  (default false)  — negation/uncertainty detection (biencoder only)
+        negation   : bool  (default false)  — negation/uncertainty detection (model-based for biencoder, rule-based otherwise)
         output_dir : str  (optional)        — if set, results are written as <stem>.json files into this directory
+        output_format : str (default "json") — with output_dir: "json" (one file per input) or "jsonl" (one <uuid>.jsonl file, one result per line)
+        timings    : bool  (default false)  — if true, a per-stage breakdown is returned in the Server-Timing header
+        profile    : bool | "cprofile" | "sample"  — profile this request (needs PROFILING_ENABLED); see /admin/profiles
     """
     data = request.json
     if not isinstance(data, dict):
@@ -211,6 +489,14 @@ def annotate_dir():
     if err:
         return jsonify({"error": err}), 400
 
+    profile, err = _extract_profile_mode(data)
+    if err:
+        return jsonify({"error": err}), 400
+
+    output_format, err = _extract_output_format(data)
+    if err:
+        return jsonify({"error": err}), 400
+
     txt_files = sorted(Path(input_dir).glob('*.txt'))
     if not txt_files:
         return jsonify({"error": f"No .txt files found in: {input_dir}"}), 400
@@ -219,19 +505,20 @@ def annotate_dir():
     filenames = [p.name for p in txt_files]
     metadatas = [{"source_file": str(p)} for p in txt_files]
 
-    pipeline = _build_pipeline(**params)
-    results = _run_pipeline(pipeline, texts, metadatas)
+    with collect_timings() as collected:
+        timings = collected if data.get('timings') else None
+        results, profile_id = _annotate(params, texts, metadatas, profile)
 
-    if output_dir := data.get('output_dir'):
-        if not isinstance(output_dir, str):
-            return jsonify({"error": "'output_dir' must be a string"}), 400
-        output_dir = Path(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        out_filenames = [Path(f).stem + '.json' for f in filenames]
-        written = _write_to_dir(results, output_dir, out_filenames)
-        return jsonify({"output_dir": str(output_dir), "files_written": [str(p) for p in written], "count": len(written)})
+        if output_dir := data.get('output_dir'):
+            if not isinstance(output_dir, str):
+                return jsonify({"error": "'output_dir' must be a string"}), 400
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            out_filenames = [Path(f).stem + '.json' for f in filenames]
+            written = _write_to_dir(results, output_dir, out_filenames, output_format)
+            return _respond({"output_dir": str(output_dir), "files_written": [str(p) for p in written], "count": len(results)}, timings, profile_id)
 
-    return jsonify(dict(zip(filenames, results)))
+        return _respond(dict(zip(filenames, results)), timings, profile_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,322 @@
+"""
+Offline batch annotation
+========================
+
+Command-line runner for corpus backfills that are too large for the HTTP API.
+It reuses the same ``method2pipeline`` pipelines as the Flask app, shards the
+input across N worker processes (each one loading its own pipeline once and
+keeping the models warm for its whole shard) and writes the serialized results
+to disk as it goes.
+
+Input
+-----
+* a directory of ``.txt`` files (one document per file), or
+* a ``.jsonl`` file with one object per line::
+
+      {"id": "note-001", "text": "...", "metadata": {"patient_id": "1"}}
+
+  ``id`` and ``metadata`` are optional; the line number is used as id.
+
+Ids name the output files and the checkpoint lines, so they must be made of
+letters, digits, spaces, ``_``, ``-`` and ``.``, start with a letter, digit or
+``_`` and be at most 200 characters long (this applies to the stems of
+``.txt`` files too). Documents with another id are logged and skipped.
+
+Output
+------
+* ``--output-format json``  → one ``<id>.json`` file per document (input
+  ``name.txt`` becomes ``name.json``, as in ``/annotate_dir``), indented unless
+  ``OUTPUT_COMPACT=1``. The files of a batch are written in the background
+  (see :mod:`app.serialization`) while the next batch is annotated.
+* ``--output-format jsonl`` → one ``part-<worker>.jsonl`` file per worker.
+
+Checkpointing
+-------------
+Each worker appends the ids it has finished to
+``<output_dir>/_checkpoint/worker-<n>.done`` once every file of a batch has
+been written. Re-running the same command skips every id found in any checkpoint
+file, so an interrupted backfill resumes where it stopped (delivery is
+at-least-once: a batch interrupted mid-write is reprocessed).
+
+Usage
+-----
+    python -m app.batch -i /data/notes -o /data/annotated \\
+        --lang es --method biencoder --entities disease symptoms --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("load", "read", "predict", "format", "write")
+CHECKPOINT_DIRNAME = "_checkpoint"
+# Ids are used as file names and checkpoint lines: no path separators, no
+# leading dot (".", ".." or a hidden file), no newline
+SAFE_ID = re.compile(r"[^\W][\w .-]{0,199}")
+
+
+def _configure_logging() -> None:
+    # Spawned workers do not inherit the parent's logging setup.
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s  %(levelname)-8s  %(message)s",
+        )
+
+
+# ---------------------------------------------------------------------------
+# Input sharding
+# ---------------------------------------------------------------------------
+
+def _iter_shard(input_path: Path, worker_id: int, n_workers: int) -> Iterator[tuple[str, str, dict]]:
+    """Yield ``(doc_id, text, metadata)`` for the documents owned by *worker_id*.
+
+    Documents are assigned round-robin by position, so every worker streams the
+    input independently and nothing has to be pickled across processes.
+    """
+    if input_path.is_dir():
+        for idx, pth in enumerate(sorted(input_path.glob("*.txt"))):
+            if idx % n_workers != worker_id:
+                continue
+            if not SAFE_ID.fullmatch(pth.stem):
+                logger.error("Skipping %s: unsafe file name for an id", pth)
+                continue
+            yield pth.stem, pth.read_text(encoding="utf-8"), {"source_file": str(pth)}
+        return
+
+    with open(input_path, "r", encoding="utf-8") as fh:
+        for line_no, line in enumerate(fh):
+            if line_no % n_workers != worker_id or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                text = record["text"]
+                if not isinstance(text, str):
+                    raise TypeError("'text' must be a string")
+                doc_id = str(record.get("id", line_no))
+                if not SAFE_ID.fullmatch(doc_id):
+                    raise ValueError(f"unsafe id {doc_id!r}: ids name output files (letters, digits, spaces, '_', '-', '.')")
+            except (ValueError, KeyError, TypeError) as exc:
+                logger.error("Skipping line %d of %s: %s", line_no + 1, input_path, exc)
+                continue
+            metadata = {**(record.get("metadata") or {}), "doc_id": doc_id}
+            yield doc_id, text, metadata
+
+
+def _load_checkpoint(output_dir: Path) -> set[str]:
+    """Return every doc id recorded as done by any worker of a previous run."""
+    done: set[str] = set()
+    for ckpt in (output_dir / CHECKPOINT_DIRNAME).glob("worker-*.done"):
+        done.update(line.rstrip("\n") for line in ckpt.open(encoding="utf-8") if line.strip())
+    return done
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+def _run_worker(worker_id: int, args: argparse.Namespace) -> dict:
+    """Annotate one shard. Returns ``{"docs": int, "skipped": int, <stage>: seconds}``."""
+    # Imported here so that the parent process does not pay for the models.
+    from app import _build_pipeline, cdm2formatter
+    from app.config import OUTPUT_COMPACT
+    from app.parallelism import configure_parallelism
+    from app.serialization import Serializer, dumps_lines, wait, write_files
+    from app.utils.chunk_cache import LOOKUPS
+
+    _configure_logging()
+    # Split the cores between the workers unless configured otherwise
+    cores = max(1, (os.cpu_count() or 1) // args.workers)
+    configure_parallelism(torch_threads=cores, rapidfuzz_workers=cores, tokenizers_parallelism=args.workers == 1)
+    stats: dict = defaultdict(float)
+    output_dir = Path(args.output_dir)
+
+    t0 = time.perf_counter()
+    pipeline = _build_pipeline(args.method, args.lang, args.entities, args.negation)
+    pipeline.load()
+    formatter = cdm2formatter["none"]()
+    stats["load"] = time.perf_counter() - t0
+    logger.info("[worker %d] pipeline ready in %.1fs", worker_id, stats["load"])
+
+    done = _load_checkpoint(output_dir)
+    ckpt_fh = open(output_dir / CHECKPOINT_DIRNAME / f"worker-{worker_id}.done", "a", encoding="utf-8")
+    part_fh = None
+    if args.output_format == "jsonl":
+        part_fh = open(output_dir / f"part-{worker_id:03d}.jsonl", "ab")
+        serializer = Serializer(compact=True)
+    else:
+        serializer = Serializer(compact=OUTPUT_COMPACT)
+    # Ids of the last batch and the futures of its files, still being written
+    pending: list[tuple[tuple[str, ...], list]] = []
+
+    def checkpoint() -> None:
+        # Only ids whose files are all on disk are recorded
+        if not pending:
+            return
+        ids, futures = pending.pop()
+        t = time.perf_counter()
+        wait(futures)
+        ckpt_fh.write("".join(f"{doc_id}\n" for doc_id in ids))
+        ckpt_fh.flush()
+        stats["write"] += time.perf_counter() - t
+
+    def flush(batch: list[tuple[str, str, dict]]) -> None:
+        ids, texts, metadatas = zip(*batch)
+
+        def serialize(where: slice, annotations: list[list[dict]]) -> list[dict]:
+            t = time.perf_counter()
+            results = [
+                formatter.serialize(text, ann, meta)
+                for text, ann, meta in zip(texts[where], annotations, metadatas[where])
+            ]
+            stats["format"] += time.perf_counter() - t
+            return results
+
+        t = time.perf_counter()
+        if hasattr(pipeline, "stream"):
+            # Formatting is the last stage of the stream: its time overlaps "predict"
+            results = [result for part in pipeline.stream(list(texts), finish=serialize) for result in part]
+            stats["predict"] += time.perf_counter() - t
+        else:
+            annotations = pipeline.predict(texts=list(texts))
+            stats["predict"] += time.perf_counter() - t
+            results = serialize(slice(None), annotations)
+
+        checkpoint()
+        t = time.perf_counter()
+        if part_fh is not None:
+            part_fh.write(dumps_lines(results, serializer))
+            part_fh.flush()
+            futures = []
+        else:
+            # Written in the background while the next batch is annotated
+            futures = write_files(results, output_dir, [f"{doc_id}.json" for doc_id in ids], serializer)
+        pending.append((ids, futures))
+        stats["write"] += time.perf_counter() - t
+        if not futures:
+            checkpoint()
+
+        stats["docs"] += len(batch)
+        elapsed = time.perf_counter() - t_start
+        logger.info("[worker %d] %d docs (%.1f docs/s)", worker_id, stats["docs"], stats["docs"] / elapsed)
+
+    try:
+        t_start = time.perf_counter()
+        batch: list[tuple[str, str, dict]] = []
+        t = time.perf_counter()
+        for doc in _iter_shard(Path(args.input), worker_id, args.workers):
+            if doc[0] in done:
+                stats["skipped"] += 1
+                continue
+            batch.append(doc)
+            if len(batch) == args.batch_size:
+                stats["read"] += time.perf_counter() - t
+                flush(batch)
+                batch = []
+                t = time.perf_counter()
+        stats["read"] += time.perf_counter() - t
+        if batch:
+            flush(batch)
+        checkpoint()
+    finally:
+        ckpt_fh.close()
+        if part_fh is not None:
+            part_fh.close()
+
+    for labels, count in LOOKUPS.snapshot().items():
+        stats["chunks"] += count
+        if dict(labels)["result"] != "miss":
+            stats["chunks_cached"] += count
+    return dict(stats)
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def _report(worker_stats: list[dict], wall: float) -> None:
+    """Print per-stage throughput. Stage times are summed over workers, so
+    docs/sec is the per-worker rate of that stage."""
+    docs = sum(s.get("docs", 0) for s in worker_stats)
+    skipped = sum(s.get("skipped", 0) for s in worker_stats)
+
+    print(f"\n{'stage':<10}{'seconds':>12}{'docs/sec':>12}")
+    for stage in STAGES:
+        secs = sum(s.get(stage, 0.0) for s in worker_stats)
+        rate = f"{docs / secs:.1f}" if secs > 0 and stage != "load" else "-"
+        print(f"{stage:<10}{secs:>12.2f}{rate:>12}")
+    chunks = sum(s.get("chunks", 0) for s in worker_stats)
+    if chunks:
+        cached = sum(s.get("chunks_cached", 0) for s in worker_stats)
+        print(f"\nNER chunk cache: {int(cached)} of {int(chunks)} chunks reused ({100 * cached / chunks:.1f}%)")
+    print(f"\n{int(docs)} docs annotated, {int(skipped)} skipped (checkpoint), "
+          f"{len(worker_stats)} worker(s), {wall:.1f}s wall, {docs / wall if wall else 0:.1f} docs/sec overall")
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description="Offline corpus annotation")
+    parser.add_argument("-i", "--input", required=True, help="Directory of .txt files or a .jsonl file")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory for results and checkpoints")
+    parser.add_argument("--lang", required=True, help="Language code (e.g. es)")
+    parser.add_argument("--method", required=True, help="Pipeline method, as in the API")
+    parser.add_argument("--entities", required=True, nargs="+", help="Entity types to detect")
+    parser.add_argument("--negation", action="store_true", help="Add negation/uncertainty attributes")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Documents per pipeline.predict call (default: 64)")
+    parser.add_argument("--output-format", choices=("json", "jsonl"), default="jsonl",
+                        help="One JSON file per document, or one JSONL file per worker (default: jsonl)")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    from app import _extract_pipeline_params
+
+    _, err = _extract_pipeline_params(vars(args))
+    if err:
+        parser.error(err)
+    if args.workers < 1 or args.batch_size < 1:
+        parser.error("--workers and --batch-size must be >= 1")
+
+    input_path = Path(args.input)
+    if not (input_path.is_dir() or input_path.is_file()):
+        parser.error(f"input does not exist: {input_path}")
+
+    output_dir = Path(args.output_dir)
+    (output_dir / CHECKPOINT_DIRNAME).mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    if args.workers == 1:
+        worker_stats = [_run_worker(0, args)]
+    else:
+        # spawn: each worker initialises its own torch/CUDA state and models
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = [pool.submit(_run_worker, worker_id, args) for worker_id in range(args.workers)]
+            worker_stats = [f.result() for f in futures]
+
+    _report(worker_stats, time.perf_counter() - t0)
+    return 0
+
+
+if __name__ == "__main__":
+    _configure_logging()
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Admission control and inference concurrency limits.
+
+Two independent limits protect a serving process under burst load:
+
+* :meth:`InferenceLimiter.inference` is a semaphore around the heavy
+  ``pipeline.predict`` calls, so at most ``max_concurrency`` of them run at
+  once (torch already parallelises each forward pass across cores; running
+  more in parallel only adds contention).
+* :meth:`InferenceLimiter.admit` bounds how many requests may be in the
+  system at all (running or waiting for a slot). Past
+  ``max_concurrency + max_queue`` a request is rejected immediately with
+  :class:`Overloaded`, which the API turns into ``503`` + ``Retry-After``, so
+  queueing delay — and tail latency — stays bounded. With unlimited
+  concurrency, ``max_queue`` alone bounds the requests in flight (and both
+  at 0 turn admission control off).
+
+Thread safety of the models themselves is handled where they are used: each
+NER model and NEL encoder serialises its own forward passes with a lock, and
+the lexical engines are read-only after construction.
+"""
+
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+
+from app.config import NER_VERSION
+from app.metrics import timed
+
+
+class Overloaded(Exception):
+    """Raised by :meth:`InferenceLimiter.admit` when the request queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server overloaded, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class InferenceLimiter:
+    """
+    Args:
+        max_concurrency: Concurrent ``predict`` calls allowed (0 = unlimited).
+        max_queue:       Admitted requests allowed to wait for a slot; with
+                         unlimited concurrency, requests admitted at once.
+        retry_after:     Seconds suggested to rejected clients.
+    """
+
+    def __init__(self, max_concurrency: int = 1, max_queue: int = 32, retry_after: int = 5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        # 0: admit everything
+        self._max_admitted = max(max_concurrency, 0) + max(max_queue, 0)
+        self._lock = threading.Lock()
+        self._admitted = 0
+
+    @contextmanager
+    def admit(self):
+        """Admit one request for its whole lifetime, or raise :class:`Overloaded`."""
+        with self._lock:
+            if self._max_admitted and self._admitted >= self._max_admitted:
+                raise Overloaded(self.retry_after)
+            self._admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    @contextmanager
+    def inference(self):
+        """Hold one of the ``max_concurrency`` inference slots."""
+        if self._semaphore is None:
+            yield
+            return
+        with timed("inference_wait"):
+            self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    @property
+    def admitted(self) -> int:
+        return self._admitted
+
+
+class LimitedPredictor:
+    """Wrap a pipeline so that every ``predict`` call takes an inference slot."""
+
+    def __init__(self, pipeline, limiter: InferenceLimiter):
+        self.pipeline = pipeline
+        self.limiter = limiter
+
+    def predict(self, texts: list[str]) -> list[list[dict]]:
+        with self.limiter.inference():
+            return self.pipeline.predict(texts=texts)
+
+    @property
+    def ner_version(self) -> int:
+        """NER backend of the wrapped pipeline (see :func:`app.incremental.predict_incremental`)."""
+        return getattr(self.pipeline, "ner_version", NER_VERSION)
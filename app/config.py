@@ -1,9 +1,105 @@
-import torch
+import json
+import os
 
-REGISTRY_PATH = "app/model_manager/toy_registry.yaml"
-RESOURCES_PATH = "app/resources"
+# Overridable so that tools (e.g. benchmarks/pipeline_bench.py) can point the
+# resolver at a self-contained registry of stand-in models.
+REGISTRY_PATH = os.environ.get("REGISTRY_PATH", "app/model_manager/toy_registry.yaml")
+RESOURCES_PATH = os.environ.get("RESOURCES_PATH", "app/resources")
+
+# NER backend used by the pipelines (see app/src/ner): 1, 2, or 3 for v2
+# through ONNX Runtime (needs the "onnx" extra; graphs are exported by
+# `python -m app.model_manager`).
+NER_VERSION = int(os.environ.get("NER_VERSION", 2))
+
+# Numeric precision of the NER (v2) and NEL encoders (see app/utils/precision.py):
+# "fp32", "int8" (dynamic quantization of linear layers, CPU only) or "bf16".
+NER_PRECISION = os.environ.get("NER_PRECISION", "fp32")
+NEL_PRECISION = os.environ.get("NEL_PRECISION", "fp32")
+
+# Token budget of one NER / NEL query-encoder batch (see
+# app/utils/token_batching.py): inputs of similar length are grouped until the
+# padded batch holds this many tokens. Halved on out-of-memory errors.
+NER_MAX_BATCH_TOKENS = int(os.environ.get("NER_MAX_BATCH_TOKENS", 8192))
+NEL_MAX_BATCH_TOKENS = int(os.environ.get("NEL_MAX_BATCH_TOKENS", 4096))
+
+# Cache of NER predictions per sentence chunk (see app/utils/chunk_cache.py):
+# NER_CHUNK_CACHE_SIZE entries in memory per process (0 disables it), and an
+# optional SQLite file under NER_CHUNK_CACHE_DIR shared by the processes of the
+# node, holding at most NER_CHUNK_CACHE_DISK_MAX_ENTRIES entries (0: unbounded).
+NER_CHUNK_CACHE_SIZE = int(os.environ.get("NER_CHUNK_CACHE_SIZE", 10000))
+NER_CHUNK_CACHE_DIR = os.environ.get("NER_CHUNK_CACHE_DIR", "")
+NER_CHUNK_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("NER_CHUNK_CACHE_DISK_MAX_ENTRIES", 1_000_000))
+
+# NER worker processes per pipeline (see app/src/ner/process_pool.py); 0 runs
+# NER in the calling process. NER_WORKER_THREADS is the torch thread count of
+# each worker (0: the process's thread budget divided by NER_WORKERS).
+NER_WORKERS = int(os.environ.get("NER_WORKERS", 0))
+NER_WORKER_THREADS = int(os.environ.get("NER_WORKER_THREADS", 0))
+
+# Streaming execution of the biencoder/cascade pipelines (see app/streaming.py):
+# requests of more than STREAM_BATCH_TEXTS texts flow through the NER, NEL and
+# negation stages concurrently, in mini-batches of that many texts, with at
+# most STREAM_MAX_QUEUE mini-batches waiting between two stages. 0 disables it.
+STREAM_BATCH_TEXTS = int(os.environ.get("STREAM_BATCH_TEXTS", 16))
+STREAM_MAX_QUEUE = int(os.environ.get("STREAM_MAX_QUEUE", 2))
+
+# Pipelines built and loaded before the production server forks its workers
+# (see app/wsgi.py). JSON list of request-like objects, e.g.
+# '[{"method": "biencoder", "lang": "es", "entities": ["disease"], "negation": false}]'
+PRELOAD_PIPELINES: list[dict] = json.loads(os.environ.get("PRELOAD_PIPELINES", "[]"))
+
+# Resident-memory budget for cached pipelines (see app/pipeline_cache.py).
+# Least-recently-used pipelines are unloaded beyond it; 0 means unbounded.
+PIPELINE_CACHE_MAX_RAM_MB = int(os.environ.get("PIPELINE_CACHE_MAX_RAM_MB", 0))
+PIPELINE_CACHE_MAX_VRAM_MB = int(os.environ.get("PIPELINE_CACHE_MAX_VRAM_MB", 0))
+
+# Whole-document result cache of the API (see app/result_cache.py): an SQLite
+# file under RESULT_CACHE_DIR (unset disables it) shared by the workers of the
+# node, holding at most RESULT_CACHE_MAX_ENTRIES documents (0: unbounded) for
+# RESULT_CACHE_TTL_S seconds each (0: no expiry).
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 100_000))
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", 7 * 24 * 3600))
+
+# Concurrency limits per serving process (see app/concurrency.py): at most
+# INFERENCE_MAX_CONCURRENCY pipeline.predict calls run at once (0 = unlimited)
+# and at most INFERENCE_MAX_QUEUE more requests wait; beyond that the API
+# answers 503 with Retry-After: INFERENCE_RETRY_AFTER_S. With unlimited
+# concurrency, INFERENCE_MAX_QUEUE caps the requests in flight; both at 0 turn
+# admission control off. A worker serves at most GUNICORN_THREADS requests at
+# once (see gunicorn.conf.py), so the queue defaults to the threads left over
+# by the running requests, less one kept free to answer the 503s.
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", 4))
+INFERENCE_MAX_CONCURRENCY = int(os.environ.get("INFERENCE_MAX_CONCURRENCY", 1))
+INFERENCE_MAX_QUEUE = int(os.environ.get(
+    "INFERENCE_MAX_QUEUE", max(GUNICORN_THREADS - INFERENCE_MAX_CONCURRENCY - 1, 0)
+))
+INFERENCE_RETRY_AFTER_S = int(os.environ.get("INFERENCE_RETRY_AFTER_S", 5))
+
+# Coalesce concurrent /annotate requests into shared pipeline.predict calls
+# (see app/microbatch.py). A max latency of 0 disables micro-batching.
+MICROBATCH_MAX_LATENCY_MS = float(os.environ.get("MICROBATCH_MAX_LATENCY_MS", 0))
+MICROBATCH_MAX_TEXTS = int(os.environ.get("MICROBATCH_MAX_TEXTS", 64))
+
+# On-demand request profiling (see app/profiling.py). Off unless enabled, since
+# profiles expose code paths and are written to PROFILE_DIR.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/nel-api-profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5))
+
+# Serialization of results (see app/serialization.py). JSON_LIBRARY is "auto"
+# (orjson when installed, else the standard library), "orjson" or "json".
+# OUTPUT_COMPACT=1 drops the indentation of the JSON files written to an
+# output_dir, which are encoded and written on OUTPUT_WRITER_THREADS threads
+# per process.
+JSON_LIBRARY = os.environ.get("JSON_LIBRARY", "auto")
+OUTPUT_COMPACT = os.environ.get("OUTPUT_COMPACT", "0") == "1"
+OUTPUT_WRITER_THREADS = int(os.environ.get("OUTPUT_WRITER_THREADS", 4))
 
 def get_device():
+    import torch
+
     if not torch.cuda.is_available():
         return "cpu"
 
@@ -27,4 +123,11 @@ def get_device():
         print(f"CUDA check failed: {e}. Falling back to CPU.")
         return "cpu"
     
-device = get_device()   
\ No newline at end of file
+def __getattr__(name: str):
+    # ``device`` is detected on first access (``from app.config import device``
+    # in the torch backends), so that importing the config does not import torch.
+    if name == "device":
+        global device
+        device = get_device()
+        return device
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,182 @@
+"""
+Incremental re-annotation of edited documents.
+
+When a note is edited, the client sends the new text with the previous result
+for it (``previous`` in ``/annotate``). Both texts are split into sentences
+the way the NER backends segment them (see
+:func:`app.utils.text_preprocessing.build_inference_chunks`), and the two
+sentence sequences are diffed:
+
+* a sentence found unchanged keeps its previous annotations, shifted to its
+  new position;
+* each run of consecutive new or edited sentences is annotated as a text of
+  its own, in one ``predict`` call for the whole request, and its annotations
+  are shifted to the run's position.
+
+Every stage of the pipelines works within a sentence: NER and negation tag
+each sentence chunk on its own, and linking depends only on the mention. The
+result is therefore the one a full run would give. Two cases could break
+that, and they are handled so that it still holds:
+
+* a previous annotation that crosses a sentence boundary: the sentences it
+  touches are re-annotated;
+* two same-class entities that end up touching, across the edge of a run or
+  between two unchanged sentences brought together by a deletion: NER would
+  have merged them into one (see :func:`merge_contiguous_entities`), so the
+  document is annotated in full instead.
+
+The v1 NER backend windows documents with spaCy rather than by these
+sentences, so the documents of a pipeline with ``ner_version=1`` are annotated
+in full.
+
+Sentences are counted in ``incremental_sentences_total{result=reused|annotated}``
+and full-document fallbacks in ``incremental_fallbacks_total``.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Optional
+
+from app.config import NER_VERSION
+from app.metrics import counter, timed
+
+SENTENCES = counter("incremental_sentences_total", "Sentences of edited documents whose annotations were reused or annotated again")
+FALLBACKS = counter("incremental_fallbacks_total", "Edited documents annotated in full because an entity may span an edit")
+
+
+@dataclass
+class EditPlan:
+    """What to reuse and what to annotate again in the new text of an edited document."""
+
+    # Previous annotations of the unchanged sentences, at their new offsets
+    reused: list[dict] = field(default_factory=list)
+    # (start, end) of the runs of new or edited sentences in the new text
+    runs: list[tuple[int, int]] = field(default_factory=list)
+
+
+def sentence_spans(text: str) -> list[tuple[int, int]]:
+    """``(start, end)`` of the sentences of *text*, as segmented by the NER backends."""
+    from app.utils.text_preprocessing import _split_sentences
+
+    return [(s["start"], s["end"]) for s in _split_sentences(text)]
+
+
+def plan_edit(old_text: str, old_annotations: list[dict], new_text: str) -> EditPlan:
+    """Diff *old_text* and *new_text* by sentence (see the module docstring)."""
+    old_spans = sentence_spans(old_text)
+    new_spans = sentence_spans(new_text)
+
+    # Assign each previous annotation to the sentence holding it; an annotation
+    # that is not inside one sentence pins the sentences it overlaps.
+    old_starts = [s for s, _ in old_spans]
+    by_sentence: dict[int, list[dict]] = {}
+    pinned: set[int] = set()
+    for ann in old_annotations:
+        i = bisect_right(old_starts, ann["start"]) - 1
+        if i >= 0 and ann["end"] <= old_spans[i][1]:
+            by_sentence.setdefault(i, []).append(ann)
+            continue
+        j = i
+        while j + 1 < len(old_spans) and old_spans[j + 1][0] < ann["end"]:
+            j += 1
+        pinned.update(range(max(i, 0), j + 1))
+
+    matcher = SequenceMatcher(
+        None, [old_text[s:e] for s, e in old_spans], [new_text[s:e] for s, e in new_spans], autojunk=False
+    )
+    old_of_new: dict[int, int] = {}
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            if a + k not in pinned:
+                old_of_new[b + k] = a + k
+
+    plan = EditPlan()
+    run_start = None
+    for j, (start, end) in enumerate(new_spans):
+        i = old_of_new.get(j)
+        if i is None:
+            if run_start is None:
+                run_start = start
+            run_end = end
+            continue
+        if run_start is not None:
+            plan.runs.append((run_start, run_end))
+            run_start = None
+        shift = start - old_spans[i][0]
+        plan.reused.extend({**ann, "start": ann["start"] + shift, "end": ann["end"] + shift} for ann in by_sentence.get(i, []))
+    if run_start is not None:
+        plan.runs.append((run_start, run_end))
+
+    SENTENCES.inc(len(old_of_new), result="reused")
+    SENTENCES.inc(len(new_spans) - len(old_of_new), result="annotated")
+    return plan
+
+
+def _may_have_merged(annotations: list[dict]) -> bool:
+    """
+    Whether two entities of *annotations* of the same class touch (at most one
+    character apart). A full run merges such entities, so its results never
+    hold any.
+    """
+    by_class: dict[Optional[str], list[tuple[int, int]]] = {}
+    for ann in annotations:
+        by_class.setdefault(ann.get("ner_class"), []).append((ann["start"], ann["end"]))
+    for spans in by_class.values():
+        spans.sort()
+        if any(0 <= b[0] - a[1] <= 1 for a, b in zip(spans, spans[1:])):
+            return True
+    return False
+
+
+def predict_incremental(predictor, texts: list[str], previous: list[Optional[dict]]) -> list[list[dict]]:
+    """
+    The annotations of *texts*, as ``predictor.predict`` would return them,
+    reusing the previous results of the documents that have one.
+
+    *previous* holds, per text, None or ``{"text": str, "annotations": list}``:
+    the previous text of the document and the annotations returned for it by
+    the same pipeline. Predictors that wrap a pipeline expose its
+    ``ner_version``; without one, the pipeline is taken to follow ``NER_VERSION``.
+    """
+    if getattr(predictor, "ner_version", NER_VERSION) == 1:
+        return predictor.predict(texts=texts)
+    with timed("incremental_diff"):
+        plans = [
+            plan_edit(prev["text"], prev["annotations"], text) if prev is not None else None
+            for text, prev in zip(texts, previous)
+        ]
+
+    # Whole documents without a previous result, and the edited runs of the others
+    pieces, owners = [], []
+    for i, (text, plan) in enumerate(zip(texts, plans)):
+        for start, end in plan.runs if plan is not None else [(0, len(text))]:
+            pieces.append(text[start:end])
+            owners.append((i, start))
+    outputs = predictor.predict(texts=pieces) if pieces else []
+
+    fresh: list[list[dict]] = [[] for _ in texts]
+    for (i, offset), annotations in zip(owners, outputs):
+        fresh[i].extend(
+            {**ann, "start": ann["start"] + offset, "end": ann["end"] + offset} if offset else ann
+            for ann in annotations
+        )
+
+    results, fallback = [], []
+    for i, plan in enumerate(plans):
+        if plan is None:
+            results.append(fresh[i])
+            continue
+        # Sentences do not overlap, so this is the order of a full run
+        annotations = sorted(plan.reused + fresh[i], key=lambda x: (x["start"], -x["end"]))
+        if _may_have_merged(annotations):
+            fallback.append(i)
+        results.append(annotations)
+
+    if fallback:
+        FALLBACKS.inc(len(fallback))
+        for i, annotations in zip(fallback, predictor.predict(texts=[texts[i] for i in fallback])):
+            results[i] = annotations
+    return results
@@ -0,0 +1,213 @@
+"""
+In-process metrics.
+
+Minimal, dependency-free counters, gauges and histograms that any module can
+record into. Metrics are created on first use and live in a process-wide
+registry; :func:`render_prometheus` exposes all of them in the Prometheus text
+format (served at ``GET /metrics``)::
+
+    from app.metrics import counter, histogram, timed
+
+    DOCS = counter("docs_total", "Documents annotated")
+    DOCS.inc(len(texts), method="biencoder")
+
+    with timed("ner_forward"):
+        ...
+
+Every metric is thread-safe; label values are passed as keyword arguments and
+each distinct label combination is tracked as its own series. Metrics are per
+process: behind a pre-forking server each worker reports its own.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+# Seconds; spans sub-millisecond lexical steps up to multi-minute batches.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: dict[tuple, dict] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][idx] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self) -> dict[tuple, dict]:
+        """Return a copy of every series: ``{labels: {"counts", "sum", "count"}}``."""
+        with self._lock:
+            return {key: {**s, "counts": list(s["counts"])} for key, s in self._series.items()}
+
+    def _render(self) -> list[str]:
+        lines = []
+        for key, s in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s["counts"]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {s['sum']}")
+            lines.append(f"{self.name}_count{_labels(key)} {s['count']}")
+        return lines
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def snapshot(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._series)
+
+    def _render(self) -> list[str]:
+        return [f"{self.name}{_labels(key)} {value}" for key, value in sorted(self.snapshot().items())]
+
+
+class Gauge:
+    """Point-in-time value read from *fn* at render time."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def _render(self) -> list[str]:
+        return [f"{self.name} {self.fn()}"]
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in key) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_registry: dict[str, Histogram | Counter | Gauge] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """Return the histogram registered under *name*, creating it on first use."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, help, buckets)
+        return _registry[name]
+
+
+def counter(name: str, help: str) -> Counter:
+    """Return the counter registered under *name*, creating it on first use."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Counter(name, help)
+        return _registry[name]
+
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> Gauge:
+    """Register (or replace) a gauge whose value is ``fn()`` at scrape time."""
+    with _registry_lock:
+        _registry[name] = Gauge(name, help, fn)
+        return _registry[name]
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in sorted(metrics, key=lambda m: m.name):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric._render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Stage timing
+# ---------------------------------------------------------------------------
+
+STAGE_SECONDS = histogram("stage_duration_seconds", "Wall time spent in each pipeline stage")
+
+# Per-request breakdown, active only inside collect_timings().
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+# Thread id -> currently open stages, kept only for threads sampled by app.profiling.
+stage_stacks: dict[int, list[str]] = {}
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as *stage*: always into :data:`STAGE_SECONDS`,
+    and into the current request's breakdown when one is being collected."""
+    stack = stage_stacks.get(threading.get_ident()) if stage_stacks else None
+    if stack is not None:
+        stack.append(stage)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        if stack is not None:
+            stack.pop()
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def add_timings(timings: dict[str, float]) -> None:
+    """Add stages timed elsewhere (e.g. on a worker thread) to the current
+    request's breakdown, without observing them a second time."""
+    current = _request_timings.get()
+    if current is not None:
+        for stage, elapsed in timings.items():
+            current[stage] = current.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect_timings():
+    """Collect the stages timed in this thread/context into the yielded dict."""
+    timings: dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
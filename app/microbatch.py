@@ -0,0 +1,180 @@
+"""
+Request coalescing in front of an annotation pipeline.
+
+Each ``/annotate`` call used to run ``pipeline.predict`` on its own texts, so
+concurrent small requests each paid for a tiny model batch. A
+:class:`MicroBatcher` owns one pipeline and a background thread: callers
+submit their texts and block on a future, while the thread gathers the texts
+of every request that arrives within ``max_latency_ms`` of the first one (or
+until ``max_batch_texts`` is reached), runs a single ``predict`` over all of
+them and hands each caller back its own slice of the results. If that call
+fails, each request of the batch is run again on its own, so that one bad
+request does not fail the others coalesced with it.
+
+Coalescing only happens between requests served by the same process, so it
+needs a threaded server (e.g. ``GUNICORN_THREADS > 1``).
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.config import NER_VERSION
+from app.metrics import add_timings, collect_timings, histogram
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = histogram(
+    "microbatch_request_latency_seconds",
+    "Time from submit to result for one request, including queueing",
+)
+QUEUE_WAIT = histogram(
+    "microbatch_queue_wait_seconds",
+    "Time a request waited for its batch to start",
+)
+BATCH_TEXTS = histogram(
+    "microbatch_batch_texts",
+    "Number of texts per coalesced pipeline.predict call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class _Pending:
+    __slots__ = ("texts", "future", "submitted", "timings")
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.submitted = time.perf_counter()
+        # Stages timed while running the batch this request was part of
+        self.timings: dict[str, float] = {}
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent ``predict`` calls on one pipeline into batched calls.
+
+    Args:
+        pipeline:        Any :class:`~app.src.pipelines.AnnotationPipeline`.
+        max_latency_ms:  How long the first request of a batch may wait for
+                         others to join it.
+        max_batch_texts: Upper bound on texts per batch. A single request
+                         larger than this is run as its own batch, never split.
+        name:            Label used in logs and metrics.
+    """
+
+    def __init__(self, pipeline, max_latency_ms: float = 5.0, max_batch_texts: int = 64, name: str = ""):
+        self.pipeline = pipeline
+        self.max_latency = max_latency_ms / 1000
+        self.max_batch_texts = max_batch_texts
+        self.name = name
+
+        self._queue: queue.Queue[_Pending] = queue.Queue()
+        # A request that did not fit in the previous batch opens the next one.
+        self._carry: _Pending | None = None
+        # Started on first use: threads do not survive the pre-fork warm-up.
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+
+    def predict(self, texts: list[str]) -> list[list[dict]]:
+        """Blocking drop-in replacement for ``pipeline.predict``."""
+        pending = _Pending(texts)
+        with self._thread_lock:
+            if self._closed:
+                return self.pipeline.predict(texts=texts)
+            self._ensure_thread()
+            self._queue.put(pending)
+        try:
+            return pending.future.result()
+        finally:
+            add_timings(pending.timings)
+            REQUEST_LATENCY.observe(time.perf_counter() - pending.submitted, pipeline=self.name)
+
+    @property
+    def ner_version(self) -> int:
+        """NER backend of the wrapped pipeline (see :func:`app.incremental.predict_incremental`)."""
+        return getattr(self.pipeline, "ner_version", NER_VERSION)
+
+    def close(self) -> None:
+        """Serve what is already queued, then stop the thread. Later calls run unbatched."""
+        with self._thread_lock:
+            self._closed = True
+            self._queue.put(None)  # every pending request was queued before this
+
+    def _ensure_thread(self) -> None:
+        # Caller holds _thread_lock.
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name=f"microbatch-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _collect(self) -> list[_Pending] | None:
+        """Block for the first request, then gather others until the deadline or size cap.
+        Returns None once the batcher is closed and drained."""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        batch, n_texts = [first], len(first.texts)
+        deadline = first.submitted + self.max_latency
+
+        while n_texts < self.max_batch_texts:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                nxt = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            if n_texts + len(nxt.texts) > self.max_batch_texts:
+                self._carry = nxt
+                break
+            batch.append(nxt)
+            n_texts += len(nxt.texts)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            texts = [text for pending in batch for text in pending.texts]
+            for pending in batch:
+                QUEUE_WAIT.observe(started - pending.submitted, pipeline=self.name)
+            BATCH_TEXTS.observe(len(texts), pipeline=self.name)
+
+            if self._run(batch, texts):
+                continue
+            # Find out which request failed it: only that one gets the error
+            logger.warning("Batched predict failed on %s, retrying its %d requests one by one", self.name, len(batch))
+            for pending in batch:
+                self._run([pending], pending.texts)
+
+    def _run(self, batch: list[_Pending], texts: list[str]) -> bool:
+        """Predict *texts* (those of *batch*) and resolve the futures of *batch*.
+        Returns False, leaving a multi-request batch unresolved, if predict raised."""
+        try:
+            with collect_timings() as timings:
+                annotations = self.pipeline.predict(texts=texts)
+        except Exception as exc:
+            if len(batch) > 1:
+                return False
+            logger.exception("Predict failed for a request on %s", self.name)
+            batch[0].future.set_exception(exc)
+            return True
+
+        offset = 0
+        for pending in batch:
+            pending.timings = timings
+            n = len(pending.texts)
+            pending.future.set_result(annotations[offset:offset + n])
+            offset += n
+        return True
@@ -15,12 +15,19 @@ Download rules (mirrors registry schema):
     ner / nel      – download when repo_id is set AND local_path is absent
     vectorized_dbs – build when the registry value is null
 
+Shared resources are fetched once: entries with the same ``repo_id`` reuse one
+download, and a vector DB whose NEL model and gazetteer have the same content
+(see :mod:`app.utils.fingerprint`) as an already-built one reuses its file.
+
 Usage
 -----
     from app.model_manager import ModelManager
 
     manager = ModelManager(device="cuda")
     manager.sanitize()          # safe to call at every startup; no-ops when all resources are present
+
+With ``NER_VERSION=3``, ``sanitize`` also exports every NER checkpoint to an
+optimized ONNX graph in ``<checkpoint>/onnx/``.
 """
 
 from __future__ import annotations
@@ -29,7 +36,9 @@ import logging
 from pathlib import Path
 from typing import TypedDict
 
-from .downloader import ResourceDownloader
+from app.config import NER_VERSION
+from app.utils.fingerprint import file_fingerprint, model_fingerprint
+
 from .resolver import LocalResolver
 
 __all__ = ["ModelManager"]
@@ -61,6 +70,10 @@ class ModelManager:
     """
 
     def __init__(self) -> None:
+        # The downloader imports torch, sentence-transformers and pandas: only
+        # setup needs it, not the serving code that imports the resolver.
+        from .downloader import ResourceDownloader
+
         self.resolver = LocalResolver()
         self.downloader = ResourceDownloader()
 
@@ -204,10 +217,14 @@ class ModelManager:
 
         if not pending:
             logger.info("All resources are already present — nothing to do.")
+            self.export_ner_graphs()
             return
 
         logger.info("Found %d resource(s) to process.", len(pending))
         errors: list[str] = []
+        # repo_id -> local path, and (NEL model, gazetteer) fingerprints -> vector DB path
+        downloaded: dict[str, str] = {}
+        vector_dbs = self._built_vector_dbs()
 
         for item in pending:
             label = self._label(item)
@@ -230,15 +247,26 @@ class ModelManager:
 
                 elif resource_type in ("ner", "nel"):
                     assert repo_id
-                    validated_path = self.downloader.download_hf(local_path, repo_id)
+                    if repo_id in downloaded:
+                        logger.info("[%s]  %r already downloaded — reusing %s", label, repo_id, downloaded[repo_id])
+                        validated_path = downloaded[repo_id]
+                    else:
+                        validated_path = self.downloader.download_hf(local_path, repo_id)
+                        downloaded[repo_id] = validated_path
 
                 elif resource_type == "vectorized_dbs":
                     assert item["task"]
                     gaz_path = self.resolver.get_gaz_path(item["lang"], item["task"])
                     nel_path, _ = self.resolver.get_nel_path(item["lang"])
-                    validated_path = self.downloader.build_vector_db(
-                        gaz_path, nel_path, local_path
-                    )
+                    key = (model_fingerprint(nel_path), file_fingerprint(gaz_path))
+                    if key in vector_dbs:
+                        logger.info("[%s]  same NEL model and gazetteer as %s — reusing it", label, vector_dbs[key])
+                        validated_path = vector_dbs[key]
+                    else:
+                        validated_path = self.downloader.build_vector_db(
+                            gaz_path, nel_path, local_path
+                        )
+                        vector_dbs[key] = validated_path
 
             except Exception:
                 logger.exception("Failed to process [%s] — skipping.", label)
@@ -261,11 +289,52 @@ class ModelManager:
             )
         else:
             logger.info("sanitize() complete — all resources ready.")
+        self.export_ner_graphs()
+
+    def export_ner_graphs(self) -> None:
+        """
+        With ``NER_VERSION=3``, export every local NER checkpoint to an
+        optimized ONNX graph next to it (see
+        :func:`app.src.ner.encoder_inference_v3.export_onnx`). Up-to-date
+        exports are skipped; failures are logged and skipped.
+        """
+        if NER_VERSION != 3:
+            return
+        from app.src.ner import export_onnx
+
+        for lang, tasks in (self.resolver.registry.get("ner") or {}).items():
+            for task in (tasks or {}):
+                label = f"ner/{lang}/{task}"
+                try:
+                    local_path, _ = self.resolver.get_ner_path(lang, task)
+                    export_onnx(local_path)
+                except Exception:
+                    logger.exception("Failed to export [%s] to ONNX — skipping.", label)
+                    continue
+                logger.info("[%s]  ✓ ONNX graph ready", label)
 
     # ------------------------------------------------------------------
     # Helpers
     # ------------------------------------------------------------------
 
+    def _built_vector_dbs(self) -> dict[tuple[str, str], str]:
+        """``(NEL model fingerprint, gazetteer fingerprint) -> path`` of the vector DBs already built."""
+        built: dict[tuple[str, str], str] = {}
+        for lang, tasks in (self.resolver.registry.get("vectorized_dbs") or {}).items():
+            for task, pth in (tasks or {}).items():
+                if pth is None:
+                    continue
+                try:
+                    nel_path, repo_id = self.resolver.get_nel_path(lang)
+                    if repo_id is not None or not Path(pth).exists():
+                        continue  # NEL model not downloaded yet
+                    key = (model_fingerprint(nel_path), file_fingerprint(self.resolver.get_gaz_path(lang, task)))
+                except Exception:
+                    logger.debug("Cannot fingerprint vectorized_dbs/%s/%s — skipping.", lang, task, exc_info=True)
+                    continue
+                built.setdefault(key, str(pth))
+        return built
+
     @staticmethod
     def _label(item: PendingResource) -> str:
         parts = [item["resource"], item["lang"]]
@@ -114,7 +114,10 @@ class LocalResolver:
         """
         Returns ``(local_path, repo_id_or_None)``.
 
-        Semantics mirror ``get_ner_path``.
+        Semantics mirror ``get_ner_path``, except that the download target is
+        per repo, not per language: languages that register the same
+        ``repo_id`` share one download. A model already downloaded to the
+        former per-language target is still used.
         """
         try:
             cfg = self.registry["nel"][lang]
@@ -129,13 +132,10 @@ class LocalResolver:
                 raise ModelNotFoundError(
                     f"No repo_id provided for NEL model {lang!r}."
                 )
-            local_path = (
-                self.base_pth
-                / "local_models"
-                / "nel_models"
-                / lang
-                / repo_id.split("/")[-1]
-            )
+            legacy_path = self.base_pth / "local_models" / "nel_models" / lang / repo_id.split("/")[-1]
+            if legacy_path.exists():
+                return legacy_path, repo_id
+            local_path = self.base_pth / "local_models" / "nel_models" / repo_id.replace("/", "--")
             logger.info(
                 "NEL model %r not yet downloaded — target: %s", lang, local_path
             )
@@ -0,0 +1,184 @@
+"""
+Per-process CPU parallelism.
+
+Several serving or batch workers on one node each default to one torch thread
+per core, so together they oversubscribe the CPU. :func:`configure_parallelism`
+sets, for the calling process:
+
+* ``torch_threads``: torch intra-op threads (``torch.set_num_threads``);
+* ``torch_interop_threads``: torch inter-op threads. Only settable before the
+  first inter-op parallel work; later attempts are logged and ignored;
+* ``tokenizers_parallelism``: the Rust thread pool of the Hugging Face fast
+  tokenizers (``TOKENIZERS_PARALLELISM``);
+* ``rapidfuzz_workers``: threads used by the fuzzy-matching methods
+  (``rapidfuzz.process.cdist``).
+
+Each value is taken from the environment variable of :data:`ENV_VARS`, else
+from the ``runtime`` section of the registry YAML, else from the caller's
+default (e.g. ``cores / workers`` in ``gunicorn.conf.py``). Unset values keep
+the library default. The torch settings wait until torch is imported (see
+:func:`apply_torch_parallelism`), so that configuring a process that serves no
+torch model does not import it. The values are logged and exported as gauges
+at ``GET /metrics``::
+
+    runtime:
+      torch_threads: 4
+      torch_interop_threads: 1
+      tokenizers_parallelism: false
+      rapidfuzz_workers: 4
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+
+import yaml
+
+from app.config import REGISTRY_PATH
+from app.metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+ENV_VARS = {
+    "torch_threads": "TORCH_NUM_THREADS",
+    "torch_interop_threads": "TORCH_INTEROP_THREADS",
+    "tokenizers_parallelism": "TOKENIZERS_PARALLELISM",
+    "rapidfuzz_workers": "RAPIDFUZZ_WORKERS",
+}
+
+_rapidfuzz_workers = 1
+# torch settings not applied yet because torch was not imported
+_pending_torch: dict = {}
+
+
+def _registry_runtime() -> dict:
+    # Read directly: a missing registry is not an error here (e.g. validation-only runs)
+    try:
+        with open(REGISTRY_PATH, "r", encoding="utf-8") as fh:
+            return (yaml.safe_load(fh) or {}).get("runtime") or {}
+    except (OSError, yaml.YAMLError):
+        return {}
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def resolve_parallelism(**defaults) -> dict:
+    """The settings :func:`configure_parallelism` would apply, ``None`` where unset."""
+    unknown = set(defaults) - set(ENV_VARS)
+    if unknown:
+        raise ValueError(f"Unknown parallelism settings {sorted(unknown)}. Expected some of {list(ENV_VARS)}.")
+    runtime = _registry_runtime()
+    settings = {}
+    for key, env_var in ENV_VARS.items():
+        value = os.environ.get(env_var, runtime.get(key, defaults.get(key)))
+        if value is None:
+            settings[key] = None
+        elif key == "tokenizers_parallelism":
+            settings[key] = _as_bool(value)
+        else:
+            settings[key] = max(1, int(value))
+    return settings
+
+
+def configure_parallelism(**defaults) -> dict:
+    """
+    Apply the parallelism settings (see module docstring) to this process.
+    *defaults* are used for the settings neither the environment nor the
+    registry defines.
+
+    Returns:
+        The values in effect afterwards, as :func:`current_parallelism`.
+    """
+    global _rapidfuzz_workers
+
+    settings = resolve_parallelism(**defaults)
+    _pending_torch.update({
+        key: settings[key] for key in ("torch_threads", "torch_interop_threads") if settings[key] is not None
+    })
+    apply_torch_parallelism()
+    if settings["tokenizers_parallelism"] is not None:
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if settings["tokenizers_parallelism"] else "false"
+    if settings["rapidfuzz_workers"] is not None:
+        _rapidfuzz_workers = settings["rapidfuzz_workers"]
+
+    report = current_parallelism()
+    logger.info(
+        "Process %d: torch intra-op threads %s, inter-op threads %s, tokenizers parallelism %s, %d rapidfuzz worker(s)",
+        os.getpid(), _describe(report["torch_threads"]), _describe(report["torch_interop_threads"]),
+        _describe(report["tokenizers_parallelism"]), report["rapidfuzz_workers"],
+    )
+    return report
+
+
+def apply_torch_parallelism() -> None:
+    """
+    Apply the pending torch settings if torch has been imported. Called by
+    :func:`configure_parallelism` and by the torch model loaders, so the
+    settings are in place before the first forward pass.
+    """
+    if not _pending_torch or "torch" not in sys.modules:
+        return
+    import torch
+
+    if "torch_threads" in _pending_torch:
+        torch.set_num_threads(_pending_torch["torch_threads"])
+    interop = _pending_torch.get("torch_interop_threads")
+    if interop is not None and interop != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError as exc:
+            logger.warning("Cannot set %d torch inter-op threads in this process: %s", interop, exc)
+    _pending_torch.clear()
+
+
+def current_parallelism() -> dict:
+    """
+    The parallelism settings of this process. Before torch is imported, the
+    torch values are the pending ones (``None`` for torch's default).
+    """
+    tokenizers = os.environ.get("TOKENIZERS_PARALLELISM")
+    report = {
+        "torch_threads": _pending_torch.get("torch_threads"),
+        "torch_interop_threads": _pending_torch.get("torch_interop_threads"),
+        "tokenizers_parallelism": None if tokenizers is None else _as_bool(tokenizers),
+        "rapidfuzz_workers": _rapidfuzz_workers,
+    }
+    if "torch" in sys.modules:
+        import torch
+
+        report["torch_threads"] = torch.get_num_threads()
+        report["torch_interop_threads"] = torch.get_num_interop_threads()
+    return report
+
+
+def _describe(value) -> str:
+    if value is None:
+        return "default"
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def rapidfuzz_workers() -> int:
+    """Threads for ``rapidfuzz.process.cdist`` in this process."""
+    return _rapidfuzz_workers
+
+
+gauge(
+    "process_torch_threads", "torch intra-op threads of this process (until torch is loaded: the setting, 0 if none)",
+    lambda: current_parallelism()["torch_threads"] or 0,
+)
+gauge(
+    "process_torch_interop_threads", "torch inter-op threads of this process (until torch is loaded: the setting, 0 if none)",
+    lambda: current_parallelism()["torch_interop_threads"] or 0,
+)
+gauge("process_rapidfuzz_workers", "rapidfuzz threads of this process", rapidfuzz_workers)
+gauge(
+    "process_tokenizers_parallelism",
+    "1 if the Hugging Face tokenizers may use their thread pool in this process (the default), else 0",
+    lambda: int(_as_bool(os.environ.get("TOKENIZERS_PARALLELISM", "true"))),
+)
@@ -0,0 +1,154 @@
+"""
+Bounded, memory-aware cache of annotation pipelines.
+
+One pipeline is built per ``(method, lang, entities, negation)`` combination.
+Their models live in the shared :data:`~app.src.model_store.model_store`, so
+overlapping pipelines share them, and the cache bounds the *resident* total:
+after a pipeline is loaded, the least-recently-used pipelines are unloaded
+until the store fits within the configured RAM/VRAM budget again. A budget of
+0 means unbounded.
+
+A pipeline is built and loaded outside the cache lock, so a cold load (which
+may take minutes) does not hold up requests for other pipelines. Concurrent
+misses on the same key wait for that one load instead of starting their own.
+
+An evicted pipeline that is still serving a request keeps working: its
+resources are only freed once the last reference to it is dropped. It is
+retired, though (see :meth:`AnnotationPipeline.unload`): it never loads its
+resources again, so later requests get a new pipeline from the cache and the
+budget accounts for it.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+
+from app.metrics import counter
+from app.src.model_store import model_store
+
+logger = logging.getLogger(__name__)
+
+HITS = counter("pipeline_cache_hits_total", "Requests served by an already-loaded pipeline")
+MISSES = counter("pipeline_cache_misses_total", "Requests that had to build and load their pipeline")
+EVICTIONS = counter("pipeline_cache_evictions_total", "Pipelines unloaded from the cache")
+
+
+class PipelineCache:
+    """
+    LRU cache of loaded pipelines, evicting under a memory budget.
+
+    Args:
+        max_ram_bytes:  Budget for the resident RAM of all models (0 = unbounded).
+        max_vram_bytes: Budget for the resident VRAM of all models (0 = unbounded).
+        on_evict:       Called with ``(key, pipeline)`` after a pipeline is evicted.
+    """
+
+    def __init__(self, max_ram_bytes: int = 0, max_vram_bytes: int = 0, on_evict: Callable | None = None):
+        self.max_ram_bytes = max_ram_bytes
+        self.max_vram_bytes = max_vram_bytes
+        self.on_evict = on_evict
+
+        self._pipelines: OrderedDict[tuple, object] = OrderedDict()
+        self._stats: dict[tuple, dict] = {}
+        # Keys being built and loaded, resolved once the pipeline is cached
+        self._loading: dict[tuple, Future] = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: tuple, factory: Callable[[], object]):
+        """Return the loaded pipeline for *key*, building and loading it with *factory* on a miss."""
+        while True:
+            with self._lock:
+                pipeline = self._pipelines.get(key)
+                if pipeline is not None:
+                    self._pipelines.move_to_end(key)
+                    self._stats[key]["hits"] += 1
+                    HITS.inc()
+                    self._stats[key]["last_used"] = time.time()
+                    return pipeline
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = Future()
+                    break
+            # Another request is loading it: wait (re-raising its error), then take it from the cache
+            loading.result()
+
+        MISSES.inc()
+        try:
+            pipeline = factory()
+            pipeline.load()
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(exc)
+            raise
+        with self._lock:
+            self._pipelines[key] = pipeline
+            self._stats[key] = {"hits": 0, "created": time.time(), "last_used": time.time()}
+            del self._loading[key]
+            self._enforce_budget(keep=key)
+        loading.set_result(pipeline)
+        return pipeline
+
+    def _over_budget(self) -> bool:
+        ram, vram = model_store.nbytes()
+        return (
+            (self.max_ram_bytes > 0 and ram > self.max_ram_bytes)
+            or (self.max_vram_bytes > 0 and vram > self.max_vram_bytes)
+        )
+
+    def _enforce_budget(self, keep: tuple) -> None:
+        # Unloading only drops references: this is quick, so it runs under the lock
+        with self._lock:
+            while self._over_budget():
+                victim = next((k for k in self._pipelines if k != keep), None)
+                if victim is None:
+                    ram, vram = model_store.nbytes()
+                    logger.warning(
+                        "Pipeline %s alone exceeds the cache budget (%.0f MB RAM, %.0f MB VRAM resident).",
+                        keep, ram / 2**20, vram / 2**20,
+                    )
+                    return
+                self.evict(victim)
+
+    def evict(self, key: tuple) -> bool:
+        """Unload and forget the pipeline under *key*. Returns False if it was not cached."""
+        with self._lock:
+            pipeline = self._pipelines.pop(key, None)
+            if pipeline is None:
+                return False
+            del self._stats[key]
+            pipeline.unload()
+            EVICTIONS.inc()
+            logger.info("Evicted pipeline %s", key)
+        if self.on_evict is not None:
+            self.on_evict(key, pipeline)
+        return True
+
+    def describe(self) -> dict:
+        """JSON-serialisable view of the cache, most recently used pipeline last."""
+        with self._lock:
+            ram, vram = model_store.nbytes()
+            pipelines = []
+            for key, pipeline in self._pipelines.items():
+                p_ram, p_vram = pipeline.memory()
+                method, lang, entities, negation = key
+                pipelines.append({
+                    "method": method,
+                    "lang": lang,
+                    "entities": sorted(entities),
+                    "negation": negation,
+                    "ram_bytes": p_ram,
+                    "vram_bytes": p_vram,
+                    **self._stats[key],
+                })
+            return {
+                "budget": {"max_ram_bytes": self.max_ram_bytes, "max_vram_bytes": self.max_vram_bytes},
+                "resident": {"ram_bytes": ram, "vram_bytes": vram},
+                "pipelines": pipelines,
+                "resources": model_store.describe(),
+            }
@@ -0,0 +1,173 @@
+"""
+On-demand profiling of single requests.
+
+With ``PROFILING_ENABLED=1``, an ``/annotate`` or ``/annotate_dir`` request
+carrying ``"profile": "cprofile"`` (or ``true``) or ``"profile": "sample"`` runs
+its pipeline call under a profiler, and the response carries an
+``X-Profile-Id`` header. The profile is stored under ``PROFILE_DIR`` and can be
+fetched from ``/admin/profiles/<id>``:
+
+* ``cprofile`` — deterministic; stores a ``.pstats`` file (``snakeviz``,
+  ``python -m pstats``) and a summary of the most expensive functions.
+* ``sample``   — a background thread samples the request thread's stack
+  every ``PROFILE_SAMPLE_INTERVAL_MS``; stores collapsed stacks
+  (``flamegraph.pl``, speedscope) rooted at the pipeline stage they were
+  taken in (``[ner];[ner_forward];...``).
+
+Both kinds also record the wall time of every stage (see :func:`app.metrics.timed`).
+Requests without the flag never touch this module.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable
+
+from app.metrics import collect_timings, stage_stacks
+
+MODES = ("cprofile", "sample")
+
+
+def _frame_label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{Path(code.co_filename).stem}.{name}"
+
+
+class _Sampler(threading.Thread):
+    """Samples the stack of thread *ident* every *interval* seconds."""
+
+    def __init__(self, ident: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.target = ident
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stages = [f"[{s}]" for s in stage_stacks.get(self.target, ())]
+            self.stacks[";".join(stages + frames[::-1])] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileStore:
+    """
+    Keeps the last ``keep`` profiles on disk.
+
+    Args:
+        directory: Where profiles are written (created on first use).
+        keep:      Number of profiles retained; older ones are deleted.
+    """
+
+    def __init__(self, directory: str | Path, keep: int = 20):
+        self.directory = Path(directory)
+        self.keep = keep
+        self._lock = threading.Lock()
+        # cProfile cannot run two profilers at once on Python >= 3.12
+        self._cprofile_lock = threading.Lock()
+
+    def profile(self, fn: Callable[[], Any], mode: str, sample_interval: float = 0.005) -> tuple[Any, str]:
+        """Call *fn* under the *mode* profiler. Returns ``(fn(), profile_id)``."""
+        profile_id = uuid.uuid4().hex
+        started = time.time()
+        with collect_timings() as stages:
+            if mode == "cprofile":
+                with self._cprofile_lock:
+                    profiler = cProfile.Profile()
+                    result = profiler.runcall(fn)
+            else:
+                ident = threading.get_ident()
+                stage_stacks[ident] = []
+                sampler = _Sampler(ident, sample_interval)
+                sampler.start()
+                try:
+                    result = fn()
+                finally:
+                    sampler.stop()
+                    stage_stacks.pop(ident, None)
+
+        summary = {
+            "id": profile_id,
+            "mode": mode,
+            "created": started,
+            "wall_s": round(time.time() - started, 4),
+            "stages_s": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if mode == "cprofile":
+            profiler.dump_stats(self.directory / f"{profile_id}.pstats")
+            summary["top_functions"] = _top_functions(profiler)
+        else:
+            (self.directory / f"{profile_id}.collapsed").write_text(
+                "".join(f"{stack} {n}\n" for stack, n in sampler.stacks.most_common()), encoding="utf-8"
+            )
+            summary["samples"] = sum(sampler.stacks.values())
+            summary["samples_by_stage"] = _samples_by_stage(sampler.stacks)
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        self._prune()
+        return result, profile_id
+
+    def _prune(self) -> None:
+        with self._lock:
+            summaries = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            for old in summaries[:-self.keep] if self.keep > 0 else []:
+                for path in self.directory.glob(f"{old.stem}.*"):
+                    path.unlink(missing_ok=True)
+
+    def describe(self) -> list[dict]:
+        """Summaries of the stored profiles, newest first (without their function tables)."""
+        if not self.directory.is_dir():
+            return []
+        summaries = [json.loads(p.read_text(encoding="utf-8")) for p in self.directory.glob("*.json")]
+        return sorted(
+            ({k: v for k, v in s.items() if k not in ("top_functions", "samples_by_stage")} for s in summaries),
+            key=lambda s: s["created"], reverse=True,
+        )
+
+    def path(self, profile_id: str, kind: str) -> Path | None:
+        """File of one stored profile: ``kind`` is ``json``, ``pstats`` or ``collapsed``."""
+        if not profile_id.isalnum():
+            return None
+        path = self.directory / f"{profile_id}.{kind}"
+        return path if path.is_file() else None
+
+
+def _top_functions(profiler: cProfile.Profile, limit: int = 30) -> list[dict]:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{Path(filename).stem}.{name}:{line}",
+            "ncalls": nc,
+            "tottime_s": round(tt, 4),
+            "cumtime_s": round(ct, 4),
+        }
+        for (filename, line, name), (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def _samples_by_stage(stacks: Counter) -> dict[str, int]:
+    """Samples per innermost stage ("-" for samples outside any stage)."""
+    counts: Counter[str] = Counter()
+    for stack, n in stacks.items():
+        stages = [frame[1:-1] for frame in stack.split(";") if frame.startswith("[")]
+        counts[stages[-1] if stages else "-"] += n
+    return dict(counts.most_common())
@@ -0,0 +1,149 @@
+"""
+Whole-document result cache in front of the pipelines.
+
+Upstream systems resend unchanged documents on every sync. With
+``RESULT_CACHE_DIR`` set, the annotations of every document served are kept in
+an SQLite file (see :class:`app.utils.disk_store.DiskStore`), keyed by a hash
+of the text and of everything that determines its annotations:
+
+* the request's ``method``, ``lang``, ``entities`` and ``negation``;
+* the content fingerprints of the registry resources for that language and
+  those entities (NER, negation and NEL models, gazetteers, vector DBs), so
+  that updating a model invalidates its results;
+* the settings that change the output (``NER_VERSION`` and the precisions),
+  and :data:`SCHEMA`.
+
+A :class:`CachedPredictor` stands in for the predictor of a request: documents
+found in the cache never reach the pipeline (which is not even built or loaded
+when they all are), nor take an inference slot. Only the others are annotated,
+and then stored. Only the annotation lists are stored: formatting and metadata
+are applied per request as usual.
+
+Entries expire after ``RESULT_CACHE_TTL_S`` and at most
+``RESULT_CACHE_MAX_ENTRIES`` are kept. The file is shared by the workers of a
+node. Lookups are counted in ``result_cache_total{result=hit|miss}``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from app.config import NEL_PRECISION, NER_PRECISION, NER_VERSION
+from app.metrics import counter, timed
+from app.utils.disk_store import DiskStore
+from app.utils.fingerprint import file_fingerprint, model_fingerprint
+
+LOOKUPS = counter("result_cache_total", "Documents looked up in the result cache, by result (hit, miss)")
+
+DISK_NAME = "results.sqlite"
+# Bump when the annotations a pipeline returns change shape or meaning
+SCHEMA = 1
+
+
+def _fingerprint(path: Path) -> str:
+    return model_fingerprint(path) if path.is_dir() else file_fingerprint(path)
+
+
+def resource_version(lang: str, entities: list[str], negation: bool) -> str:
+    """
+    Fingerprint of the registry resources a request for *lang*, *entities* and
+    *negation* may use, whatever its method. Resources that are not registered
+    or not on disk are left out.
+    """
+    from app.model_manager.resolver import LocalResolver
+
+    resolver = LocalResolver()
+    lookups = [("nel", lambda: resolver.get_nel_path(lang)[0])]
+    for entity in sorted(entities):
+        lookups += [
+            (f"ner/{entity}", lambda e=entity: resolver.get_ner_path(lang, e)[0]),
+            (f"gazetteer/{entity}", lambda e=entity: resolver.get_gaz_path(lang, e)),
+            (f"vector_db/{entity}", lambda e=entity: resolver.get_vector_db_path(lang, e)[0]),
+        ]
+    if negation:
+        lookups.append(("ner/negation", lambda: resolver.get_ner_path(lang, "negation")[0]))
+
+    parts = []
+    for name, lookup in lookups:
+        try:
+            path = Path(lookup())
+        except Exception:  # not registered for this language, or not downloaded
+            continue
+        if path.exists():
+            parts.append(f"{name}={_fingerprint(path)}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Annotations per ``(request parameters, text)``.
+
+    Args:
+        path:        SQLite file.
+        max_entries: Documents kept; 0 means unbounded.
+        ttl_s:       Seconds a result stays valid; 0 means forever.
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = 0, ttl_s: float = 0):
+        self.store = DiskStore(path, max_entries=max_entries, ttl_s=ttl_s)
+
+    def namespace(self, method: str, lang: str, entities: list[str], negation: bool) -> str:
+        """The part of the key shared by every document of a request with these parameters."""
+        # Computed per request, so that a model updated on disk invalidates its
+        # results at once. Fingerprints are memoized by path, size and mtime, so
+        # this only reads the registry and stats the resource files.
+        return json.dumps([
+            SCHEMA, method, lang, sorted(entities), bool(negation),
+            resource_version(lang, entities, negation), NER_VERSION, NER_PRECISION, NEL_PRECISION,
+        ])
+
+    @staticmethod
+    def _key(namespace: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{text}".encode()).hexdigest()
+
+    def get_many(self, namespace: str, texts: list[str]) -> list[Optional[list[dict]]]:
+        """The cached annotations of each of *texts*, or None where there are none."""
+        keys = [self._key(namespace, text) for text in texts]
+        stored = self.store.get_many(list(set(keys)))
+        found = [json.loads(stored[key]) if key in stored else None for key in keys]
+        hits = sum(annotations is not None for annotations in found)
+        LOOKUPS.inc(hits, result="hit")
+        LOOKUPS.inc(len(found) - hits, result="miss")
+        return found
+
+    def put_many(self, namespace: str, texts: list[str], annotations: list[list[dict]]) -> None:
+        self.store.put_many({
+            self._key(namespace, text): json.dumps(anns, ensure_ascii=False)
+            for text, anns in zip(texts, annotations)
+        })
+
+
+class CachedPredictor:
+    """
+    Serve documents found in *cache* from it, and the others from the predictor
+    returned by *build*. The predictor, and so its pipeline, is only built when
+    some document is missing.
+    """
+
+    def __init__(self, build: Callable[[], Any], cache: ResultCache, namespace: str):
+        self.build = build
+        self.cache = cache
+        self.namespace = namespace
+
+    def predict(self, texts: list[str]) -> list[list[dict]]:
+        with timed("result_cache"):
+            results = self.cache.get_many(self.namespace, texts)
+        missing = [i for i, annotations in enumerate(results) if annotations is None]
+        if not missing:
+            return results
+        # A text repeated within the request is annotated once
+        todo = list(dict.fromkeys(texts[i] for i in missing))
+        fresh = dict(zip(todo, self.build().predict(texts=todo)))
+        with timed("result_cache"):
+            self.cache.put_many(self.namespace, todo, [fresh[text] for text in todo])
+        for i in missing:
+            results[i] = fresh[texts[i]]
+        return results
@@ -0,0 +1,212 @@
+"""
+Serialization and writing of results.
+
+Results are encoded by a :class:`Serializer`. It uses orjson when it is
+installed (the ``fast-json`` extra) and ``JSON_LIBRARY`` allows it, and the
+standard library otherwise. An object orjson cannot encode (e.g. an integer
+beyond 64 bits) falls back to the standard library, so the library only
+changes the speed, not what can be written. Both emit UTF-8 without escaping
+non-ASCII characters. A compact serializer drops the indentation and the
+spaces after separators.
+
+The API answers through :class:`FastJSONProvider`, which encodes the response
+bodies (and decodes the request bodies) with orjson when it is available,
+keeping Flask's key sorting and its indentation in debug mode.
+
+Results written to an ``output_dir`` are either:
+
+* ``json``: one file per result (indented unless ``OUTPUT_COMPACT``). Files are
+  encoded and written on a thread pool of ``OUTPUT_WRITER_THREADS`` threads per
+  process (see :func:`write_files`), or
+* ``jsonl``: one compact result per line, in a single file (see
+  :func:`write_jsonl`).
+
+Either way, each file is written to a temporary file in the same directory and
+renamed into place, so a reader never sees a partial file.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from flask.json.provider import DefaultJSONProvider
+
+from app.config import JSON_LIBRARY, OUTPUT_COMPACT, OUTPUT_WRITER_THREADS
+
+LIBRARIES = ("auto", "orjson", "json")
+FORMATS = ("json", "jsonl")
+
+
+@lru_cache(maxsize=None)
+def _orjson(library: str):
+    """The orjson module if *library* allows it and it is installed, else None."""
+    if library not in LIBRARIES:
+        raise ValueError(f"Unknown JSON library {library!r}: expected one of {', '.join(LIBRARIES)}")
+    if library == "json":
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if library == "orjson":
+            raise ImportError("JSON_LIBRARY=orjson needs orjson (uv sync --extra fast-json)") from None
+        return None
+    return orjson
+
+
+class Serializer:
+    """
+    JSON encoding to UTF-8 bytes.
+
+    Args:
+        compact:   No indentation nor spaces after separators (otherwise an indent of 2).
+        sort_keys: Sort the keys of objects.
+        library:   ``"auto"`` (orjson when installed), ``"orjson"`` or ``"json"``.
+        default:   Called with an object neither library can encode; returns an encodable one.
+    """
+
+    def __init__(
+        self,
+        compact: bool = False,
+        sort_keys: bool = False,
+        library: str = JSON_LIBRARY,
+        default: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.compact = compact
+        self.sort_keys = sort_keys
+        self.default = default
+        self._orjson = _orjson(library)
+        if self._orjson is not None:
+            options = self._orjson.OPT_SERIALIZE_NUMPY | self._orjson.OPT_NON_STR_KEYS
+            if not compact:
+                options |= self._orjson.OPT_INDENT_2
+            if sort_keys:
+                options |= self._orjson.OPT_SORT_KEYS
+            self._options = options
+
+    @property
+    def library(self) -> str:
+        return "json" if self._orjson is None else "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        if self._orjson is not None:
+            try:
+                return self._orjson.dumps(obj, default=self.default, option=self._options)
+            except TypeError:  # orjson.JSONEncodeError; the standard library may still encode it
+                pass
+        return json.dumps(
+            obj,
+            ensure_ascii=False,
+            sort_keys=self.sort_keys,
+            default=self.default,
+            indent=None if self.compact else 2,
+            separators=(",", ":") if self.compact else None,
+        ).encode("utf-8")
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data) if self._orjson is None else self._orjson.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's default JSON provider, with the response bodies encoded by a
+    :class:`Serializer` and the request bodies decoded by it. Calls with extra
+    arguments for the standard library are left to Flask.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._serializer(compact=True).dumps(obj).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self._serializer(compact=True).loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        compact = self.compact if self.compact is not None else not self._app.debug
+        body = self._serializer(compact=compact).dumps(obj)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+    def _serializer(self, compact: bool) -> Serializer:
+        # Built per call: sort_keys may be changed on the provider at any time
+        return Serializer(compact=compact, sort_keys=self.sort_keys, default=self.default)
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Threads do not survive a fork: each process starts its own pool
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=max(1, OUTPUT_WRITER_THREADS), thread_name_prefix="result-writer")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def write_atomic(path: Path, data: bytes) -> Path:
+    """Write *data* to *path* through a temporary file renamed into place."""
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def _write_file(path: Path, result: Any, serializer: Serializer) -> Path:
+    return write_atomic(path, serializer.dumps(result))
+
+
+def write_files(
+    results: list[Any],
+    output_dir: Path,
+    filenames: list[str],
+    serializer: Optional[Serializer] = None,
+) -> list[Future]:
+    """
+    Start writing each of *results* to its file of *filenames* in *output_dir*,
+    in the background. Returns one future per file, giving its path (see
+    :func:`wait`).
+    """
+    serializer = serializer or Serializer(compact=OUTPUT_COMPACT)
+    pool = _executor()
+    return [
+        pool.submit(_write_file, output_dir / name, result, serializer)
+        for result, name in zip(results, filenames)
+    ]
+
+
+def wait(futures: list[Future]) -> list[Path]:
+    """The paths of the files of *futures*, once all are written; raises the first error."""
+    return [future.result() for future in futures]
+
+
+def dumps_lines(results: list[Any], serializer: Optional[Serializer] = None) -> bytes:
+    """*results* as JSON lines (*serializer* must be compact)."""
+    serializer = serializer or Serializer(compact=True)
+    return b"".join(serializer.dumps(result) + b"\n" for result in results)
+
+
+def write_jsonl(results: list[Any], path: Path, serializer: Optional[Serializer] = None) -> Path:
+    """Write *results* to *path*, one per line (see :func:`dumps_lines`)."""
+    return write_atomic(path, dumps_lines(results, serializer))
@@ -0,0 +1,208 @@
+"""
+Columnar annotations of a list of documents.
+
+The biencoder and cascade pipelines hand their mentions from NER through NEL
+to negation as an :class:`AnnotationBatch` rather than as one dict per
+mention. Each attribute is one array over the mentions of all the documents,
+and the mentions of document ``i`` are the rows ``offsets[i]:offsets[i + 1]``.
+Stages select rows or add columns; no per-mention object is built until
+:meth:`AnnotationBatch.to_dicts` turns the batch into the annotation dicts a
+pipeline returns (see :mod:`app.src.format.base` for their schema).
+
+Strings that repeat across mentions are interned in tables, and the rows hold
+ids into them: ``classes`` for the NER labels and ``concepts`` for the
+``(code, term)`` pairs found by NEL. Spans are kept as a list of strings.
+
+Only the v2 and v3 NER backends produce batches: v1 returns its scores as
+strings and its spans cleaned of the pretokenization spaces, so its pipelines
+stay on dicts.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Hashable, Optional
+
+import numpy as np
+
+
+def _intern(tables: list[list], ids: list[np.ndarray]) -> tuple[list, list[np.ndarray]]:
+    """One table for the values of *tables*, and *ids* (one array per table) remapped into it."""
+    merged: dict[Hashable, int] = {}
+    remapped = []
+    for table, table_ids in zip(tables, ids):
+        remap = np.array([merged.setdefault(value, len(merged)) for value in table], dtype=np.int32)
+        remapped.append(remap[table_ids] if len(table) else table_ids)
+    return list(merged), remapped
+
+
+def _or_none(values: np.ndarray) -> list:
+    # NaN marks a missing score
+    return [None if x != x else x for x in values.tolist()]
+
+
+@dataclass
+class AnnotationBatch:
+    """
+    Mentions of ``n_docs`` documents, one row per mention, grouped by document
+    and, within a document, in the order the pipeline returns them.
+    """
+
+    # Rows of document i: offsets[i]:offsets[i + 1]
+    offsets: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    ner_score: np.ndarray
+    # Ids into classes
+    ner_class: np.ndarray
+    classes: list[str]
+    span: list[str]
+    # Set by NEL: ids into concepts, a table of (code, term)
+    concept: Optional[np.ndarray] = None
+    concepts: list[tuple] = field(default_factory=list)
+    nel_score: Optional[np.ndarray] = None
+    # Set by negation: the number of scopes over each mention and their best score (NaN without one)
+    is_negated: Optional[np.ndarray] = None
+    negation_score: Optional[np.ndarray] = None
+    is_uncertain: Optional[np.ndarray] = None
+    uncertainty_score: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_rows(
+        cls,
+        counts: list[int],
+        start: list[int],
+        end: list[int],
+        ner_score: list[float],
+        ner_class: list[str],
+        span: list[str],
+    ) -> "AnnotationBatch":
+        """A batch of ``len(counts)`` documents, the first ``counts[0]`` rows being the first document's, etc."""
+        classes: dict[str, int] = {}
+        return cls(
+            offsets=np.concatenate(([0], np.cumsum(counts, dtype=np.int64))).astype(np.int64),
+            start=np.array(start, dtype=np.int64),
+            end=np.array(end, dtype=np.int64),
+            ner_score=np.array(ner_score, dtype=np.float64),
+            ner_class=np.array([classes.setdefault(c, len(classes)) for c in ner_class], dtype=np.int32),
+            classes=list(classes),
+            span=list(span),
+        )
+
+    @classmethod
+    def empty(cls, n_docs: int) -> "AnnotationBatch":
+        return cls.from_rows([0] * n_docs, [], [], [], [], [])
+
+    @classmethod
+    def concat(cls, batches: list["AnnotationBatch"]) -> "AnnotationBatch":
+        """The documents of *batches*, one after the other (e.g. the shards of a request)."""
+        if not batches:
+            return cls.empty(0)
+        sizes = np.cumsum([0] + [len(b) for b in batches[:-1]])
+        classes, class_ids = _intern([b.classes for b in batches], [b.ner_class for b in batches])
+        stacked = cls(
+            offsets=np.concatenate([batches[0].offsets[:1]] + [b.offsets[1:] + n for b, n in zip(batches, sizes)]),
+            start=np.concatenate([b.start for b in batches]),
+            end=np.concatenate([b.end for b in batches]),
+            ner_score=np.concatenate([b.ner_score for b in batches]),
+            ner_class=np.concatenate(class_ids),
+            classes=classes,
+            span=[s for b in batches for s in b.span],
+        )
+        # Batches without rows may lack the columns of a stage that had nothing to do
+        filled = [b for b in batches if len(b)] or batches
+        if all(b.concept is not None for b in filled):
+            concepts, concept_ids = _intern(
+                [b.concepts for b in batches],
+                [b.concept if b.concept is not None else np.zeros(0, np.int32) for b in batches],
+            )
+            stacked.concept = np.concatenate(concept_ids)
+            stacked.concepts = concepts
+            stacked.nel_score = np.concatenate([b.nel_score for b in batches if b.nel_score is not None] or [np.zeros(0)])
+        if all(b.is_negated is not None for b in filled):
+            for name in ("is_negated", "negation_score", "is_uncertain", "uncertainty_score"):
+                setattr(stacked, name, np.concatenate([getattr(b, name) for b in batches if getattr(b, name) is not None]))
+        return stacked
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.offsets) - 1
+
+    def doc_ids(self) -> np.ndarray:
+        """The document of each row."""
+        return np.repeat(np.arange(self.n_docs), np.diff(self.offsets))
+
+    def doc_spans(self, i: int) -> list[tuple[int, int]]:
+        """``(start, end)`` of the mentions of document *i*."""
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.start[a:b].tolist(), self.end[a:b].tolist()))
+
+    def take(self, rows: np.ndarray) -> "AnnotationBatch":
+        """The *rows* (indices or a boolean mask) of the batch, which must keep the documents in order."""
+        rows = np.flatnonzero(rows) if rows.dtype == bool else rows
+        return self.select(rows, self.doc_ids()[rows], self.n_docs)
+
+    def select(self, rows: np.ndarray, docs: np.ndarray, n_docs: int) -> "AnnotationBatch":
+        """The *rows* of the batch as the rows of *n_docs* documents, ``rows[k]`` going to document ``docs[k]`` (non-decreasing)."""
+        columns = {
+            name: getattr(self, name)[rows]
+            for name in ("start", "end", "ner_score", "ner_class", "concept", "nel_score",
+                         "is_negated", "negation_score", "is_uncertain", "uncertainty_score")
+            if getattr(self, name) is not None
+        }
+        span = self.span
+        return replace(
+            self,
+            offsets=np.concatenate(([0], np.cumsum(np.bincount(docs, minlength=n_docs)))).astype(np.int64),
+            span=[span[k] for k in rows.tolist()],
+            **columns,
+        )
+
+    def expand(self, docs: list[int], n_docs: int) -> "AnnotationBatch":
+        """This batch as documents *docs* (in increasing order) of *n_docs* documents; the others have no rows."""
+        counts = np.zeros(n_docs, dtype=np.int64)
+        counts[docs] = np.diff(self.offsets)
+        return replace(self, offsets=np.concatenate(([0], np.cumsum(counts))).astype(np.int64))
+
+    def with_links(self, links: dict[str, tuple]) -> "AnnotationBatch":
+        """The batch with the NEL columns set from *links*, the ``(code, term, nel_score)`` of each span."""
+        concepts: dict[tuple, int] = {}
+        by_span = {
+            span: (concepts.setdefault((code, term), len(concepts)), score)
+            for span, (code, term, score) in links.items()
+        }
+        rows = [by_span[span] for span in self.span]
+        return replace(
+            self,
+            concept=np.array([concept for concept, _ in rows], dtype=np.int32),
+            concepts=list(concepts),
+            nel_score=np.array([score for _, score in rows], dtype=np.float64),
+        )
+
+    def to_dicts(self) -> list[list[dict]]:
+        """The annotation dicts of each document, with the keys in the order of the dict-based stages."""
+        columns = {
+            "start": self.start.tolist(),
+            "end": self.end.tolist(),
+            "ner_score": self.ner_score.tolist(),
+            "span": self.span,
+            "ner_class": [self.classes[i] for i in self.ner_class.tolist()],
+        }
+        if self.concept is not None:
+            concepts = [self.concepts[i] for i in self.concept.tolist()]
+            columns["code"] = [code for code, _ in concepts]
+            columns["term"] = [term for _, term in concepts]
+            columns["nel_score"] = self.nel_score.tolist()
+        if self.is_negated is not None:
+            columns["is_negated"] = self.is_negated.tolist()
+            columns["negation_score"] = _or_none(self.negation_score)
+            columns["is_uncertain"] = self.is_uncertain.tolist()
+            columns["uncertainty_score"] = _or_none(self.uncertainty_score)
+
+        keys = list(columns)
+        rows = [dict(zip(keys, values)) for values in zip(*columns.values())]
+        bounds = self.offsets.tolist()
+        return [rows[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
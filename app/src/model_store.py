@@ -0,0 +1,198 @@
+"""
+Process-wide store of resident models and indexes.
+
+Pipelines do not load their NER models, NEL encoders, vector DBs or gazetteer
+engines directly: they *acquire* them from :data:`model_store` under a key that
+identifies the resource (e.g. ``("ner", 2, "/models/disease", "simple")``).
+Two pipelines that need the same resource — say ``biencoder/es/[disease]`` and
+``biencoder/es/[disease, symptoms]`` — therefore share one loaded copy.
+
+Resources are reference counted. When the last pipeline holding a resource
+releases it, the store drops its reference so that the memory can be
+reclaimed. Each resource's RAM/VRAM footprint is estimated once, at load time.
+
+Resources are loaded outside the store's lock, so loading one does not block
+acquiring the others; concurrent acquisitions of a resource being loaded wait
+for that load.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import types
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from app.metrics import counter, timed
+
+logger = logging.getLogger(__name__)
+
+HITS = counter("model_store_hits_total", "Resource acquisitions served by an already-resident copy")
+MISSES = counter("model_store_misses_total", "Resource acquisitions that had to load the resource")
+
+
+# Shared program state reachable from any object: never charged to a resource.
+_NOT_WALKED = (types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, type, logging.Logger)
+
+
+def estimate_nbytes(obj: Any, skip_ids: frozenset = frozenset()) -> tuple[int, int]:
+    """
+    Estimate the memory held by *obj* as ``(ram_bytes, vram_bytes)``.
+
+    torch modules and tensors are measured exactly (by device), pandas and
+    NumPy objects by their buffers, and plain Python containers and objects by
+    walking them with ``sys.getsizeof``. Objects whose ``id`` is in
+    *skip_ids* (other resources in the store) are not counted, so a resource
+    that merely references a shared encoder is not charged for it.
+    """
+    torch = sys.modules.get("torch")
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+
+    ram = vram = 0
+    seen: set[int] = set()
+    seen_storages: set[int] = set()
+    stack = [obj]
+
+    def count_tensor(t) -> None:
+        nonlocal ram, vram
+        # Tied weights and views share a storage: count it once.
+        ptr = t.untyped_storage().data_ptr()
+        if ptr in seen_storages:
+            return
+        seen_storages.add(ptr)
+        nbytes = t.numel() * t.element_size()
+        if t.device.type == "cuda":
+            vram += nbytes
+        else:
+            ram += nbytes
+
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or id(item) in skip_ids:
+            continue
+        seen.add(id(item))
+
+        if isinstance(item, _NOT_WALKED):
+            continue
+        if torch is not None and isinstance(item, torch.Tensor):
+            count_tensor(item)
+        elif torch is not None and isinstance(item, torch.nn.Module):
+            for t in list(item.parameters()) + list(item.buffers()):
+                count_tensor(t)
+        elif pd is not None and isinstance(item, (pd.DataFrame, pd.Series)):
+            ram += int(item.memory_usage(deep=True).sum()) if isinstance(item, pd.DataFrame) else int(item.memory_usage(deep=True))
+        elif np is not None and isinstance(item, np.ndarray):
+            ram += item.nbytes
+        elif isinstance(item, (str, bytes, int, float, bool, type(None))):
+            ram += sys.getsizeof(item)
+        elif isinstance(item, dict):
+            ram += sys.getsizeof(item)
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            ram += sys.getsizeof(item)
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            ram += sys.getsizeof(item)
+            stack.extend(vars(item).values())
+        else:
+            ram += sys.getsizeof(item)
+    return ram, vram
+
+
+class _Entry:
+    __slots__ = ("value", "refcount", "ram_bytes", "vram_bytes")
+
+    def __init__(self, value: Any, ram_bytes: int, vram_bytes: int):
+        self.value = value
+        self.refcount = 0
+        self.ram_bytes = ram_bytes
+        self.vram_bytes = vram_bytes
+
+
+class ModelStore:
+    """Reference-counted, thread-safe registry of loaded resources."""
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple, _Entry] = {}
+        # Keys being loaded, resolved once they are stored
+        self._loading: dict[tuple, Future] = {}
+        self._lock = threading.RLock()
+
+    def acquire(self, key: tuple, loader: Callable[[], Any]) -> Any:
+        """Return the resource stored under *key*, calling *loader* to create it if absent.
+
+        Every ``acquire`` must be balanced by a :meth:`release` of the same key.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    HITS.inc(kind=key[0])
+                    entry.refcount += 1
+                    return entry.value
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = Future()
+                    break
+            # Another caller is loading it: wait (re-raising its error), then take a reference
+            loading.result()
+
+        MISSES.inc(kind=key[0])
+        try:
+            with timed("model_load"):
+                value = loader()
+            with self._lock:
+                others = frozenset(id(e.value) for e in self._entries.values())
+            ram, vram = estimate_nbytes(value, skip_ids=others)
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(exc)
+            raise
+        with self._lock:
+            entry = self._entries[key] = _Entry(value, ram, vram)
+            entry.refcount += 1
+            del self._loading[key]
+        loading.set_result(None)
+        logger.info("Loaded %s (%.1f MB RAM, %.1f MB VRAM)", key, ram / 2**20, vram / 2**20)
+        return value
+
+    def release(self, key: tuple) -> None:
+        """Drop one reference to *key*; the resource is forgotten when none remain."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refcount -= 1
+            if entry.refcount <= 0:
+                del self._entries[key]
+                logger.info("Released %s", key)
+
+    def nbytes(self, keys: list[tuple] | None = None) -> tuple[int, int]:
+        """Total ``(ram, vram)`` of *keys* (each counted once), or of the whole store."""
+        with self._lock:
+            selected = self._entries if keys is None else {k: self._entries[k] for k in set(keys) if k in self._entries}
+            return (
+                sum(e.ram_bytes for e in selected.values()),
+                sum(e.vram_bytes for e in selected.values()),
+            )
+
+    def describe(self) -> list[dict]:
+        """JSON-serialisable listing of every resident resource."""
+        with self._lock:
+            return [
+                {
+                    "key": [str(part) for part in key],
+                    "refcount": e.refcount,
+                    "ram_bytes": e.ram_bytes,
+                    "vram_bytes": e.vram_bytes,
+                }
+                for key, e in self._entries.items()
+            ]
+
+
+model_store = ModelStore()
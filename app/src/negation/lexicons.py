@@ -0,0 +1,155 @@
+"""
+Trigger lexicons for the rule-based negation/uncertainty tagger (see
+:mod:`app.src.negation.negex`), one entry per registry language.
+
+Each language maps to:
+
+* ``NEG`` / ``UNC``: triggers, split into ``pre`` (scope follows the trigger,
+  "no presenta fiebre") and ``post`` (scope precedes it, "fiebre descartada");
+* ``pseudo``: phrases that contain a trigger but negate nothing ("sin
+  embargo", "no obstante"); they are matched first and ignored;
+* ``terminate``: words that close a scope early ("pero", "aunque"), on top of
+  sentence punctuation and line breaks.
+
+Matching is case-insensitive on whole words; whitespace inside a phrase
+matches any run of whitespace.
+"""
+
+LEXICONS: dict[str, dict] = {
+    "es": {
+        "NEG": {
+            "pre": [
+                "no", "ni", "sin", "niega", "niegan", "negativo para", "negativa para", "ausencia de",
+                "no presenta", "no refiere", "no se observa", "no se observan", "no se aprecia",
+                "no se aprecian", "no hay", "no existe", "no evidencia de", "sin evidencia de",
+                "sin signos de", "libre de", "descarta", "se descarta", "nunca", "tampoco",
+            ],
+            "post": ["negativo", "negativa", "negativos", "negativas", "descartado", "descartada", "ausente", "ausentes"],
+        },
+        "UNC": {
+            "pre": [
+                "posible", "posibles", "probable", "probables", "sospecha de", "sospecha", "compatible con",
+                "sugestivo de", "sugestiva de", "sugiere", "no se descarta", "no se puede descartar",
+                "a descartar", "descartar", "dudoso", "dudosa", "valorar", "impresiona de", "parece",
+            ],
+            "post": ["a descartar", "por confirmar", "en estudio", "dudoso", "dudosa", "probable", "posible"],
+        },
+        "pseudo": ["sin embargo", "no obstante", "no solo", "no sólo", "sin cambios", "no cambios"],
+        "terminate": ["pero", "aunque", "excepto", "salvo", "sin embargo", "no obstante", "mientras que"],
+    },
+    "en": {
+        "NEG": {
+            "pre": [
+                "no", "not", "without", "denies", "denied", "negative for", "absence of", "no evidence of",
+                "no signs of", "free of", "rules out", "ruled out", "never", "nor", "neither",
+                "did not", "does not", "not seen", "cannot see",
+            ],
+            "post": ["negative", "ruled out", "absent", "excluded"],
+        },
+        "UNC": {
+            "pre": [
+                "possible", "possibly", "probable", "probably", "suspected", "suspicion of", "compatible with",
+                "consistent with", "suggestive of", "suggests", "may be", "might be", "rule out", "r/o",
+                "cannot be ruled out", "cannot rule out", "questionable", "likely",
+            ],
+            "post": ["cannot be excluded", "to be ruled out", "is suspected", "not excluded", "questionable", "unlikely"],
+        },
+        "pseudo": ["no increase", "no change", "not only", "no further", "not necessarily", "without difficulty"],
+        "terminate": ["but", "however", "although", "except", "apart from", "aside from", "which", "though"],
+    },
+    "it": {
+        "NEG": {
+            "pre": [
+                "no", "non", "né", "senza", "nega", "negativo per", "negativa per", "assenza di",
+                "non si osserva", "non si osservano", "non evidenza di", "nessun", "nessuna", "mai",
+                "libero da", "libera da", "esclude",
+            ],
+            "post": ["negativo", "negativa", "assente", "assenti", "escluso", "esclusa"],
+        },
+        "UNC": {
+            "pre": [
+                "possibile", "probabile", "sospetto di", "sospetta", "sospetto", "compatibile con",
+                "suggestivo di", "suggestiva di", "verosimile", "da escludere", "non si esclude",
+                "non escludibile", "dubbio", "dubbia",
+            ],
+            "post": ["da escludere", "da confermare", "in studio", "dubbio", "dubbia"],
+        },
+        "pseudo": ["non solo", "tuttavia", "senza variazioni", "non variazioni"],
+        "terminate": ["ma", "però", "tuttavia", "sebbene", "eccetto", "tranne", "mentre"],
+    },
+    "nl": {
+        "NEG": {
+            "pre": [
+                "geen", "niet", "zonder", "nooit", "noch", "ontkent", "negatief voor", "afwezigheid van",
+                "geen aanwijzingen voor", "geen tekenen van", "vrij van", "uitgesloten",
+            ],
+            "post": ["negatief", "afwezig", "uitgesloten", "niet aanwezig", "niet gezien"],
+        },
+        "UNC": {
+            "pre": [
+                "mogelijk", "mogelijke", "waarschijnlijk", "waarschijnlijke", "verdenking op", "verdacht voor",
+                "passend bij", "suggestief voor", "differentiaal diagnostisch", "ddx", "twijfel",
+                "niet uit te sluiten",
+            ],
+            "post": ["niet uitgesloten", "niet uit te sluiten", "twijfelachtig", "waarschijnlijk"],
+        },
+        "pseudo": ["niet alleen", "geen verandering", "geen toename", "echter"],
+        "terminate": ["maar", "echter", "hoewel", "behalve", "uitgezonderd", "terwijl"],
+    },
+    "ro": {
+        "NEG": {
+            "pre": [
+                "nu", "fără", "fara", "nici", "neagă", "neaga", "negativ pentru", "absența", "absenta",
+                "nu prezintă", "nu prezinta", "nu se observă", "nu se observa", "niciun", "nicio", "niciodată",
+                "exclude",
+            ],
+            "post": ["negativ", "negativă", "negativa", "absent", "absentă", "absenta", "exclus", "exclusă", "exclusa"],
+        },
+        "UNC": {
+            "pre": [
+                "posibil", "posibilă", "posibila", "probabil", "probabilă", "probabila", "suspiciune de",
+                "suspect de", "compatibil cu", "sugestiv pentru", "nu se exclude", "de exclus",
+            ],
+            "post": ["de exclus", "de confirmat", "în studiu", "in studiu", "incert", "incertă"],
+        },
+        "pseudo": ["nu numai", "nu doar", "fără modificări", "fara modificari", "totuși", "totusi"],
+        "terminate": ["dar", "însă", "insa", "deși", "desi", "cu excepția", "cu exceptia", "totuși", "totusi"],
+    },
+    "sv": {
+        "NEG": {
+            "pre": [
+                "ingen", "inget", "inga", "inte", "ej", "utan", "aldrig", "varken", "förnekar",
+                "negativ för", "avsaknad av", "inga tecken på", "ingen misstanke om", "fri från",
+            ],
+            "post": ["negativ", "negativt", "uteslutet", "utesluten", "saknas", "ses ej", "ej påvisad"],
+        },
+        "UNC": {
+            "pre": [
+                "möjlig", "möjligt", "möjligen", "trolig", "troligt", "troligen", "misstänkt", "misstanke om",
+                "förenlig med", "talar för", "kan inte uteslutas", "eventuellt", "oklar",
+            ],
+            "post": ["kan inte uteslutas", "ej uteslutet", "misstänks", "oklart"],
+        },
+        "pseudo": ["inte bara", "ingen förändring", "ingen ökning", "dock"],
+        "terminate": ["men", "dock", "fast", "även om", "förutom", "utom", "medan"],
+    },
+    "cz": {
+        "NEG": {
+            "pre": [
+                "ne", "nikoli", "bez", "žádný", "žádná", "žádné", "nikdy", "ani", "neguje", "popírá",
+                "negativní na", "nepřítomnost", "nebyl prokázán", "nebyla prokázána", "nebylo prokázáno",
+                "vyloučen", "vyloučena",
+            ],
+            "post": ["negativní", "nepřítomen", "nepřítomna", "vyloučen", "vyloučena", "vyloučeno"],
+        },
+        "UNC": {
+            "pre": [
+                "možný", "možná", "možné", "pravděpodobně", "pravděpodobný", "pravděpodobná", "suspektní",
+                "podezření na", "susp.", "kompatibilní s", "svědčí pro", "nelze vyloučit", "nejasný", "nejasná",
+            ],
+            "post": ["nelze vyloučit", "k vyloučení", "k potvrzení", "nejasné"],
+        },
+        "pseudo": ["nejen", "bez změny", "beze změn", "nicméně"],
+        "terminate": ["ale", "avšak", "však", "nicméně", "kromě", "ačkoli", "zatímco"],
+    },
+}
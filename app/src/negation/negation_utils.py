@@ -8,51 +8,236 @@ and enriches NER entities with is_negated and is_uncertain attributes.
 Author: Jan Rodríguez Miret
 """
 
+import heapq
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.src.annotations import AnnotationBatch
+
+# Classes produced by the negation tagger; never returned as clinical entities.
+NEGATION_CLASSES = frozenset({'NEG', 'NSCO', 'UNC', 'USCO'})
+
+# Below this many entity × scope pairs the direct pairwise check is cheaper than sorting.
+_PAIRWISE_MAX = 64
+
+
 def add_negation_uncertainty_attributes(nerl_results: list[list[dict]], negation_entities_list: list[list[dict]]) -> list[list[dict]]:
     """
     Add is_negated and is_uncertain attributes to NER entities based on overlap with negation/uncertainty scope entities.
     Also includes negation/uncertainty scores from the matching scopes.
-    Calls the negation tagger internally to detect negation/uncertainty scopes.
     Filters out NEG, NSCO, UNC, USCO entities from the results.
-    
+
+    Scopes are matched with a sort-and-sweep (see :func:`_match_scopes`), so a
+    document costs O((n + m) log(n + m)) for n entities and m scopes.
+
     Args:
-        nerl_results (list): List of NER entities for each text (output from ner_inference with combined=True)
-        texts (list): List of original text strings to process with negation tagger
-        agg_strat (str): Aggregation strategy for the negation tagger model
-    
+        nerl_results (list): List of NER(+NEL) entities for each text
+        negation_entities_list (list): Output of the negation tagger for each text
+
     Returns:
         list: List of NER entities with added is_negated, is_uncertain, negation_score, and uncertainty_score attributes
     """
-    # Run negation tagger inference to get negation/uncertainty entities
     results_with_attributes = []
-    
+
     for nerL_entities_doc, negation_entities_doc in zip(nerl_results, negation_entities_list):
-        
-        # Separate negation/uncertainty scopes and triggers
-        neg_scopes = [e for e in negation_entities_doc if e['ner_class'] == 'NSCO']
-        unc_scopes = [e for e in negation_entities_doc if e['ner_class'] == 'USCO']
-        
+
+        # Separate negation/uncertainty scopes (triggers are not used)
+        neg_scopes, unc_scopes = [], []
+        for e in negation_entities_doc:
+            if e['ner_class'] == 'NSCO':
+                neg_scopes.append(e)
+            elif e['ner_class'] == 'USCO':
+                unc_scopes.append(e)
+
         # Filter NER entities: exclude NEG, NSCO, UNC, USCO entities
-        filtered_ner_entities = [
-            e for e in nerL_entities_doc 
-            if e['ner_class'] not in ['NEG', 'NSCO', 'UNC', 'USCO'] # though idk why this would be called if the neg ner is only called above
-        ]
-        
+        filtered_ner_entities = [e for e in nerL_entities_doc if e['ner_class'] not in NEGATION_CLASSES]
+
         # Add negation/uncertainty attributes to each entity
-        for entity in filtered_ner_entities:
-            is_negated, negation_score = _find_property(entity, neg_scopes)
-            is_uncertain, uncertainty_score = _find_property(entity, unc_scopes)
-            
+        negations = _match_scopes(filtered_ner_entities, neg_scopes)
+        uncertainties = _match_scopes(filtered_ner_entities, unc_scopes)
+        for entity, (is_negated, negation_score), (is_uncertain, uncertainty_score) in zip(filtered_ner_entities, negations, uncertainties):
             entity['is_negated'] = is_negated
             entity['negation_score'] = negation_score
             entity['is_uncertain'] = is_uncertain
             entity['uncertainty_score'] = uncertainty_score
-        
+
         results_with_attributes.append(filtered_ner_entities)
-    
+
     return results_with_attributes
 
+
+def add_negation_uncertainty_attributes_batch(nerl_results: "AnnotationBatch", negation_entities: "AnnotationBatch") -> "AnnotationBatch":
+    """
+    :func:`add_negation_uncertainty_attributes` for columnar results (see
+    :class:`app.src.annotations.AnnotationBatch`): the mentions of
+    *nerl_results* that are not of a negation class, with the ``is_negated``,
+    ``negation_score``, ``is_uncertain`` and ``uncertainty_score`` columns
+    (NaN for a missing score).
+    """
+    import numpy as np
+
+    negation_ids = [i for i, c in enumerate(nerl_results.classes) if c in NEGATION_CLASSES]
+    entities = nerl_results.take(~np.isin(nerl_results.ner_class, negation_ids))
+    scope_ids = {c: i for i, c in enumerate(negation_entities.classes) if c in ('NSCO', 'USCO')}
+    nsco, usco = scope_ids.get('NSCO', -1), scope_ids.get('USCO', -1)
+
+    starts, ends = entities.start.tolist(), entities.end.tolist()
+    scopes = list(zip(
+        negation_entities.start.tolist(), negation_entities.end.tolist(), negation_entities.ner_score.tolist(),
+    ))
+    scope_classes = negation_entities.ner_class.tolist()
+    bounds, scope_bounds = entities.offsets.tolist(), negation_entities.offsets.tolist()
+
+    negations, uncertainties = [], []
+    for doc in range(entities.n_docs):
+        a, b = bounds[doc], bounds[doc + 1]
+        c, d = scope_bounds[doc], scope_bounds[doc + 1]
+        neg_scopes = [scopes[k] for k in range(c, d) if scope_classes[k] == nsco]
+        unc_scopes = [scopes[k] for k in range(c, d) if scope_classes[k] == usco]
+        negations.extend(_match_spans(starts[a:b], ends[a:b], neg_scopes))
+        uncertainties.extend(_match_spans(starts[a:b], ends[a:b], unc_scopes))
+
+    entities.is_negated = np.array([count for count, _ in negations], dtype=np.int64)
+    entities.negation_score = np.array([np.nan if score is None else score for _, score in negations], dtype=np.float64)
+    entities.is_uncertain = np.array([count for count, _ in uncertainties], dtype=np.int64)
+    entities.uncertainty_score = np.array([np.nan if score is None else score for _, score in uncertainties], dtype=np.float64)
+    return entities
+
+
+class _Desc:
+    """Inverts the ordering of a score so that heapq pops the highest one first."""
+    __slots__ = ("score",)
+
+    def __init__(self, score):
+        self.score = score
+
+    def __lt__(self, other: "_Desc") -> bool:
+        return self.score > other.score
+
+
+def _stabbing_max(points: list[int], scopes: list[tuple], left_closed: bool) -> list:
+    """
+    For each point, the highest score among the ``(start, end, score)``
+    *scopes* containing it, or None.
+
+    A scope contains ``x`` when ``start <= x < end`` (*left_closed*) or
+    ``start < x <= end`` (otherwise). Points are swept in increasing order; a
+    max-heap holds the scopes started so far, and scopes already ended are
+    dropped lazily from its top, since they cannot contain any later point.
+    """
+    by_start = sorted(scopes, key=lambda s: s[0])
+    heap: list = []
+    out = [None] * len(points)
+    i = 0
+    for p in sorted(range(len(points)), key=points.__getitem__):
+        x = points[p]
+        while i < len(by_start) and (by_start[i][0] <= x if left_closed else by_start[i][0] < x):
+            heapq.heappush(heap, (_Desc(by_start[i][2]), i, by_start[i][1]))
+            i += 1
+        while heap and (heap[0][2] <= x if left_closed else heap[0][2] < x):
+            heapq.heappop(heap)
+        if heap:
+            out[p] = heap[0][0].score
+    return out
+
+
+def _count_containing(starts: list[int], ends: list[int], scopes: list[tuple]) -> list[int]:
+    """
+    For each pair ``(starts[k], ends[k])``, the number of scopes with
+    ``start <= starts[k]`` and ``end >= ends[k]``, by sweeping the starts in
+    increasing order over a Fenwick tree of the scope ends.
+    """
+    by_start = sorted(scopes, key=lambda s: s[0])
+    sorted_ends = sorted(s[1] for s in scopes)
+    tree = [0] * (len(sorted_ends) + 1)
+    out = [0] * len(starts)
+    added = i = 0
+    for k in sorted(range(len(starts)), key=starts.__getitem__):
+        while i < len(by_start) and by_start[i][0] <= starts[k]:
+            j = bisect_left(sorted_ends, by_start[i][1]) + 1
+            while j < len(tree):
+                tree[j] += 1
+                j += j & -j
+            added += 1
+            i += 1
+        # added scopes whose end is < ends[k]
+        below, j = 0, bisect_left(sorted_ends, ends[k])
+        while j > 0:
+            below += tree[j]
+            j -= j & -j
+        out[k] = added - below
+    return out
+
+
+def _match_scopes(entities: list[dict], scopes: list[dict]) -> list[tuple[int, float | None]]:
+    """Equivalent to ``[_find_property(e, scopes) for e in entities]`` (see :func:`_match_spans`)."""
+    return _match_spans(
+        [e['start'] for e in entities],
+        [e['end'] for e in entities],
+        [(s['start'], s['end'], s['ner_score']) for s in scopes],
+    )
+
+
+def _match_spans(starts: list[int], ends: list[int], scopes: list[tuple]) -> list[tuple[int, float | None]]:
+    """
+    For each entity ``(starts[k], ends[k])``, the number of ``(start, end,
+    score)`` *scopes* it overlaps and their highest score.
+
+    An entity overlaps a scope (:func:`_entity_in_scope`) when its start lies in
+    ``[scope.start, scope.end)`` (set A) or its end lies in
+    ``(scope.start, scope.end]`` (set B). Both are stabbing queries, so
+
+    * ``|A ∪ B| = |A| + |B| - |A ∩ B|``, where |A| and |B| are differences of
+      binary searches over the sorted scope starts and ends, and ``A ∩ B`` are
+      the scopes spanning the whole entity;
+    * the max score over ``A ∪ B`` is the larger of the max over A and over B.
+    """
+    if not scopes:
+        return [(0, None)] * len(starts)
+    if len(starts) * len(scopes) <= _PAIRWISE_MAX:
+        return [_find_spans(x, y, scopes) for x, y in zip(starts, ends)]
+
+    # Empty or inverted scopes overlap nothing; inverted entities (never produced
+    # by the NER step) fall outside the identities above and are checked pairwise.
+    scopes = [s for s in scopes if s[0] < s[1]]
+    regular = [k for k in range(len(starts)) if starts[k] < ends[k]]
+    results: list = [None] * len(starts)
+    for k in range(len(starts)):
+        if starts[k] >= ends[k]:
+            results[k] = _find_spans(starts[k], ends[k], scopes)
+    if not scopes:
+        return [r if r is not None else (0, None) for r in results]
+
+    e_starts = [starts[k] for k in regular]
+    e_ends = [ends[k] for k in regular]
+    s_starts = sorted(s[0] for s in scopes)
+    s_ends = sorted(s[1] for s in scopes)
+
+    max_a = _stabbing_max(e_starts, scopes, left_closed=True)
+    max_b = _stabbing_max(e_ends, scopes, left_closed=False)
+    spanning = _count_containing(e_starts, e_ends, scopes)
+
+    for idx, k in enumerate(regular):
+        x, y = e_starts[idx], e_ends[idx]
+        in_a = bisect_right(s_starts, x) - bisect_right(s_ends, x)
+        in_b = bisect_left(s_starts, y) - bisect_left(s_ends, y)
+        count = in_a + in_b - spanning[idx]
+        a, b = max_a[idx], max_b[idx]
+        score = a if b is None else b if a is None else max(a, b)
+        results[k] = (count, score)
+    return results
+
+def _find_spans(start: int, end: int, scopes: list[tuple]) -> tuple[int, float | None]:
+    # :func:`_find_property` for an entity (start, end) and (start, end, score) scopes
+    scores = [
+        score for scope_start, scope_end, score in scopes
+        if scope_start <= start < scope_end or scope_start < end <= scope_end
+    ]
+    return len(scores), max(scores) if scores else None
+
 def _find_property(entity: dict, prop_scopes: list[dict]) -> tuple[int, float | None]:
+    # Pairwise reference for _match_scopes (which uses _find_spans for small inputs).
     # Find overlapping negation scopes and get their scores
     overlapping_scopes = [scope for scope in prop_scopes if _entity_in_scope(entity, scope)] # for some reason, there can be more than one negation per entity
     # Use the highest score if multiple scopes overlap
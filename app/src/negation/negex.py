@@ -0,0 +1,129 @@
+"""
+negex.py
+
+Rule-based negation and uncertainty tagger in the NegEx style, for the
+pipelines that have no NER model to host a negation head (lookup, fuzzy,
+BM25).
+
+Each language's trigger lexicon (see :mod:`app.src.negation.lexicons`) is
+compiled into a single regular expression. A trigger opens a scope that runs
+forward (``pre`` triggers) or backward (``post`` triggers) for at most
+``window`` words, and stops at sentence punctuation, a line break or a
+termination word. The output has the shape of the negation tagger's
+(``NEG``/``UNC`` triggers and ``NSCO``/``USCO`` scopes, with ``ner_score``
+1.0), so it feeds :func:`add_negation_uncertainty_attributes` unchanged.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+from .lexicons import LEXICONS
+
+SCOPE_CLASS = {"NEG": "NSCO", "UNC": "USCO"}
+PSEUDO = "PSEUDO"
+
+# Sentence-ending punctuation (not decimal points) and line breaks close every scope.
+_BOUNDARY = r"[.;!?](?!\w)|\n"
+_WORD = re.compile(r"\w+(?:[.,/]\w+)*")  # "38.5" is one word
+
+
+def _phrase_pattern(phrases) -> str:
+    # Longest first, so that "no se descarta" wins over "no"
+    alternatives = sorted(set(phrases), key=len, reverse=True)
+    return "|".join(r"\s+".join(re.escape(word) for word in phrase.split()) for phrase in alternatives)
+
+
+class NegexTagger:
+    """
+    Negation/uncertainty tagger for one language.
+
+    Args:
+        lang:   Language code; must be a key of :data:`LEXICONS`.
+        window: Maximum scope length, in words.
+    """
+
+    def __init__(self, lang: str, window: int = 6):
+        if lang not in LEXICONS:
+            raise ValueError(f"No negation lexicon for language {lang!r}. Available: {sorted(LEXICONS)}")
+        lexicon = LEXICONS[lang]
+        self.lang = lang
+        self.window = window
+
+        # phrase (lowercased, single-spaced) -> [(trigger class, direction), ...]
+        self.rules: dict[str, list[tuple[str, str]]] = {}
+        for trigger_class in SCOPE_CLASS:
+            for direction in ("pre", "post"):
+                for phrase in lexicon[trigger_class][direction]:
+                    self.rules.setdefault(phrase.lower(), []).append((trigger_class, direction))
+        for phrase in lexicon["pseudo"]:
+            self.rules[phrase.lower()] = [(PSEUDO, "")]
+
+        self._triggers = re.compile(rf"(?<!\w)(?:{_phrase_pattern(self.rules)})(?!\w)", re.IGNORECASE)
+        self._terminators = re.compile(
+            rf"{_BOUNDARY}|(?<!\w)(?:{_phrase_pattern(lexicon['terminate'])})(?!\w)", re.IGNORECASE
+        )
+
+    def tag(self, text: str) -> list[dict]:
+        """Trigger and scope entities found in *text*, sorted by start offset."""
+        matches = list(self._triggers.finditer(text))
+        if not matches:
+            return []
+
+        words = [(m.start(), m.end()) for m in _WORD.finditer(text)]
+        word_starts = [s for s, _ in words]
+        word_ends = [e for _, e in words]
+        stops = [(m.start(), m.end()) for m in self._terminators.finditer(text)]
+        stop_starts = [s for s, _ in stops]
+        stop_ends = [e for _, e in stops]
+
+        entities = []
+        for match in matches:
+            rules = self.rules[" ".join(match.group().lower().split())]
+            if rules[0][0] == PSEUDO:
+                continue
+            for trigger_class in dict.fromkeys(c for c, _ in rules):
+                entities.append(_entity(text, match.start(), match.end(), trigger_class))
+            for trigger_class, direction in rules:
+                if direction == "pre":
+                    # From the trigger up to the window-th word or the next stop
+                    i = bisect_left(word_starts, match.end())
+                    if i == len(words):
+                        continue
+                    start = words[i][0]
+                    end = words[min(i + self.window, len(words)) - 1][1]
+                    j = bisect_left(stop_starts, match.end())
+                    if j < len(stops):
+                        end = min(end, stop_starts[j])
+                else:
+                    # From the window-th word or the previous stop up to the trigger
+                    i = bisect_right(word_ends, match.start())
+                    if i == 0:
+                        continue
+                    start = words[max(i - self.window, 0)][0]
+                    end = words[i - 1][1]
+                    j = bisect_right(stop_ends, match.start())
+                    if j > 0:
+                        start = max(start, stop_ends[j - 1])
+                span = text[start:end]
+                stripped = span.strip()
+                if not stripped:
+                    continue
+                start += len(span) - len(span.lstrip())
+                end = start + len(stripped)
+                entities.append(_entity(text, start, end, SCOPE_CLASS[trigger_class]))
+        return sorted(entities, key=lambda e: (e["start"], e["end"]))
+
+
+def _entity(text: str, start: int, end: int, ner_class: str) -> dict:
+    return {"start": start, "end": end, "span": text[start:end], "ner_class": ner_class, "ner_score": 1.0}
+
+
+def negex_inference(texts: list[str], tagger: NegexTagger, entities: Optional[list[list[dict]]] = None) -> list[list[dict]]:
+    """
+    Tag every text with *tagger*. With *entities* (per text), texts without
+    any entity are skipped, since their scopes could not match anything.
+    """
+    if entities is None:
+        return [tagger.tag(text) for text in texts]
+    return [tagger.tag(text) if doc else [] for text, doc in zip(texts, entities)]
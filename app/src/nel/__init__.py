@@ -1,4 +1,34 @@
-from .biencoder import biencoder_inference
-from .lookup import lookup_inference
-from .fuzzy_match import fuzzymatch_inference
-from .bm25 import bm25okapi_inference
\ No newline at end of file
+"""
+Entity linking backends. Each one is imported on first use (e.g.
+``app.src.nel.lookup_inference``), so that a deployment only pays for the
+libraries of the methods it serves: flashtext (lookup), rapidfuzz (fuzzy),
+rank_bm25 (BM25), torch and sentence-transformers (biencoder, cascade).
+"""
+
+import importlib
+
+_LAZY = {
+    "biencoder_inference": ".biencoder",
+    "biencoder_inference_batch": ".biencoder",
+    "load_biencoder_models": ".biencoder",
+    "load_nel_encoder": ".biencoder",
+    "BiencoderModel": ".biencoder",
+    "lookup_inference": ".lookup",
+    "LookUpMethod": ".lookup",
+    "fuzzymatch_inference": ".fuzzy_match",
+    "FuzzyMatchMethod": ".fuzzy_match",
+    "bm25okapi_inference": ".bm25",
+    "BM25Method": ".bm25",
+    "cascade_inference": ".cascade",
+    "cascade_inference_batch": ".cascade",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -2,18 +2,29 @@ import sys, os
 import pandas as pd
 import torch
 from pathlib import Path
+from typing import Optional, Union
 from sentence_transformers import SentenceTransformer
-from app.config import device
+from app.config import NEL_PRECISION, device
 
+from app.src.annotations import AnnotationBatch
 from app.utils.model_utils import DenseRetriever
 from app.utils.download_model import load_as_torch_tensor
+from app.parallelism import apply_torch_parallelism
+from app.utils.precision import apply_precision
 
 
 class BiencoderModel:
-    def __init__(self, gaz_pth: Path, model_pth: Path, vector_db_pth: Path):
+    def __init__(self, gaz_pth: Path, model_pth: Union[Path, SentenceTransformer], vector_db_pth: Path):
+        """
+        model_pth can also be an already-loaded SentenceTransformer, so that several
+        entity types of the same language share a single resident encoder.
+        """
         self.device = device
 
-        self.st_model = SentenceTransformer(str(model_pth)).to(self.device)
+        if isinstance(model_pth, SentenceTransformer):
+            self.st_model = model_pth
+        else:
+            self.st_model = load_nel_encoder(model_pth)
         self.gazetteer = pd.read_csv(gaz_pth, sep='\t')
         self.gazetteer.drop_duplicates(subset=["term"], inplace=True)
 
@@ -45,7 +56,34 @@ class BiencoderModel:
         )
         return candidates_df.set_index('mention')
 
-def biencoder_inference(ner_results: list[list[list[dict]]], nel_model_pth: Path, gaz_path_list: list[Path], vector_db_path_list: list[Path]) -> list[list[list[dict]]]:
+    def link(self, mentions: list[str]) -> dict[str, tuple]:
+        """``(code, term, similarity)`` of the top candidate of each of *mentions*."""
+        output = self.run_nel_inference(input_mentions=mentions, k=1)
+        return dict(zip(output.index, zip(output["code"], output["term"], output["similarity"])))
+
+def load_nel_encoder(nel_model_pth: Path, precision: str = NEL_PRECISION) -> SentenceTransformer:
+    """
+    Load the query encoder in *precision*. The vector DBs stay in fp32 (built
+    with the full-precision model), so int8/bf16 queries drift slightly from
+    them; see benchmarks/precision_bench.py.
+    """
+    apply_torch_parallelism()
+    return apply_precision(SentenceTransformer(str(nel_model_pth)).to(device), precision, device)
+
+def load_biencoder_models(nel_model_pth: Path, gaz_path_list: list[Path], vector_db_path_list: list[Path]) -> list[BiencoderModel]:
+    """
+    Load one BiencoderModel per entity type, all of them sharing a single SentenceTransformer.
+    The result can be kept resident and passed to biencoder_inference through `nel_models`.
+    """
+    assert len(gaz_path_list) == len(vector_db_path_list)
+
+    st_model = load_nel_encoder(nel_model_pth)
+    return [
+        BiencoderModel(gaz_pth=gaz_pth, model_pth=st_model, vector_db_pth=vector_db_pth)
+        for gaz_pth, vector_db_pth in zip(gaz_path_list, vector_db_path_list)
+    ]
+
+def biencoder_inference(ner_results: list[list[list[dict]]], nel_model_pth: Path, gaz_path_list: list[Path], vector_db_path_list: list[Path], nel_models: Optional[list[BiencoderModel]] = None) -> list[list[list[dict]]]:
     """
     ner_results = [//result level
         [// entity type level
@@ -62,6 +100,9 @@ def biencoder_inference(ner_results: list[list[list[dict]]], nel_model_pth: Path
 
     gaz_path_list, vector_db_path_list are pretty self explanatory.
 
+    nel_models: optional models already loaded with load_biencoder_models (one per entity type,
+    same order as gaz_path_list). When given, nothing is loaded from disk.
+
     returns the same ner_results list of list of list of dict with extra keys for the normalized codes and the simmilarity to the original concept
     """
 
@@ -74,11 +115,14 @@ def biencoder_inference(ner_results: list[list[list[dict]]], nel_model_pth: Path
         if len(mentions) == 0:
             continue # no mentions for that entity type
 
-        nel_model = BiencoderModel(
-            gaz_pth=gaz_pth,
-            model_pth=nel_model_pth,
-            vector_db_pth=vector_db_pth,
-        )
+        if nel_models is not None:
+            nel_model = nel_models[ent_type_idx]
+        else:
+            nel_model = BiencoderModel(
+                gaz_pth=gaz_pth,
+                model_pth=nel_model_pth,
+                vector_db_pth=vector_db_pth,
+            )
         
         output = nel_model.run_nel_inference(
             input_mentions=mentions,
@@ -90,3 +134,16 @@ def biencoder_inference(ner_results: list[list[list[dict]]], nel_model_pth: Path
                 mention_dict["code"], mention_dict["term"], mention_dict["nel_score"] = output.loc[mention_dict["span"]]
                 
     return nerl_results
+
+
+def biencoder_inference_batch(ner_results: list[AnnotationBatch], nel_models: list[BiencoderModel]) -> list[AnnotationBatch]:
+    """
+    :func:`biencoder_inference` for columnar NER results, one batch per entity
+    type (same order as *nel_models*). Each distinct span is encoded once, and
+    its code, term and similarity are set on every mention of it.
+    """
+    assert len(ner_results) == len(nel_models)
+    return [
+        batch.with_links(nel_model.link(list(dict.fromkeys(batch.span)))) if len(batch) else batch
+        for batch, nel_model in zip(ner_results, nel_models)
+    ]
@@ -53,7 +53,7 @@ class BM25Method:
 
         return result
 
-def bm25okapi_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str]) -> list[list[list[dict]]]:
+def bm25okapi_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str | BM25Method]) -> list[list[list[dict]]]:
 
     assert len(ner_results) == len(gaz_pths)
 
@@ -64,7 +64,7 @@ def bm25okapi_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str]
         if len(mentions) == 0:
             continue
 
-        bm25_engine = BM25Method(gaz_path = gaz)
+        bm25_engine = gaz if isinstance(gaz, BM25Method) else BM25Method(gaz_path = gaz)
 
         for mention_doc in nerl_results[ent_type_idx]:
             for mention_dict in mention_doc:
@@ -0,0 +1,126 @@
+"""
+Cascade entity linking: each mention is linked by the cheapest tier that
+resolves it, in order:
+
+1. ``exact``: its normalized form (lowercase, no accents) is a gazetteer term;
+2. ``fuzzy``: its best fuzzy score against the gazetteer reaches the (high)
+   threshold of the :class:`FuzzyMatchMethod`;
+3. ``dense``: the remaining mentions go to the :class:`BiencoderModel`.
+
+Only the last tier runs the SentenceTransformer.
+"""
+
+from collections import Counter
+
+from app.metrics import timed
+from app.src.annotations import AnnotationBatch
+
+from .biencoder import BiencoderModel
+from .fuzzy_match import FuzzyMatchMethod
+
+TIERS = ("exact", "fuzzy", "dense")
+
+
+def cascade_inference(
+        ner_results: list[list[list[dict]]],
+        fuzzy_engines: list[FuzzyMatchMethod],
+        nel_models: list[BiencoderModel],
+    ) -> tuple[list[list[list[dict]]], dict[str, int]]:
+    """
+    Link every mention of *ner_results* (same nesting as in biencoder_inference),
+    one fuzzy engine and one biencoder model per entity type, same order.
+
+    Returns the results with the ``code``, ``term`` and ``nel_score`` keys
+    added, and the number of mentions linked by each tier.
+    """
+    assert len(ner_results) == len(fuzzy_engines) == len(nel_models)
+
+    hits = dict.fromkeys(TIERS, 0)
+    nerl_results = ner_results.copy()
+    for ent_type_mentions, fuzzy_engine, nel_model in zip(nerl_results, fuzzy_engines, nel_models):
+        mention_dicts = [mention_dict for mention_doc in ent_type_mentions for mention_dict in mention_doc]
+        if len(mention_dicts) == 0:
+            continue
+
+        with timed("nel_lexical"):
+            unresolved = []
+            for mention_dict in mention_dicts:
+                info = fuzzy_engine.term_to_info.get(fuzzy_engine._normalize(mention_dict["span"]))
+                if info is None:
+                    unresolved.append(mention_dict)
+                    continue
+                mention_dict["term"], mention_dict["code"] = info
+                mention_dict["nel_score"] = 1.0
+            hits["exact"] += len(mention_dicts) - len(unresolved)
+
+            remaining = []
+            if unresolved:
+                matches = fuzzy_engine.run_fuzzymatch_batch([mention_dict["span"] for mention_dict in unresolved])
+                for mention_dict, result in zip(unresolved, matches):
+                    if result["nel_score"] < fuzzy_engine.threshold:
+                        remaining.append(mention_dict)
+                        continue
+                    mention_dict["code"] = result["code"]
+                    mention_dict["term"] = result["term"]
+                    mention_dict["nel_score"] = result["nel_score"]
+            hits["fuzzy"] += len(unresolved) - len(remaining)
+
+        if remaining:
+            output = nel_model.run_nel_inference(
+                input_mentions=[mention_dict["span"] for mention_dict in remaining],
+                k=1,
+            )
+            for mention_dict in remaining:
+                mention_dict["code"], mention_dict["term"], mention_dict["nel_score"] = output.loc[mention_dict["span"]]
+            hits["dense"] += len(remaining)
+
+    return nerl_results, hits
+
+
+def cascade_inference_batch(
+        ner_results: list[AnnotationBatch],
+        fuzzy_engines: list[FuzzyMatchMethod],
+        nel_models: list[BiencoderModel],
+    ) -> tuple[list[AnnotationBatch], dict[str, int]]:
+    """
+    :func:`cascade_inference` for columnar NER results, one batch per entity
+    type. Each distinct span goes through the tiers once; the mentions linked
+    by each tier are still counted one by one.
+    """
+    assert len(ner_results) == len(fuzzy_engines) == len(nel_models)
+
+    hits = dict.fromkeys(TIERS, 0)
+    results = []
+    for batch, fuzzy_engine, nel_model in zip(ner_results, fuzzy_engines, nel_models):
+        if not len(batch):
+            results.append(batch)
+            continue
+        mentions = Counter(batch.span)
+        links = {}
+
+        with timed("nel_lexical"):
+            unresolved = []
+            for span in mentions:
+                info = fuzzy_engine.term_to_info.get(fuzzy_engine._normalize(span))
+                if info is None:
+                    unresolved.append(span)
+                    continue
+                term, code = info
+                links[span] = (code, term, 1.0)
+            hits["exact"] += sum(mentions[span] for span in links)
+
+            remaining = []
+            if unresolved:
+                for span, result in zip(unresolved, fuzzy_engine.run_fuzzymatch_batch(unresolved)):
+                    if result["nel_score"] < fuzzy_engine.threshold:
+                        remaining.append(span)
+                        continue
+                    links[span] = (result["code"], result["term"], result["nel_score"])
+            hits["fuzzy"] += sum(mentions[span] for span in unresolved) - sum(mentions[span] for span in remaining)
+
+        if remaining:
+            links.update(nel_model.link(remaining))
+            hits["dense"] += sum(mentions[span] for span in remaining)
+        results.append(batch.with_links(links))
+
+    return results, hits
@@ -1,7 +1,13 @@
 import unicodedata
+import numpy as np
 import pandas as pd
 from rapidfuzz import process, distance, fuzz 
 
+from app.parallelism import rapidfuzz_workers
+
+# Bound on the (mentions x gazetteer terms) score matrix of one cdist call
+CDIST_MAX_CELLS = 2**22
+
 class FuzzyMatchMethod:
     def __init__(self, gaz_path: str, method: str, threshold: float):
         
@@ -69,18 +75,47 @@ class FuzzyMatchMethod:
             else:
                 matched_term = None # no match found
             
-        # store results in dict
+        return self._result(mention, matched_term, score)
+
+    def run_fuzzymatch_batch(self, mentions: list[str]) -> list[dict]:
+        """
+        Same as :meth:`run_fuzzymatch` for every mention, scoring all the
+        distinct non-exact ones against the gazetteer at once with
+        ``rapidfuzz.process.cdist`` on ``RAPIDFUZZ_WORKERS`` threads (see
+        :mod:`app.parallelism`).
+        """
+        scorer = self.SCORERS.get(self.method)
+        if scorer is None:
+            raise ValueError(f"Unkown method: '{self.method}'. Valid options: {list(self.SCORERS)}")
+        score_scale = self.SCORE_SCALE.get(self.method)
+        if not (0 <= self.threshold <= 1):
+            raise ValueError(f"Threshold must be [0, 1] ")
+
+        norm_mentions = [self._normalize(mention) for mention in mentions]
+        # normalized mention -> (matched term or None, score)
+        matches = {norm: (norm, 1.0) for norm in norm_mentions if norm in self.term_to_info}
+        queries = list(dict.fromkeys(norm for norm in norm_mentions if norm not in matches))
+        step = max(1, CDIST_MAX_CELLS // max(1, len(self.clean_terms)))
+        for i in range(0, len(queries), step):
+            chunk = queries[i:i + step]
+            scores = process.cdist(chunk, self.clean_terms, scorer=scorer, dtype=np.float64, workers=rapidfuzz_workers())
+            best = scores.argmax(axis=1)
+            for query, idx, row in zip(chunk, best, scores):
+                score = float(row[idx]) / score_scale
+                matches[query] = (self.clean_terms[idx] if score >= self.threshold else None, score)
+
+        return [self._result(mention, *matches[norm]) for mention, norm in zip(mentions, norm_mentions)]
+
+    def _result(self, mention: str, matched_term, score: float) -> dict:
         original_term, code = self.term_to_info.get(matched_term, (mention, "NO_MAP"))
-        result = {
+        return {
             "nel_class": f"FUZZYMATCH_{self.method.upper()}",
             "code": code,
             "term": original_term,
             "nel_score": score,
         }
-        
-        return result
             
-def fuzzymatch_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str], method: str, threshold: float) -> list[list[list[dict]]]:
+def fuzzymatch_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str | FuzzyMatchMethod], method: str, threshold: float) -> list[list[list[dict]]]:
 
     assert len(ner_results) == len(gaz_pths)
 
@@ -91,13 +126,12 @@ def fuzzymatch_inference(ner_results: list[list[list[dict]]], gaz_pths: list[str
         if len(mentions) == 0:
             continue
 
-        fuzzy_engine = FuzzyMatchMethod(gaz_path = gaz, method = method, threshold = threshold)
+        fuzzy_engine = gaz if isinstance(gaz, FuzzyMatchMethod) else FuzzyMatchMethod(gaz_path = gaz, method = method, threshold = threshold)
 
-        for mention_doc in ner_results[ent_type_idx]:
-            for mention_dict in mention_doc:
-                result = fuzzy_engine.run_fuzzymatch(mention_dict['span'])
-                mention_dict["code"] = result["code"]
-                mention_dict["term"] = result["term"]
-                mention_dict["nel_score"] = result["nel_score"]
+        mention_dicts = [mention_dict for mention_doc in ner_results[ent_type_idx] for mention_dict in mention_doc]
+        for mention_dict, result in zip(mention_dicts, fuzzy_engine.run_fuzzymatch_batch(mentions)):
+            mention_dict["code"] = result["code"]
+            mention_dict["term"] = result["term"]
+            mention_dict["nel_score"] = result["nel_score"]
 
     return nerl_results
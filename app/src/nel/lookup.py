@@ -53,14 +53,14 @@ class LookUpMethod:
         return results
 
 
-def lookup_inference(texts: list[str], gaz_pths: list[str]) -> list[list[list[dict]]]:  
+def lookup_inference(texts: list[str], gaz_pths: list[str | LookUpMethod]) -> list[list[list[dict]]]:
     
     results = []
     
     # extract words for each gazetteer
     for gaz in gaz_pths:
     
-        lookup_engine = LookUpMethod(gaz)
+        lookup_engine = gaz if isinstance(gaz, LookUpMethod) else LookUpMethod(gaz)
 
         gaz_results = []
         for text in texts:
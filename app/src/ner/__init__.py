@@ -53,63 +53,169 @@ Behaviour constraints
   back to a different device without logging a warning.
 """
 
+import importlib
 from pathlib import Path
 from typing import Optional
 
-from .encoder_inference_v1 import ner_inference_v1
-from .encoder_inference_v2 import ner_inference_v2
+from .process_pool import NerProcessPool, PooledNerModel
+
+# The backends (torch, transformers, spaCy, ONNX Runtime) are imported on first
+# use, so that importing the package, e.g. for a lookup-only deployment, is cheap.
+_LAZY = {
+    "ner_inference_v1": (".encoder_inference_v1", "ner_inference_v1"),
+    "NerModelV1": (".encoder_inference_v1", "NerModel"),
+    "ner_inference_v2": (".encoder_inference_v2", "ner_inference_v2"),
+    "NerModelV2": (".encoder_inference_v2", "NerModel"),
+    "ner_inference_v3": (".encoder_inference_v3", "ner_inference_v3"),
+    "NerModelV3": (".encoder_inference_v3", "NerModel"),
+    "export_onnx": (".encoder_inference_v3", "export_onnx"),
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _LAZY[name]
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value
+    return value
+
+
+def load_encoder_models(
+    ner_models: list[Path],
+    version: int = 2,
+    agg_strat: Optional[str] = None,
+    lang: str = "es",
+    merge_entities: bool = True,
+    score_mode: str = "mean",
+    precision: Optional[str] = None,
+) -> list:
+    """
+    Load the NER checkpoints once so that callers can keep them resident and
+    pass them back to :func:`encoder_inference` in place of their paths.
+
+    Arguments mirror :func:`encoder_inference`; version-specific ones are
+    ignored by the other backend. ``precision`` (v2 only) overrides
+    ``NER_PRECISION``.
+
+    Returns:
+        One loaded ``NerModel`` per entry of ``ner_models``, in the same order.
+
+    Raises:
+        ValueError: If ``version`` is not a recognised backend identifier.
+    """
+    if version == 1:
+        from .encoder_inference_v1 import NerModel as NerModelV1
+        return [
+            NerModelV1(pth, agg_strat=agg_strat if agg_strat is not None else "first", lang=lang)
+            for pth in ner_models
+        ]
+    elif version == 2:
+        from .encoder_inference_v2 import NerModel as NerModelV2
+        kwargs = {"precision": precision} if precision is not None else {}
+        return [
+            NerModelV2(
+                pth,
+                agg_strat=agg_strat if agg_strat is not None else "simple",
+                merge_entities=merge_entities,
+                score_mode=score_mode,
+                **kwargs,
+            )
+            for pth in ner_models
+        ]
+    elif version == 3:
+        from .encoder_inference_v3 import NerModel as NerModelV3
+        return [
+            NerModelV3(
+                pth,
+                agg_strat=agg_strat if agg_strat is not None else "simple",
+                merge_entities=merge_entities,
+                score_mode=score_mode,
+            )
+            for pth in ner_models
+        ]
+    else:
+        raise ValueError(f"Unknown NER inference version {version!r}. Expected 1, 2 or 3.")
 
 
 def encoder_inference(
     # ── required ────────────────────────────────────────────────────────────
     texts: list[str],
-    ner_models: list[Path],
+    ner_models: list,
     # ── routing ─────────────────────────────────────────────────────────────
     version: int = 2,
     # ── shared ──────────────────────────────────────────────────────────────
     agg_strat: Optional[str] = None,
     # ── v1-only ─────────────────────────────────────────────────────────────
     lang: str = "es",
-    # ── v2-only ─────────────────────────────────────────────────────────────
-    batch_size: int = 16,
+    # ── v2/v3-only ──────────────────────────────────────────────────────────
+    batch_size: Optional[int] = None,
     merge_entities: bool = True,
     score_mode: str = "mean",
-) -> list[list[list[dict]]]:
+    # ── shared, optional ────────────────────────────────────────────────────
+    spans: Optional[list[list[tuple[int, int]]]] = None,
+    columnar: bool = False,
+) -> list:
     """
     Unified entry point for NER inference.
 
     Args:
         texts:          Input texts to annotate.
-        ner_models:     Paths to the model checkpoints.
-        version:        Which inference backend to use (1 or 2). Defaults to 2.
+        ner_models:     Paths to the model checkpoints, or models already
+                        loaded with :func:`load_encoder_models` for the same
+                        ``version``, or handles on the models of one
+                        :class:`NerProcessPool` (which then runs the call on
+                        its workers; the routing arguments are the pool's).
+        version:        Which inference backend to use (1, 2 or 3). Defaults to 2.
+                        3 is v2 served through ONNX Runtime (see
+                        :mod:`.encoder_inference_v3`).
         device:         Torch device string, e.g. ``"cuda"`` or ``"cpu"``.
         agg_strat:      Aggregation strategy passed to the underlying pipeline.
-                        Defaults to ``"first"`` for v1 and ``"simple"`` for v2.
+                        Defaults to ``"first"`` for v1 and ``"simple"`` for v2/v3.
         lang:           **(v1 only)** Language code used for pre/post-processing.
                         Defaults to ``"es"``.
-        batch_size:     **(v2 only)** Number of texts per inference batch.
-                        Defaults to ``16``.
-        merge_entities: **(v2 only)** Whether to merge adjacent entities of the
+        batch_size:     **(v2/v3 only)** Maximum chunks per inference batch.
+                        Defaults to ``None``: batches are bounded by the
+                        models' token budget only (``NER_MAX_BATCH_TOKENS``).
+        merge_entities: **(v2/v3 only)** Whether to merge adjacent entities of the
                         same class. Defaults to ``True``.
-        score_mode:     **(v2 only)** Strategy for aggregating per-token scores
+        score_mode:     **(v2/v3 only)** Strategy for aggregating per-token scores
                         into a single entity score (``"mean"`` | ``"max"`` | ``"min"``).
                         Defaults to ``"mean"``.
+        spans:          Optional ``(start, end)`` spans per text. When given,
+                        only the sentences overlapping one of a text's spans
+                        are run through the models (e.g. to tag negation only
+                        where entities were found).
+        columnar:       **(v2/v3 only)** Return one
+                        :class:`~app.src.annotations.AnnotationBatch` per model
+                        instead of entity dicts.
 
     Returns:
         A three-level nested list ``[text_i][model_j][entity_k]``.
         See the module docstring for the full entity-dict schema.
+        With ``columnar``, a list ``[model_j]`` of batches.
 
     Raises:
-        ValueError: If ``version`` is not a recognised backend identifier.
+        ValueError: If ``version`` is not a recognised backend identifier,
+                    or is 1 with ``columnar``.
     """
+    if ner_models and all(isinstance(m, PooledNerModel) for m in ner_models):
+        pool = ner_models[0].pool
+        assert all(m.pool is pool for m in ner_models), "models of different NER process pools"
+        return pool.infer(texts, [m.index for m in ner_models], spans=spans, columnar=columnar)
+    if version == 1 and columnar:
+        raise ValueError("The v1 NER backend does not return columnar results.")
     if version == 1:
+        from .encoder_inference_v1 import ner_inference_v1
         return ner_inference_v1(
             texts=texts,
             ner_models=ner_models,
             agg_strat=agg_strat if agg_strat is not None else "first",
             lang=lang,
+            spans=spans,
         )
     elif version == 2:
+        from .encoder_inference_v2 import ner_inference_v2
         return ner_inference_v2(
             texts=texts,
             ner_models=ner_models,
@@ -117,6 +223,20 @@ def encoder_inference(
             batch_size=batch_size,
             merge_entities=merge_entities,
             score_mode=score_mode,
+            spans=spans,
+            columnar=columnar,
+        )
+    elif version == 3:
+        from .encoder_inference_v3 import ner_inference_v3
+        return ner_inference_v3(
+            texts=texts,
+            ner_models=ner_models,
+            agg_strat=agg_strat if agg_strat is not None else "simple",
+            batch_size=batch_size,
+            merge_entities=merge_entities,
+            score_mode=score_mode,
+            spans=spans,
+            columnar=columnar,
         )
     else:
-        raise ValueError(f"Unknown NER inference version {version!r}. Expected 1 or 2.")
\ No newline at end of file
+        raise ValueError(f"Unknown NER inference version {version!r}. Expected 1, 2 or 3.")
\ No newline at end of file
@@ -9,34 +9,47 @@ Usage example:
 
 Author: Jan Rodríguez Miret
 """
+import importlib
+import threading
 import torch
 from transformers import pipeline
 from pathlib import Path
+from typing import Optional, Union
 from app.config import device
-from spacy.lang.es import Spanish
-from spacy.lang.en import English
-from spacy.lang.it import Italian
-from spacy.lang.ro import Romanian
-from spacy.lang.cs import Czech      # 'cz' is non-standard; Czech ISO 639-1 is 'cs'
-from spacy.lang.sv import Swedish    # 'se' is Northern Sami; Swedish is 'sv'
-from spacy.lang.nl import Dutch
-
-from app.utils.text_preprocessing import pretokenize_sentence
+from app.metrics import counter, timed
+from app.parallelism import apply_torch_parallelism
+
+from app.utils.text_preprocessing import make_overlap_test, pretokenize_sentence, SKIPPED_SENTENCES
 from app.utils.results_postprocessing import align_results
 
-SPACY_LANG_MAP: dict[str, type] = {
-    'es': Spanish,
-    'en': English,
-    'it': Italian,
-    'ro': Romanian,
-    'cz': Czech,   # non-standard code, mapped to Czech
-    'cs': Czech,   # standard code also supported
-    'se': Swedish, # ambiguous code, mapped to Swedish
-    'sv': Swedish, # standard code also supported
-    'nl': Dutch,
+CHUNKS = counter("ner_chunks_total", "Chunks forwarded through a NER model")
+
+# Language code -> (spacy.lang module, class). Only the language of a model is
+# imported, when the model is loaded.
+SPACY_LANG_MAP: dict[str, tuple[str, str]] = {
+    'es': ("spacy.lang.es", "Spanish"),
+    'en': ("spacy.lang.en", "English"),
+    'it': ("spacy.lang.it", "Italian"),
+    'ro': ("spacy.lang.ro", "Romanian"),
+    'cz': ("spacy.lang.cs", "Czech"),    # non-standard code, mapped to Czech (ISO 639-1 is 'cs')
+    'cs': ("spacy.lang.cs", "Czech"),    # standard code also supported
+    'se': ("spacy.lang.sv", "Swedish"),  # ambiguous code (Northern Sami), mapped to Swedish
+    'sv': ("spacy.lang.sv", "Swedish"),  # standard code also supported
+    'nl': ("spacy.lang.nl", "Dutch"),
 }
 
 
+def spacy_language(lang: str) -> type:
+    """The spaCy ``Language`` class for *lang*, imported on first use."""
+    if lang not in SPACY_LANG_MAP:
+        raise ValueError(
+            f"Unsupported language '{lang}'. "
+            f"Supported codes: {sorted(SPACY_LANG_MAP.keys())}"
+        )
+    module, cls = SPACY_LANG_MAP[lang]
+    return getattr(importlib.import_module(module), cls)
+
+
 class NerModel:
     def __init__(
         self,
@@ -44,16 +57,14 @@ class NerModel:
         agg_strat: str = "first",
         lang: str = "es",
     ):
-        lang_class = SPACY_LANG_MAP.get(lang)
-        if lang_class is None:
-            raise ValueError(
-                f"Unsupported language '{lang}'. "
-                f"Supported codes: {sorted(SPACY_LANG_MAP.keys())}"
-            )
-        self.nlp = lang_class()
+        apply_torch_parallelism()
+        self.nlp = spacy_language(lang)()
         self.nlp.add_pipe("sentencizer")
 
         self.device = device
+        self.name = Path(model_checkpoint).name
+        # The HF pipeline is not safe to call concurrently (see v2)
+        self._lock = threading.Lock()
 
         self.pipe = pipeline(
             task="token-classification",
@@ -66,7 +77,9 @@ class NerModel:
         # Pretokenize sentence for model compatibility
         sentence_pretokenized, added_spaces_pos = pretokenize_sentence(sentence)
         # Run model inference
-        results_pre = self.pipe(sentence_pretokenized)
+        CHUNKS.inc(model=self.name)
+        with timed("ner_forward"):
+            results_pre = self.pipe(sentence_pretokenized)
         # Convert numpy types to native Python types for JSON serialization
         for entity in results_pre:
             str_score = entity.pop('score')
@@ -75,32 +88,44 @@ class NerModel:
         results = align_results(results_pre, added_spaces_pos, sentence_start_offset)
         return results
 
-    def _process_text(self, text: str) -> list[dict]:
+    def _process_text(self, text: str, spans: Optional[list[tuple[int, int]]] = None) -> list[dict]:
         results_text = []
+        overlaps = make_overlap_test(spans) if spans is not None else None
         line_start_offset = 0  # Track the offset of the start of each line in the file
         for line in text.splitlines():
-            doc = self.nlp(line)
-            sents = list(doc.sents)
+            with timed("sentence_split"):
+                doc = self.nlp(line)
+                sents = list(doc.sents)
             for sentence in sents:
+                if overlaps is not None and not overlaps(sentence.start_char + line_start_offset, sentence.end_char + line_start_offset):
+                    SKIPPED_SENTENCES.inc()
+                    continue
                 results_sent = self._process_sentence(sentence.text, sentence.start_char + line_start_offset)
                 results_text.extend(results_sent)
             line_start_offset += len(line) + 1 # account for the '\n' character
         return results_text
     
-    def infer(self, texts: list[str]) -> list[list[dict]]:
-        return [self._process_text(text) for text in texts]
+    def infer(self, texts: list[str], spans: Optional[list[list[tuple[int, int]]]] = None) -> list[list[dict]]:
+        """With *spans* (per text), only sentences overlapping one of them are run through the model."""
+        doc_spans = spans if spans is not None else [None] * len(texts)
+        with self._lock:
+            return [self._process_text(text, text_spans) for text, text_spans in zip(texts, doc_spans)]
 
 
 
 def ner_inference_v1(
     texts: list[str],
-    ner_models: list[Path],
+    ner_models: list[Union[Path, NerModel]],
     agg_strat: str = "first",
     lang: str = "es",
+    spans: Optional[list[list[tuple[int, int]]]] = None,
 ) -> list[list[list[dict]]]:
     results = []
-    for model_checkpoint in ner_models:
-        ner_model = NerModel(model_checkpoint, agg_strat=agg_strat, lang=lang)
-        results_model = ner_model.infer(texts)
+    for model_or_path in ner_models:
+        if isinstance(model_or_path, NerModel):
+            ner_model = model_or_path
+        else:
+            ner_model = NerModel(model_or_path, agg_strat=agg_strat, lang=lang)
+        results_model = ner_model.infer(texts, spans=spans)
         results.append(results_model)
     return results
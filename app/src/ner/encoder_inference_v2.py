@@ -5,19 +5,46 @@ Performs NER (token classification) inference using a HuggingFace Transformers m
 Unlike v1, this module does NOT rely on spaCy for sentence splitting or
 pretokenization. Instead, it uses NLTK's PunktSentenceTokenizer for sentence segmentation
 and handles long sentences by splitting them into token-safe chunks using the model's own
-tokenizer. Inference is run in batches for efficiency.
+tokenizer. Inference is run over the chunks of all documents together, in
+batches bounded by a token budget (see :mod:`app.utils.token_batching`).
+Chunks predicted before are taken from the chunk cache instead (see
+:mod:`app.utils.chunk_cache`).
 
 Span offsets in the output are always relative to the original (unmodified) input text.
 
 Author: Fernando Gallego
 """
 
+import threading
+from operator import itemgetter
 from pathlib import Path
+from typing import Optional, Union
+
 from transformers import pipeline
-from app.config import device
+from app.config import NER_MAX_BATCH_TOKENS, NER_PRECISION, device
+from app.metrics import counter, timed
+from app.parallelism import apply_torch_parallelism
 
+from app.src.annotations import AnnotationBatch
+from app.utils.chunk_cache import cache_namespace, get_chunk_cache
 from app.utils.text_preprocessing import build_inference_chunks
+from app.utils.precision import apply_precision
 from app.utils.results_postprocessing import merge_contiguous_entities
+from app.utils.token_batching import TokenBudget
+
+CHUNKS = counter("ner_chunks_total", "Chunks forwarded through a NER model")
+
+
+def safe_max_length(tokenizer, model_config) -> int:
+    """Effective max token length of a chunk, leaving room for the special tokens."""
+    tokenizer_max = getattr(tokenizer, "model_max_length", 512)
+    model_max = getattr(model_config, "max_position_embeddings", 512)
+    special_tokens_getter = getattr(tokenizer, "num_special_tokens_to_add", lambda pair=False: 2 if pair else 1) # Fallback: if the tokenizer doesn't have the method, we define a lambda that returns a standard offset.
+    if not isinstance(tokenizer_max, int) or tokenizer_max <= 0:
+        tokenizer_max = 512
+    if not isinstance(model_max, int) or model_max <= 0:
+        model_max = 512
+    return min(tokenizer_max, model_max) - special_tokens_getter(pair=False)
 
 
 class NerModel:
@@ -27,7 +54,8 @@ class NerModel:
 
     Long sentences are split at token boundaries to respect the
     model's maximum sequence length.  Inference is batched across all chunks of
-    a document for throughput efficiency.
+    the documents of a call, grouping chunks of similar length so that each
+    padded batch holds at most ``max_batch_tokens`` tokens.
 
     Args:
         model_checkpoint: Path to a local HuggingFace model directory.
@@ -39,6 +67,13 @@ class NerModel:
                           after inference (see :func:`merge_contiguous_entities`).
         score_mode:       Score aggregation mode used during entity merging
                           (``"mean"``, ``"max"``, or ``"min"``).
+        precision:        ``"fp32"``, ``"int8"`` or ``"bf16"`` (see
+                          :func:`app.utils.precision.apply_precision`).
+        max_batch_tokens: Token budget of one batch (see
+                          :class:`app.utils.token_batching.TokenBudget`).
+        chunk_cache:      Reuse the predictions of chunks seen before (see
+                          :mod:`app.utils.chunk_cache`), when the cache is
+                          enabled.
     """
 
     def __init__(
@@ -47,10 +82,24 @@ class NerModel:
         agg_strat: str = "simple",
         merge_entities: bool = True,
         score_mode: str = "mean",
+        precision: str = NER_PRECISION,
+        max_batch_tokens: int = NER_MAX_BATCH_TOKENS,
+        chunk_cache: bool = True,
     ):
+        apply_torch_parallelism()
         self.device = device
+        self.name = Path(model_checkpoint).name
         self.merge_entities = merge_entities
         self.score_mode = score_mode
+        self.token_budget = TokenBudget(max_batch_tokens, self.name)
+        self.chunk_cache = get_chunk_cache() if chunk_cache else None
+        if self.chunk_cache is not None:
+            self.cache_namespace = cache_namespace(
+                model_checkpoint, "hf", agg_strat=agg_strat, precision=precision, device=self.device
+            )
+        # The HF pipeline and its tokenizer are not safe to call concurrently;
+        # the model may be shared by several pipelines and request threads.
+        self._lock = threading.Lock()
 
         self.pipe = pipeline(
             task="token-classification",
@@ -59,94 +108,141 @@ class NerModel:
             device=self.device,
             stride=256,
         )
+        self.pipe.model = apply_precision(self.pipe.model, precision, self.device)
 
-        # Compute the effective max token length the model can handle
-        tokenizer_max = getattr(self.pipe.tokenizer, "model_max_length", 512)
-        model_max = getattr(self.pipe.model.config, "max_position_embeddings", 512)
-        special_tokens_getter = getattr(self.pipe.tokenizer, "num_special_tokens_to_add", lambda pair=False: 2 if pair else 1) # Fallback: if the tokenizer doesn't have the method, we define a lambda that returns a standard offset.
-        if not isinstance(tokenizer_max, int) or tokenizer_max <= 0:
-            tokenizer_max = 512
-        if not isinstance(model_max, int) or model_max <= 0:
-            model_max = 512
-
-        self.safe_max_length = min(tokenizer_max, model_max) - special_tokens_getter(pair=False)
+        self.tokenizer = self.pipe.tokenizer
+        self.safe_max_length = safe_max_length(self.tokenizer, self.pipe.model.config)
 
-    def _predict_chunks(self, text: str, filename: str, batch_size: int) -> list[dict]:
+    def _forward(self, texts: list[str], batch_size: int) -> list[list[dict]]:
         """
-        Segment *text* into token-safe chunks, run batched inference, and return
-        a flat list of entity dicts with offsets adjusted to *text*.
-
-        Each entity dict contains:
-            ``filename``, ``sent_id``, ``label``, ``start``, ``end``,
-            ``score``, ``span``.
+        Run the model over *texts* (chunks that fit the model) and return, per
+        text, the aggregated predictions of the HF token-classification
+        pipeline: dicts with ``entity_group``, ``score``, ``start`` and ``end``
+        (offsets relative to the text). Other backends override this.
         """
-        chunks = build_inference_chunks(text, self.pipe.tokenizer, self.safe_max_length)
-        if not chunks:
-            return []
+        return self.pipe(texts, batch_size=batch_size)
 
-        raw_preds = self.pipe([c["text"] for c in chunks], batch_size=batch_size)
-
-        entities = []
-        for chunk, preds in zip(chunks, raw_preds):
-            for pred in preds:
-                # Offsets from the pipeline are relative to the chunk text;
-                # adding chunk["start"] converts them to offsets in *text*.
-                global_start = chunk["start"] + int(pred["start"])
-                global_end   = chunk["start"] + int(pred["end"])
-
-                if not (0 <= global_start < global_end <= len(text)):
-                    continue  # Discard malformed spans
-
-                entities.append({
-                    "filename": filename,
-                    "sent_id":  chunk["sent_id"],
-                    "start":    global_start,
-                    "end":      global_end,
-                    "ner_score":    round(float(pred.get("score", 0.0)), 4),
-                    "span":     text[global_start:global_end],
-                    "ner_class":    pred.get("entity_group", pred.get("entity")),
-                })
-
-        entities.sort(key=lambda e: (e["filename"], e["start"], e["end"]))
-        return entities
-
-    def _process_text(self, text: str, filename: str, batch_size: int) -> list[dict]:
+    def _forward_batched(self, chunks: list[dict], batch_size: Optional[int] = None) -> list[list[dict]]:
         """
-        Run full inference on a single *text* document and return its entities.
-
-        Calls :meth:`_predict_chunks` and optionally merges contiguous entities
-        via :func:`merge_contiguous_entities`.
-
-        Removes the filename and sentence id that are only used for the merging, and have no use outside of it
+        :meth:`_forward` over *chunks*, in batches within :attr:`token_budget`
+        (and of at most *batch_size* chunks). Returns the predictions in the
+        order of *chunks*.
         """
-        entities = self._predict_chunks(text, filename, batch_size)
-        if self.merge_entities and entities:
-            entities = merge_contiguous_entities(entities, text, score_mode=self.score_mode)
+        # +2 for the special tokens (e.g. [CLS] / [SEP]) added to every chunk
+        lengths = [c["n_tokens"] + 2 for c in chunks]
+        return self.token_budget.run(
+            [c["text"] for c in chunks], lengths,
+            lambda batch: self._forward(batch, len(batch)),
+            max_items=batch_size,
+        )
 
-        keys_to_remove = {"filename", "sent_id"}
-        for ann in entities:
-            for k in keys_to_remove:
-                del ann[k] # assume the key always exists  (which it does), if not use ann.pop(k, None)
-        return entities
+    def _forward_cached(self, chunks: list[dict], batch_size: Optional[int] = None) -> list[list[dict]]:
+        """
+        :meth:`_forward_batched` over the *chunks* missing from the chunk
+        cache; the predictions of the others are reused. Returns the
+        predictions in the order of *chunks*.
+        """
+        if self.chunk_cache is None:
+            CHUNKS.inc(len(chunks), model=self.name)
+            return self._forward_batched(chunks, batch_size)
+
+        texts = [c["text"] for c in chunks]
+        preds = self.chunk_cache.get_many(self.cache_namespace, texts, model=self.name)
+        # A chunk repeated within the call is forwarded once
+        todo: dict[str, list[int]] = {}
+        for i, (text, cached) in enumerate(zip(texts, preds)):
+            if cached is None:
+                todo.setdefault(text, []).append(i)
+        if todo:
+            CHUNKS.inc(len(todo), model=self.name)
+            fresh = self._forward_batched([chunks[idx[0]] for idx in todo.values()], batch_size)
+            self.chunk_cache.put_many(self.cache_namespace, list(todo), fresh)
+            for idx, chunk_preds in zip(todo.values(), fresh):
+                for i in idx:
+                    preds[i] = chunk_preds
+        return preds
+
+    def _to_batch(self, texts: list[str], doc_chunks: list[list[dict]], raw_preds: list[list[dict]]) -> AnnotationBatch:
+        """
+        Turn the predictions *raw_preds* for the chunks *doc_chunks* of
+        *texts* into an :class:`AnnotationBatch`, with offsets adjusted to each
+        text and sorted by start and end within it, and optionally merge
+        contiguous entities via :func:`merge_contiguous_entities`.
+        """
+        counts, rows, spans = [], [], []
+        offset = 0
+        for text, chunks in zip(texts, doc_chunks):
+            text_rows = []
+            for chunk, preds in zip(chunks, raw_preds[offset:offset + len(chunks)]):
+                # Offsets from the pipeline are relative to the chunk text;
+                # adding chunk["start"] converts them to offsets in *text*.
+                base = chunk["start"]
+                text_rows.extend(
+                    (base + int(pred["start"]), base + int(pred["end"]), pred)
+                    for pred in preds
+                )
+            offset += len(chunks)
+
+            # Discard malformed spans
+            text_rows = [row for row in text_rows if 0 <= row[0] < row[1] <= len(text)]
+            text_rows.sort(key=itemgetter(0, 1))
+            counts.append(len(text_rows))
+            rows.extend(text_rows)
+            spans.extend(text[start:end] for start, end, _ in text_rows)
+
+        batch = AnnotationBatch.from_rows(
+            counts,
+            [start for start, _, _ in rows],
+            [end for _, end, _ in rows],
+            [round(float(pred.get("score", 0.0)), 4) for _, _, pred in rows],
+            [pred.get("entity_group", pred.get("entity")) for _, _, pred in rows],
+            spans,
+        )
+        if self.merge_entities and len(batch):
+            with timed("ner_merge"):
+                batch = merge_contiguous_entities(batch, texts, score_mode=self.score_mode)
+        return batch
 
-    def infer(self, texts: list[str], batch_size: int = 16) -> list[list[dict]]:
+    def infer_batch(self, texts: list[str], batch_size: Optional[int] = None, spans: Optional[list[list[tuple[int, int]]]] = None) -> AnnotationBatch:
         """
         Run inference on a list of documents.
 
+        Every document is segmented into token-safe chunks, and the chunks of
+        all documents are forwarded together in batches of similar length
+        (see :meth:`_forward_batched`), except those found in the chunk cache
+        (see :meth:`_forward_cached`).
+
         Args:
             texts:      Input documents as plain strings.
-            batch_size: Number of chunks forwarded to the model in a single
-                        GPU/CPU batch.
+            batch_size: Maximum number of chunks forwarded to the model in a
+                        single GPU/CPU batch. By default batches are only
+                        bounded by the token budget.
+            spans:      Optional ``(start, end)`` spans per document. Only the
+                        sentences overlapping one of its spans are run through
+                        the model; the rest yield no entities.
 
         Returns:
-            A list of length ``len(texts)``, where each element is the list of
-            entity dicts predicted for that document.
+            The entities of the documents, as an :class:`AnnotationBatch`.
+        """
+        doc_spans = spans if spans is not None else [None] * len(texts)
+        with self._lock:
+            doc_chunks = [
+                build_inference_chunks(text, self.tokenizer, self.safe_max_length, spans=text_spans)
+                for text, text_spans in zip(texts, doc_spans)
+            ]
+            chunks = [chunk for text_chunks in doc_chunks for chunk in text_chunks]
+            raw_preds = []
+            if chunks:
+                with timed("ner_forward"):
+                    raw_preds = self._forward_cached(chunks, batch_size)
+        return self._to_batch(texts, doc_chunks, raw_preds)
+
+    def infer(self, texts: list[str], batch_size: Optional[int] = None, spans: Optional[list[list[tuple[int, int]]]] = None) -> list[list[dict]]:
         """
-        filenames = [f"doc_{i}" for i in range(len(texts))]
-        return [
-            self._process_text(text, filename, batch_size)
-            for text, filename in zip(texts, filenames)
-        ]
+        :meth:`infer_batch`, returning a list of length ``len(texts)``, where
+        each element is the list of entity dicts predicted for that document.
+        """
+        return self.infer_batch(texts, batch_size=batch_size, spans=spans).to_dicts()
 
 
 # ---------------------------------------------------------------------------
@@ -155,12 +251,14 @@ class NerModel:
 
 def ner_inference_v2(
     texts: list[str],
-    ner_models: list[Path],
+    ner_models: list[Union[Path, NerModel]],
     agg_strat: str = "simple",
-    batch_size: int = 16,
+    batch_size: Optional[int] = None,
     merge_entities: bool = True,
     score_mode: str = "mean",
-) -> list[list[list[dict]]]:
+    spans: Optional[list[list[tuple[int, int]]]] = None,
+    columnar: bool = False,
+) -> Union[list[list[list[dict]]], list[AnnotationBatch]]:
     """
     Run NER inference across multiple models and multiple documents.
 
@@ -169,23 +267,35 @@ def ner_inference_v2(
 
     Args:
         texts:          Input documents as plain strings.
-        ner_models:     Paths to one or more HuggingFace model directories.
+        ner_models:     Paths to one or more HuggingFace model directories, or
+                        already-loaded :class:`NerModel` instances (reused as-is,
+                        so resident models skip the load step).
         device:         Torch device. Auto-detected if None.
         agg_strat:      Token aggregation strategy for the HF pipeline.
-        batch_size:     Chunk batch size for GPU inference.
+        batch_size:     Maximum chunks per batch; by default only the models'
+                        token budget bounds a batch.
         merge_entities: Whether to merge contiguous same-label entities.
         score_mode:     Score aggregation for merged entities.
+        spans:          Optional ``(start, end)`` spans per document restricting
+                        inference to the sentences they overlap.
+        columnar:       Return one :class:`AnnotationBatch` per model instead
+                        of entity dicts.
 
     Returns:
-        A list of shape ``[n_models][n_texts][n_entities]``.
+        A list of shape ``[n_models][n_texts][n_entities]``, or ``[n_models]``
+        batches when *columnar*.
     """
     results = []
-    for model_checkpoint in ner_models:
-        model = NerModel(
-            model_checkpoint,
-            agg_strat=agg_strat,
-            merge_entities=merge_entities,
-            score_mode=score_mode,
-        )
-        results.append(model.infer(texts, batch_size=batch_size))
+    for model_or_path in ner_models:
+        if isinstance(model_or_path, NerModel):
+            model = model_or_path
+        else:
+            model = NerModel(
+                model_or_path,
+                agg_strat=agg_strat,
+                merge_entities=merge_entities,
+                score_mode=score_mode,
+            )
+        infer = model.infer_batch if columnar else model.infer
+        results.append(infer(texts, batch_size=batch_size, spans=spans))
     return results
\ No newline at end of file
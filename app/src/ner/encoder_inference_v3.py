@@ -0,0 +1,279 @@
+"""
+encoder_inference_v3.py
+
+v2 inference (NLTK sentence splitting, token-safe chunking, entity merging)
+with the forward pass run by ONNX Runtime instead of eager PyTorch.
+
+Each checkpoint is exported once to ``<checkpoint>/onnx/`` (see
+:func:`export_onnx`, called by ``ModelManager.sanitize`` and, if the export is
+missing or stale, on load): a plain ONNX graph, and a copy with ONNX Runtime's
+graph optimizations (constant folding, attention/GELU/LayerNorm fusion)
+applied, which is the one served. Token aggregation follows the HF
+token-classification pipeline, so entities, offsets and scores match v2.
+
+Requires the ``onnx`` extra (``uv sync --extra onnx``).
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import torch
+
+from app.config import NER_MAX_BATCH_TOKENS, device
+from app.parallelism import apply_torch_parallelism
+from app.src.annotations import AnnotationBatch
+from app.utils.chunk_cache import cache_namespace, get_chunk_cache
+from app.utils.token_batching import TokenBudget
+from .encoder_inference_v2 import NerModel as NerModelV2, safe_max_length
+
+logger = logging.getLogger(__name__)
+
+ONNX_DIRNAME = "onnx"
+ONNX_OPSET = 17
+AGG_STRATS = ("simple", "first", "average", "max")
+
+
+def onnx_path(model_checkpoint: Path) -> Path:
+    """The optimized graph served for *model_checkpoint*."""
+    return Path(model_checkpoint) / ONNX_DIRNAME / "model.opt.onnx"
+
+
+def _is_stale(model_checkpoint: Path) -> bool:
+    target = onnx_path(model_checkpoint)
+    if not target.exists():
+        return True
+    weights = [*Path(model_checkpoint).glob("*.safetensors"), *Path(model_checkpoint).glob("pytorch_model*.bin")]
+    return any(w.stat().st_mtime > target.stat().st_mtime for w in weights)
+
+
+def export_onnx(model_checkpoint: Path, force: bool = False) -> Path:
+    """
+    Export *model_checkpoint* to ONNX and save an optimized copy next to it.
+    A no-op when the export is newer than the checkpoint's weights.
+
+    Returns:
+        Path of the optimized graph.
+    """
+    import onnxruntime as ort
+    import torch
+    from transformers import AutoModelForTokenClassification, AutoTokenizer
+
+    model_checkpoint = Path(model_checkpoint)
+    target = onnx_path(model_checkpoint)
+    if not force and not _is_stale(model_checkpoint):
+        return target
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    raw = target.parent / "model.onnx"
+    tokenizer = AutoTokenizer.from_pretrained(str(model_checkpoint))
+    model = AutoModelForTokenClassification.from_pretrained(str(model_checkpoint)).eval()
+
+    dummy = tokenizer(["a", "a longer sample text"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class _Logits(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Logits(),
+            tuple(dummy[name] for name in input_names),
+            str(raw),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes={name: dynamic for name in [*input_names, "logits"]},
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+
+    # Offline optimization, kept to the hardware-independent ("extended")
+    # level; layout optimizations for the serving CPU are applied on load.
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = str(target)
+    ort.InferenceSession(str(raw), options, providers=["CPUExecutionProvider"])
+    logger.info("Exported %s to %s", model_checkpoint, target)
+    return target
+
+
+def _get_tag(label: str) -> tuple[str, str]:
+    if label.startswith("B-") or label.startswith("I-"):
+        return label[0], label[2:]
+    return "I", label
+
+
+class NerModel(NerModelV2):
+    """
+    :class:`~app.src.ner.encoder_inference_v2.NerModel` served through ONNX
+    Runtime. Arguments are the same; ``agg_strat`` is one of
+    :data:`AGG_STRATS`.
+    """
+
+    def __init__(
+        self,
+        model_checkpoint: Path,
+        agg_strat: str = "simple",
+        merge_entities: bool = True,
+        score_mode: str = "mean",
+        max_batch_tokens: int = NER_MAX_BATCH_TOKENS,
+        chunk_cache: bool = True,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        apply_torch_parallelism()
+        if agg_strat not in AGG_STRATS:
+            raise ValueError(f"Unsupported aggregation strategy {agg_strat!r} for NER v3. Expected one of {AGG_STRATS}.")
+        if _is_stale(model_checkpoint):
+            logger.warning("No up-to-date ONNX export for %s; exporting now.", model_checkpoint)
+            export_onnx(model_checkpoint)
+
+        self.device = device
+        self.name = Path(model_checkpoint).name
+        self.agg_strat = agg_strat
+        self.merge_entities = merge_entities
+        self.score_mode = score_mode
+        self.token_budget = TokenBudget(max_batch_tokens, self.name)
+        self.chunk_cache = get_chunk_cache() if chunk_cache else None
+        if self.chunk_cache is not None:
+            self.cache_namespace = cache_namespace(model_checkpoint, "onnx", agg_strat=agg_strat, device=self.device)
+        self._lock = threading.Lock()
+
+        config = AutoConfig.from_pretrained(str(model_checkpoint))
+        self.id2label = {int(i): label for i, label in config.id2label.items()}
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_checkpoint))
+        self.safe_max_length = safe_max_length(self.tokenizer, config)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Same per-process thread budget as torch (see gunicorn.conf.py)
+        options.intra_op_num_threads = torch.get_num_threads()
+        providers = ["CPUExecutionProvider"]
+        if self.device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(str(onnx_path(model_checkpoint)), options, providers=providers)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        backend = getattr(self.tokenizer, "_tokenizer", None)
+        self._subword_prefix = getattr(getattr(backend, "model", None), "continuing_subword_prefix", None)
+
+    def _forward(self, texts: list[str], batch_size: int) -> list[list[dict]]:
+        # Batch chunks of similar length together to keep padding low (a no-op
+        # for the single, length-sorted batches of _forward_batched)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        preds: list[list[dict]] = [[] for _ in texts]
+        for b in range(0, len(order), batch_size):
+            idx = order[b:b + batch_size]
+            enc = self.tokenizer(
+                [texts[i] for i in idx],
+                padding=True,
+                return_offsets_mapping=True,
+                return_special_tokens_mask=True,
+                return_tensors="np",
+            )
+            logits = self.session.run(["logits"], {name: enc[name].astype(np.int64) for name in self.input_names})[0]
+            shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs = shifted / shifted.sum(axis=-1, keepdims=True)
+            for row, i in enumerate(idx):
+                preds[i] = self._aggregate(texts[i], probs[row], enc, row)
+        return preds
+
+    def _aggregate(self, text: str, probs: np.ndarray, enc, row: int) -> list[dict]:
+        """Group token scores into entities, as the HF token-classification pipeline does."""
+        offsets = enc["offset_mapping"][row]
+        special = enc["special_tokens_mask"][row]
+        input_ids = enc["input_ids"][row]
+        token_strs = enc.tokens(row)
+        # (start, end, scores, is_subword) per non-special token
+        tokens = []
+        for t in range(len(probs)):
+            if special[t]:
+                continue
+            start, end = int(offsets[t][0]), int(offsets[t][1])
+            if input_ids[t] == self.tokenizer.unk_token_id:
+                is_subword = False
+            elif self._subword_prefix:
+                is_subword = len(token_strs[t]) != end - start
+            else:
+                is_subword = start > 0 and " " not in text[start - 1:start + 1]
+            tokens.append((start, end, probs[t], is_subword))
+        # (label, score, start, end) per token ("simple") or per word
+        if self.agg_strat == "simple":
+            units = [(self.id2label[int(p.argmax())], float(p.max()), s, e) for s, e, p, _ in tokens]
+        else:
+            words: list[list] = []
+            for token in tokens:
+                if words and token[3]:
+                    words[-1].append(token)
+                else:
+                    words.append([token])
+            units = [self._aggregate_word(word) for word in words]
+
+        groups: list[list] = []
+        for unit in units:
+            bi, tag = _get_tag(unit[0])
+            if groups and bi != "B" and tag == _get_tag(groups[-1][-1][0])[1]:
+                groups[-1].append(unit)
+            else:
+                groups.append([unit])
+        entities = []
+        for group in groups:
+            label = group[0][0].split("-", 1)[-1]
+            if label == "O":
+                continue
+            entities.append({
+                "entity_group": label,
+                "score": float(np.nanmean([u[1] for u in group])),
+                "start": group[0][2],
+                "end": group[-1][3],
+            })
+        return entities
+
+    def _aggregate_word(self, word: list) -> tuple:
+        if self.agg_strat == "first":
+            scores = word[0][2]
+        elif self.agg_strat == "max":
+            scores = max(word, key=lambda token: token[2].max())[2]
+        else:  # average
+            scores = np.stack([token[2] for token in word]).mean(axis=0)
+        idx = int(scores.argmax())
+        return self.id2label[idx], float(scores[idx]), word[0][0], word[-1][1]
+
+
+# ---------------------------------------------------------------------------
+# Module-level convenience function
+# ---------------------------------------------------------------------------
+
+def ner_inference_v3(
+    texts: list[str],
+    ner_models: list[Union[Path, NerModel]],
+    agg_strat: str = "simple",
+    batch_size: Optional[int] = None,
+    merge_entities: bool = True,
+    score_mode: str = "mean",
+    spans: Optional[list[list[tuple[int, int]]]] = None,
+    columnar: bool = False,
+) -> Union[list[list[list[dict]]], list[AnnotationBatch]]:
+    """Same as :func:`~app.src.ner.encoder_inference_v2.ner_inference_v2`, through ONNX Runtime."""
+    results = []
+    for model_or_path in ner_models:
+        if isinstance(model_or_path, NerModel):
+            model = model_or_path
+        else:
+            model = NerModel(
+                model_or_path,
+                agg_strat=agg_strat,
+                merge_entities=merge_entities,
+                score_mode=score_mode,
+            )
+        infer = model.infer_batch if columnar else model.infer
+        results.append(infer(texts, batch_size=batch_size, spans=spans))
+    return results
@@ -0,0 +1,206 @@
+"""
+process_pool.py
+
+NER inference on a pool of worker processes.
+
+On many-core CPU nodes a single torch process does not scale linearly with
+its thread count for small batches. :class:`NerProcessPool` keeps ``workers``
+spawned processes instead, each with every NER model of the pool loaded and
+``threads`` torch threads. :func:`~app.src.ner.encoder_inference` hands the
+documents of a call to the pool in contiguous shards of similar length (a few
+per worker, so that workers that finish early pick up the rest) and
+reassembles the results in input order.
+
+Pipelines use a pool when built with ``ner_workers > 0`` (``NER_WORKERS``):
+they get one :class:`PooledNerModel` handle per model in place of the loaded
+models, and pass the handles to ``encoder_inference`` as usual.
+
+Workers are started by :meth:`NerProcessPool.start` in the process that uses
+the pool; a process forked afterwards starts its own. Their memory is not
+part of the pipeline cache budget.
+"""
+
+import logging
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from app.parallelism import ENV_VARS, current_parallelism
+
+logger = logging.getLogger(__name__)
+
+# Shards per worker in one call: enough for load balancing, few enough that
+# each shard still fills a batch.
+SHARDS_PER_WORKER = 2
+
+# Worker process state, set by _init_worker
+_models: list = []
+_options: dict = {}
+
+
+def _init_worker(paths: list[str], version: int, agg_strat: Optional[str], lang: str, threads: int) -> None:
+    # The pool's thread budget, not the parent's environment, applies here
+    os.environ[ENV_VARS["torch_threads"]] = str(threads)
+    os.environ[ENV_VARS["rapidfuzz_workers"]] = "1"
+    os.environ[ENV_VARS["tokenizers_parallelism"]] = "false"
+    from app.parallelism import configure_parallelism
+    from app.src.ner import load_encoder_models
+
+    configure_parallelism()
+    global _models, _options
+    _models = load_encoder_models([Path(p) for p in paths], version=version, agg_strat=agg_strat, lang=lang)
+    _options = {"version": version, "agg_strat": agg_strat, "lang": lang}
+
+
+def _infer_shard(texts: list[str], model_idx: list[int], spans: Optional[list], columnar: bool = False) -> list:
+    from app.src.ner import encoder_inference
+
+    return encoder_inference(texts, [_models[i] for i in model_idx], spans=spans, columnar=columnar, **_options)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _shards(lengths: list[int], n: int) -> list[tuple[int, int]]:
+    """Split ``range(len(lengths))`` into at most *n* contiguous ``(start, end)`` ranges of similar total length."""
+    n = max(1, min(n, len(lengths)))
+    target = max(1, sum(lengths)) / n
+    bounds, start, acc, shard = [], 0, 0, 0
+    for i, length in enumerate(lengths):
+        # Each item goes to the shard its midpoint falls in
+        item_shard = min(n - 1, int((acc + length / 2) // target))
+        if item_shard != shard and i > start:
+            bounds.append((start, i))
+            start = i
+        shard = item_shard
+        acc += length
+    if start < len(lengths):
+        bounds.append((start, len(lengths)))
+    return bounds
+
+
+def _shutdown(state: dict) -> None:
+    executor = state.pop("executor", None)
+    if executor is not None and state.get("pid") == os.getpid():
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass(frozen=True)
+class PooledNerModel:
+    """Handle on the *index*-th model of a :class:`NerProcessPool`."""
+
+    pool: "NerProcessPool"
+    index: int
+
+    @property
+    def name(self) -> str:
+        return Path(self.pool.paths[self.index]).name
+
+
+class NerProcessPool:
+    """
+    Worker processes holding the NER models at *paths*.
+
+    Args:
+        paths:     NER checkpoints loaded by every worker.
+        version:   ``encoder_inference`` backend (1, 2 or 3).
+        agg_strat: Aggregation strategy (backend default if None).
+        lang:      Language of the v1 backend.
+        workers:   Number of worker processes.
+        threads:   torch threads per worker. Defaults to this process's torch
+                   thread budget (or its cores) divided by *workers*.
+    """
+
+    def __init__(
+        self,
+        paths: list[Path],
+        version: int = 2,
+        agg_strat: Optional[str] = None,
+        lang: str = "es",
+        workers: int = 2,
+        threads: Optional[int] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be positive, got {workers}")
+        self.paths = [str(p) for p in paths]
+        self.version = version
+        self.agg_strat = agg_strat
+        self.lang = lang
+        self.workers = workers
+        if not threads:
+            budget = current_parallelism()["torch_threads"] or os.cpu_count() or 1
+            threads = max(1, budget // workers)
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._state: dict = {}
+        weakref.finalize(self, _shutdown, self._state)
+
+    def models(self) -> list[PooledNerModel]:
+        """One handle per model, in the order of *paths*."""
+        return [PooledNerModel(self, i) for i in range(len(self.paths))]
+
+    def _executor(self):
+        with self._lock:
+            if self._state.get("pid") != os.getpid() or self._state.get("executor") is None:
+                import multiprocessing as mp
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._state["executor"] = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=mp.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.paths, self.version, self.agg_strat, self.lang, self.threads),
+                )
+                self._state["pid"] = os.getpid()
+                logger.info(
+                    "Starting %d NER worker process(es) with %d torch thread(s) each for %s",
+                    self.workers, self.threads, ", ".join(Path(p).name for p in self.paths),
+                )
+            return self._state["executor"]
+
+    def start(self) -> None:
+        """Start the workers and wait until they have loaded the models. Idempotent."""
+        executor = self._executor()
+        pings = [executor.submit(_ping) for _ in range(self.workers)]
+        self._wait(pings)
+
+    def close(self) -> None:
+        """Stop the workers. A later call starts new ones."""
+        with self._lock:
+            _shutdown(self._state)
+
+    def _wait(self, futures: list) -> list:
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            return [f.result() for f in futures]
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): start afresh next call
+            logger.error("A NER worker process died; the pool will be restarted on the next call.")
+            self.close()
+            raise
+
+    def infer(self, texts: list[str], model_idx: list[int], spans: Optional[list[list[tuple[int, int]]]] = None, columnar: bool = False) -> list:
+        """
+        Run the models *model_idx* over *texts* on the workers. Same arguments
+        and result (``[model][text][entity]``, or ``[model]`` batches when
+        *columnar*) as ``encoder_inference``. Columnar results are also much
+        cheaper to send back from the workers.
+        """
+        if columnar:
+            from app.src.annotations import AnnotationBatch
+        if not texts:
+            return [AnnotationBatch.empty(0) if columnar else [] for _ in model_idx]
+        executor = self._executor()
+        shards = _shards([len(t) for t in texts], self.workers * SHARDS_PER_WORKER)
+        parts = self._wait([
+            executor.submit(_infer_shard, texts[a:b], list(model_idx), spans[a:b] if spans is not None else None, columnar)
+            for a, b in shards
+        ])
+        if columnar:
+            return [AnnotationBatch.concat([part[m] for part in parts]) for m in range(len(model_idx))]
+        return [[doc for part in parts for doc in part[m]] for m in range(len(model_idx))]
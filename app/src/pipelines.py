@@ -1,14 +1,35 @@
-from typing import Protocol
+import threading
+from typing import Any, Callable, Iterator, Optional, Protocol
 from abc import abstractmethod
+from functools import partial
+from pathlib import Path
 
+from app.config import NER_VERSION, NER_WORKER_THREADS, NER_WORKERS, STREAM_BATCH_TEXTS, STREAM_MAX_QUEUE
+from app.metrics import counter, timed
 from app.model_manager.resolver import LocalResolver
-from app.src.ner import encoder_inference
-from app.src.nel import lookup_inference, fuzzymatch_inference, bm25okapi_inference, biencoder_inference
-from app.src.negation.negation_utils import add_negation_uncertainty_attributes
-from app.utils.results_postprocessing import join_all_entities
+from app.src.model_store import model_store
+from app.streaming import StagedExecutor
+# Backends are resolved on first use (see app/src/ner and app/src/nel), so that
+# building a pipeline only imports the libraries of its own method.
+from app.src import nel, ner
+from app.src.negation.negation_utils import add_negation_uncertainty_attributes, add_negation_uncertainty_attributes_batch
+from app.src.negation.negex import NegexTagger, negex_inference
+from app.utils.fingerprint import file_fingerprint, model_fingerprint
+from app.utils.results_postprocessing import join_all_batches, join_all_entities
+
+DOCS = counter("pipeline_docs_total", "Documents annotated, by pipeline")
+MENTIONS = counter("pipeline_mentions_total", "Annotations returned, by pipeline")
+CASCADE_MENTIONS = counter("nel_cascade_mentions_total", "Mentions linked by each tier of the cascade pipeline")
 
 
 class AnnotationPipeline(Protocol):
+    # Label used for this pipeline's metrics
+    name: str = "pipeline"
+    # NER worker processes (see _acquire_ner_models); 0 runs NER in-process
+    ner_workers: int = 0
+    # Set by unload: the pipeline no longer acquires resources
+    retired: bool = False
+
     @abstractmethod
     def predict(self, texts: list[str]) -> list[list[dict]]:
         """
@@ -83,67 +104,261 @@ class AnnotationPipeline(Protocol):
         """
         pass
 
+    def load(self) -> None:
+        """
+        Load every model, gazetteer and vector DB the pipeline needs and keep
+        them resident, so that subsequent ``predict`` calls skip the load step.
+
+        Constructors only resolve paths; ``predict`` calls ``load`` on first
+        use. Calling it explicitly warms the pipeline up front (e.g. in a batch
+        worker before the first document arrives). It is idempotent and
+        thread-safe: concurrent calls load the resources once.
+
+        Resources are acquired from the shared :data:`model_store` through
+        :meth:`_acquire`, so pipelines that overlap share one loaded copy.
+        Subclasses implement :meth:`_load`. A retired pipeline (see
+        :meth:`unload`) acquires nothing.
+        """
+        with self._load_lock:
+            if self.resource_keys or self.retired:
+                return
+            try:
+                self._load()
+            except Exception:
+                self._release()  # do not leave a half-loaded pipeline behind
+                raise
+
+    def _load(self) -> None:
+        pass
+
+    def unload(self) -> None:
+        """
+        Release every resource acquired by :meth:`load` and retire the
+        pipeline (e.g. on eviction from the pipeline cache). Calls that still
+        hold it finish on the models it references, which are freed with it,
+        but it never loads them again: that would hold memory outside the
+        cache's budget. Get a new pipeline from the cache instead.
+        """
+        with self._load_lock:
+            self.retired = True
+            self._release()
+
+    def _release(self) -> None:
+        for key in self.resource_keys:
+            model_store.release(key)
+        self.resource_keys = []
+
+
+    def memory(self) -> tuple[int, int]:
+        """``(ram_bytes, vram_bytes)`` held by this pipeline's resources, shared ones included."""
+        return model_store.nbytes(self.resource_keys)
+
+    def _record(self, texts: list[str], results: list[list[dict]]) -> list[list[dict]]:
+        DOCS.inc(len(texts), pipeline=self.name)
+        MENTIONS.inc(sum(len(doc) for doc in results), pipeline=self.name)
+        return results
+
+    def _acquire(self, key: tuple, loader: Callable[[], Any]) -> Any:
+        value = model_store.acquire(key, loader)
+        self.resource_keys.append(key)
+        return value
+
+    def _acquire_negex(self, lang: str) -> NegexTagger:
+        return self._acquire(("negex", lang), partial(NegexTagger, lang))
+
+    def _negex_attributes(self, texts: list[str], results: list[list[dict]]) -> list[list[dict]]:
+        """Add negation/uncertainty attributes to *results* with the rule-based tagger."""
+        with timed("negation_rules"):
+            neg_results = negex_inference(texts, self.negex, entities=results)
+        with timed("negation_overlap"):
+            return add_negation_uncertainty_attributes(results, neg_results)
+
+    def _acquire_ner_models(self, ner_paths: list[Path], version: int, agg_strat: Optional[str] = None, lang: str = "es") -> list:
+        """
+        The NER models at *ner_paths*, in order: loaded in this process, or,
+        with ``self.ner_workers``, handles on one :class:`NerProcessPool`
+        holding all of them (pass every model of the pipeline in one call).
+        """
+        if self.ner_workers:
+            pool = self._acquire(
+                ("ner_pool", version, tuple(str(p) for p in ner_paths), agg_strat, lang if version == 1 else None, self.ner_workers),
+                partial(_start_ner_pool, ner_paths, version, agg_strat, lang, self.ner_workers),
+            )
+            return pool.models()
+        return [
+            self._acquire(
+                # lang only changes the v1 backend (spaCy sentencizer)
+                ("ner", version, str(pth), agg_strat, lang if version == 1 else None),
+                partial(_load_ner_model, pth, version, agg_strat, lang),
+            )
+            for pth in ner_paths
+        ]
+
+
+def _load_ner_model(pth: Path, version: int, agg_strat: Optional[str], lang: str):
+    return ner.load_encoder_models([pth], version=version, agg_strat=agg_strat, lang=lang)[0]
+
+
+def _carry_slice(fn: Callable) -> Callable:
+    """Wrap a stage of :meth:`BiencoderPipeline.stream` to pass its mini-batch's slice along."""
+    def stage(batch: tuple[slice, Any]) -> tuple[slice, Any]:
+        where, value = batch
+        return where, fn(value)
+    return stage
+
+
+def _start_ner_pool(paths: list[Path], version: int, agg_strat: Optional[str], lang: str, workers: int):
+    pool = ner.NerProcessPool(paths, version=version, agg_strat=agg_strat, lang=lang, workers=workers, threads=NER_WORKER_THREADS)
+    pool.start()
+    return pool
+
 
 class LookupPipeline(AnnotationPipeline):
-    """Direct text → code lookup. No NER step needed."""
+    """
+    Direct text → code lookup. No NER step needed.
+
+    With ``negation``, negation/uncertainty attributes come from the rule-based
+    :class:`NegexTagger` (the same applies to the fuzzy and BM25 pipelines).
+    """
 
-    def __init__(self, lang: str, entities: list[str]):
+    name = "lookup"
+
+    def __init__(self, lang: str, entities: list[str], negation: bool = False):
+        self.lang = lang
+        self.negation = negation
         self.resolver = LocalResolver()
         self.gaz_pths = [self.resolver.get_gaz_path(lang, e) for e in entities]
+        self.resource_keys: list[tuple] = []
+        self._load_lock = threading.Lock()
+        self.engines = None
+        self.negex = None
+
+    def _load(self) -> None:
+        self.engines = [self._acquire(("lookup", str(gaz)), partial(nel.LookUpMethod, gaz)) for gaz in self.gaz_pths]
+        if self.negation:
+            self.negex = self._acquire_negex(self.lang)
 
     def predict(self, texts: list[str]) -> list[list[dict]]:
-        inference_results = lookup_inference(texts, self.gaz_pths)
-        return join_all_entities(inference_results)
+        self.load()
+        with timed("nel_lookup"):
+            inference_results = nel.lookup_inference(texts, self.engines)
+        results = join_all_entities(inference_results)
+        if self.negation:
+            results = self._negex_attributes(texts, results)
+        return self._record(texts, results)
 
 
 class FuzzyMatchPipeline(AnnotationPipeline):
 
+    name = "fuzzy"
+
     def __init__(
         self,
         lang: str,
         entities: list[str],
-        method: str = "jaro_winkler",
+        method: str = "jaro-winkler",
         threshold: float = 0.7,
         agg_strat: str = "first",
+        ner_version: int = NER_VERSION,
+        negation: bool = False,
+        ner_workers: int = NER_WORKERS,
     ):
+        self.lang = lang
         self.method = method
         self.threshold = threshold
         self.agg_strat = agg_strat
+        self.ner_version = ner_version
+        self.negation = negation
+        self.ner_workers = ner_workers
 
         self.resolver = LocalResolver()
         self.gaz_pths = [self.resolver.get_gaz_path(lang, e) for e in entities]
         self.ner_pths = [self.resolver.get_ner_path(lang, e)[0] for e in entities]
+        self.resource_keys: list[tuple] = []
+        self._load_lock = threading.Lock()
+        self.ner_models = None
+        self.engines = None
+        self.negex = None
+
+    def _load(self) -> None:
+        self.ner_models = self._acquire_ner_models(self.ner_pths, self.ner_version, self.agg_strat)
+        self.engines = [
+            self._acquire(("fuzzy", str(gaz), self.method, self.threshold), partial(nel.FuzzyMatchMethod, gaz, self.method, self.threshold))
+            for gaz in self.gaz_pths
+        ]
+        if self.negation:
+            self.negex = self._acquire_negex(self.lang)
 
     def predict(self, texts: list[str]) -> list[list[dict]]:
-        ner_results = ner_inference(texts, self.ner_pths, agg_strat=self.agg_strat)
-        fuzzy_result = fuzzymatch_inference(ner_results, self.gaz_pths, self.method, self.threshold)
-        return join_all_entities(fuzzy_result)
+        self.load()
+        with timed("ner"):
+            ner_results = ner.encoder_inference(texts, self.ner_models, version=self.ner_version, agg_strat=self.agg_strat)
+        with timed("nel_fuzzy"):
+            fuzzy_result = nel.fuzzymatch_inference(ner_results, self.engines, self.method, self.threshold)
+        results = join_all_entities(fuzzy_result)
+        if self.negation:
+            results = self._negex_attributes(texts, results)
+        return self._record(texts, results)
 
 
 class BM25OkapiPipeline(AnnotationPipeline):
 
+    name = "bm25"
+
     def __init__(
         self,
         lang: str,
         entities: list[str],
         agg_strat: str = "first",
+        ner_version: int = NER_VERSION,
+        negation: bool = False,
+        ner_workers: int = NER_WORKERS,
     ):
+        self.lang = lang
         self.agg_strat = agg_strat
+        self.ner_version = ner_version
+        self.negation = negation
+        self.ner_workers = ner_workers
 
         self.resolver = LocalResolver()
         self.gaz_pths = [self.resolver.get_gaz_path(lang, e) for e in entities]
         self.ner_pths = [self.resolver.get_ner_path(lang, e)[0] for e in entities]
+        self.resource_keys: list[tuple] = []
+        self._load_lock = threading.Lock()
+        self.ner_models = None
+        self.engines = None
+        self.negex = None
+
+    def _load(self) -> None:
+        self.ner_models = self._acquire_ner_models(self.ner_pths, self.ner_version, self.agg_strat)
+        self.engines = [self._acquire(("bm25", str(gaz)), partial(nel.BM25Method, gaz)) for gaz in self.gaz_pths]
+        if self.negation:
+            self.negex = self._acquire_negex(self.lang)
 
     def predict(self, texts: list[str]) -> list[list[dict]]:
-        ner_results = ner_inference(texts, self.ner_pths, agg_strat=self.agg_strat)
-        bm25_result = bm25okapi_inference(ner_results, self.gaz_pths)
-        return join_all_entities(bm25_result)
+        self.load()
+        with timed("ner"):
+            ner_results = ner.encoder_inference(texts, self.ner_models, version=self.ner_version, agg_strat=self.agg_strat)
+        with timed("nel_bm25"):
+            bm25_result = nel.bm25okapi_inference(ner_results, self.engines)
+        results = join_all_entities(bm25_result)
+        if self.negation:
+            results = self._negex_attributes(texts, results)
+        return self._record(texts, results)
 
 
 class BiencoderPipeline(AnnotationPipeline):
     """
     Full pipeline: NER → NEL (dense retrieval) → Negation.
 
+    Negation runs last, so that it only has to tag the sentences that contain
+    a linked entity (see ``lazy_negation``).
+
+    With the v2 and v3 NER backends, the mentions go from NER to negation as
+    one :class:`~app.src.annotations.AnnotationBatch` (columns over all the
+    mentions of a request) and only become dicts at the end of the pipeline.
+    With v1 they are dicts throughout.
+
     Parameters
     ----------
     lang : str
@@ -160,45 +375,233 @@ class BiencoderPipeline(AnnotationPipeline):
     ner_version : int
         NER pre and postprocessing version to use. Model is called in the same
         way but inputs are chunked and postprocessed in the same way
+    lazy_negation : bool
+        Run the negation model only on the sentences overlapping an entity
+        found by NER. Scopes elsewhere cannot match any entity, so the output
+        is unchanged; documents without entities skip the model entirely.
+        Set to False to tag every sentence.
+    ner_workers : int
+        Run the NER and negation models on this many worker processes (see
+        :class:`app.src.ner.NerProcessPool`); 0 runs them in this process.
+    stream_batch_texts : int
+        Split requests of more than this many texts into mini-batches of that
+        size and run NER, NEL and negation on them concurrently (see
+        :meth:`stream`). 0 runs each stage over the whole request in turn.
     device : str 
         Torch device string, e.g. "cuda:0"
     """
 
+    name = "biencoder"
+
     def __init__(
         self,
         lang: str,
         entities: list[str],
         negation: bool=True,
-        ner_version: int=2,
+        ner_version: int=NER_VERSION,
+        lazy_negation: bool=True,
+        ner_workers: int=NER_WORKERS,
+        stream_batch_texts: int=STREAM_BATCH_TEXTS,
     ):
         self.negation = negation
         self.lang = lang
         self.ner_version = ner_version
+        self.lazy_negation = lazy_negation
+        self.ner_workers = ner_workers
+        self.stream_batch_texts = stream_batch_texts
+        self.columnar = ner_version != 1
 
         self.resolver = LocalResolver()
-        self.ner_paths = [self.resolver.get_ner_path(self.lang, e)[0] for e in (entities + ["negation"] if self.negation else entities)]
+        self.ner_paths = [self.resolver.get_ner_path(self.lang, e)[0] for e in entities]
+        self.negation_path = self.resolver.get_ner_path(self.lang, "negation")[0] if self.negation else None
         self.nel_path = self.resolver.get_nel_path(self.lang)[0]
         self.gaz_paths = [self.resolver.get_gaz_path(self.lang, e) for e in entities]
         self.vdb_paths = [self.resolver.get_vector_db_path(self.lang, e)[0] for e in entities]
+        self.resource_keys: list[tuple] = []
+        self._load_lock = threading.Lock()
+        self.ner_models = None
+        self.negation_model = None
+        self.nel_models = None
+
+    def _load(self) -> None:
+        # One call, so that a NER process pool holds the negation model too
+        models = self._acquire_ner_models(
+            self.ner_paths + ([self.negation_path] if self.negation else []), self.ner_version, lang=self.lang
+        )
+        self.ner_models = models[:len(self.ner_paths)]
+        if self.negation:
+            self.negation_model = models[-1]
+        # One resident encoder per NEL checkpoint *content*, shared by every
+        # entity type's index and by every language registering the same model.
+        # Likewise one index per (model, gazetteer) content: the vector DB is
+        # the gazetteer embedded by the model, so identical inputs share it.
+        nel_id = model_fingerprint(self.nel_path)
+        st_model = self._acquire(("nel_encoder", nel_id), partial(nel.load_nel_encoder, self.nel_path))
+        self.nel_models = [
+            self._acquire(
+                ("nel_index", nel_id, file_fingerprint(gaz)),
+                partial(nel.BiencoderModel, gaz_pth=gaz, model_pth=st_model, vector_db_pth=vdb),
+            )
+            for gaz, vdb in zip(self.gaz_paths, self.vdb_paths)
+        ]
 
     def predict(self, texts: list[str]) -> list[list[dict]]:
-        # use v2 encoder
-        ner_results = encoder_inference(
-            texts, self.ner_paths, version=self.ner_version
-        )
+        self.load()
+        if self.stream_batch_texts and len(texts) > self.stream_batch_texts:
+            return [doc for batch in self.stream(texts) for doc in batch]
+        return self._negation_stage(self._nel_stage(self._ner_stage(texts)))
 
-        # If no negation, run the standard pipeline and exit
-        if not self.negation:
-            norm_results = biencoder_inference(
-                ner_results, self.nel_path, self.gaz_paths, self.vdb_paths
+    def stream(self, texts: list[str], finish: Optional[Callable[[slice, list[list[dict]]], Any]] = None) -> Iterator:
+        """
+        Annotate *texts* in mini-batches of ``stream_batch_texts`` texts flowing
+        through the NER, NEL and negation stages, each on its own thread (see
+        :class:`app.streaming.StagedExecutor`), and yield each mini-batch's
+        results as soon as it is done, in input order.
+
+        *finish*, when given, runs as a last stage on each mini-batch: it is
+        called with the mini-batch's ``slice`` of *texts* and its results, and
+        its return value is yielded instead (e.g. the serialized documents).
+        """
+        self.load()
+        size = self.stream_batch_texts or len(texts) or 1
+        # Results travel with the slice of their texts, for the finish stage
+        stages = [
+            (stage, _carry_slice(fn))
+            for stage, fn in (("ner", self._ner_stage), ("nel", self._nel_stage), ("negation", self._negation_stage))
+        ]
+        if finish is not None:
+            stages.append(("finish", lambda batch: (batch[0], finish(*batch))))
+        executor = StagedExecutor(stages, max_queue=STREAM_MAX_QUEUE, name=self.name)
+        batches = ((slice(i, i + size), texts[i:i + size]) for i in range(0, len(texts), size))
+        for _, output in executor.run(batches):
+            yield output
+
+    # Between stages, the mentions of the texts are an AnnotationBatch per
+    # entity type, then one for all (columnar), or dicts nested in the same way.
+
+    def _ner_stage(self, texts: list[str]) -> tuple[list[str], list]:
+        with timed("ner"):
+            ner_results = ner.encoder_inference(
+                texts, self.ner_models, version=self.ner_version, lang=self.lang, columnar=self.columnar
             )
-            return join_all_entities(norm_results)
+        return texts, ner_results
+
+    def _nel_stage(self, batch: tuple[list[str], list]) -> tuple[list[str], Any]:
+        texts, ner_results = batch
+        with timed("nel"):
+            norm_results = self._link(ner_results)
+        return texts, join_all_batches(norm_results) if self.columnar else join_all_entities(norm_results)
+
+    def _negation_stage(self, batch: tuple[list[str], Any]) -> list[list[dict]]:
+        texts, results = batch
+        if self.negation:
+            with timed("negation_ner"):
+                neg_results = self._tag_negation(texts, results)
+            with timed("negation_overlap"):
+                if self.columnar:
+                    results = add_negation_uncertainty_attributes_batch(results, neg_results)
+                else:
+                    results = add_negation_uncertainty_attributes(results, neg_results)
+        if self.columnar:
+            results = results.to_dicts()
+        return self._record(texts, results)
+
+    def _link(self, ner_results: list) -> list:
+        if self.columnar:
+            return nel.biencoder_inference_batch(ner_results, self.nel_models)
+        return nel.biencoder_inference(
+            ner_results, self.nel_path, self.gaz_paths, self.vdb_paths, nel_models=self.nel_models
+        )
 
-        # If negation exists, handle the specialized pipeline
-        neg_results = ner_results.pop()
-        norm_results = biencoder_inference(
-            ner_results, self.nel_path, self.gaz_paths, self.vdb_paths
+    def _tag_negation(self, texts: list[str], entities: Any) -> Any:
+        """Negation/uncertainty tags per text, in the form of *entities*; lazily, only around *entities*."""
+        if not self.lazy_negation:
+            return ner.encoder_inference(
+                texts, [self.negation_model], version=self.ner_version, lang=self.lang, columnar=self.columnar
+            )[0]
+
+        if self.columnar:
+            bounds = entities.offsets.tolist()
+            todo = [i for i in range(len(texts)) if bounds[i + 1] > bounds[i]]
+            spans = [entities.doc_spans(i) for i in todo]
+        else:
+            todo = [i for i, doc in enumerate(entities) if doc]
+            spans = [[(e["start"], e["end"]) for e in entities[i]] for i in todo]
+        if not todo:
+            if self.columnar:
+                from app.src.annotations import AnnotationBatch
+                return AnnotationBatch.empty(len(texts))
+            return [[] for _ in texts]
+
+        tagged = ner.encoder_inference(
+            [texts[i] for i in todo], [self.negation_model], version=self.ner_version, lang=self.lang,
+            spans=spans, columnar=self.columnar,
+        )[0]
+        if self.columnar:
+            return tagged.expand(todo, len(texts))
+        neg_results = [[] for _ in texts]
+        for i, doc in zip(todo, tagged):
+            neg_results[i] = doc
+        return neg_results
+
+
+class CascadePipeline(BiencoderPipeline):
+    """
+    NER → NEL by the cheapest tier that resolves each mention → Negation.
+
+    A mention is linked by exact lookup of its normalized form when it is a
+    gazetteer term, else by fuzzy matching when its best score reaches
+    ``fuzzy_threshold``, else by dense retrieval as in
+    :class:`BiencoderPipeline` (see :mod:`app.src.nel.cascade`). Only the
+    mentions left for the last tier are embedded. The number of mentions
+    linked by each tier is counted in ``nel_cascade_mentions_total``.
+
+    Parameters
+    ----------
+    fuzzy_method : str
+        Fuzzy scorer of the second tier (any :class:`FuzzyMatchMethod` method).
+    fuzzy_threshold : float
+        Minimum fuzzy score, in [0, 1], to accept a match in the second tier.
+        Keep it high: lower-scoring mentions are better served by the encoder.
+
+    The other parameters are those of :class:`BiencoderPipeline`.
+    """
+
+    name = "cascade"
+
+    def __init__(
+        self,
+        lang: str,
+        entities: list[str],
+        negation: bool=True,
+        ner_version: int=NER_VERSION,
+        lazy_negation: bool=True,
+        ner_workers: int=NER_WORKERS,
+        stream_batch_texts: int=STREAM_BATCH_TEXTS,
+        fuzzy_method: str="levenshtein",
+        fuzzy_threshold: float=0.9,
+    ):
+        super().__init__(
+            lang, entities, negation=negation, ner_version=ner_version, lazy_negation=lazy_negation,
+            ner_workers=ner_workers, stream_batch_texts=stream_batch_texts,
         )
-        norm_results = join_all_entities(norm_results)
-        
-        return add_negation_uncertainty_attributes(norm_results, neg_results)
\ No newline at end of file
+        self.fuzzy_method = fuzzy_method
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_engines = None
+
+    def _load(self) -> None:
+        super()._load()
+        self.fuzzy_engines = [
+            self._acquire(
+                ("fuzzy", str(gaz), self.fuzzy_method, self.fuzzy_threshold),
+                partial(nel.FuzzyMatchMethod, gaz, self.fuzzy_method, self.fuzzy_threshold),
+            )
+            for gaz in self.gaz_paths
+        ]
+
+    def _link(self, ner_results: list) -> list:
+        link = nel.cascade_inference_batch if self.columnar else nel.cascade_inference
+        results, hits = link(ner_results, self.fuzzy_engines, self.nel_models)
+        for tier, count in hits.items():
+            CASCADE_MENTIONS.inc(count, pipeline=self.name, tier=tier)
+        return results
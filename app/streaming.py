@@ -0,0 +1,168 @@
+"""
+Staged, streaming execution of a pipeline over mini-batches.
+
+A pipeline's ``predict`` runs its stages one after the other over the whole
+request: all NER, then all NEL, then all negation. For a large request the
+stages never overlap, although they mostly wait on different resources (the
+NER model, the NEL encoder, the lexical code). A :class:`StagedExecutor` runs
+each stage on its own thread instead, connected by bounded queues, and feeds
+the request through it in mini-batches: while NEL links the mentions of batch
+``k``, NER already tags batch ``k + 1``.
+
+* Back-pressure: a stage whose output queue holds ``max_queue`` batches
+  blocks until the next stage takes one, so at most about
+  ``(stages + 1) * max_queue`` batches are in flight, whatever the request size.
+* Order: each stage handles its batches one at a time, in arrival order, so
+  the results come out in input order.
+* Errors: the first exception raised by a stage (or by the iteration of the
+  items) stops every stage and is re-raised to the caller, which may first
+  receive the results of earlier batches.
+
+Stage threads run in a copy of the caller's context, so stage timings still
+reach the request's ``Server-Timing`` breakdown (overlapping stages add up to
+more than the wall time). The time each stage spends waiting for input or for
+room downstream is counted in ``streaming_stage_wait_seconds_total``; the
+stage that waits least is the bottleneck.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from app.metrics import counter
+
+WAIT_SECONDS = counter(
+    "streaming_stage_wait_seconds_total",
+    "Time streaming stages spent waiting, by stage and for what (input: starved; output: back-pressure)",
+)
+
+# Interval at which blocked stages check whether the run was stopped
+_POLL_S = 0.1
+
+_END = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class StagedExecutor:
+    """
+    Run items through a sequence of stages, one thread per stage.
+
+    Args:
+        stages:    ``(name, fn)`` pairs; each ``fn`` maps the output of the
+                   previous stage (the item, for the first one) to its own.
+        max_queue: Batches buffered between two stages.
+        name:      Label for metrics.
+    """
+
+    def __init__(self, stages: Sequence[tuple[str, Callable[[Any], Any]]], max_queue: int = 2, name: str = ""):
+        if not stages:
+            raise ValueError("at least one stage is required")
+        if max_queue < 1:
+            raise ValueError(f"max_queue must be positive, got {max_queue}")
+        self.stages = list(stages)
+        self.max_queue = max_queue
+        self.name = name
+
+    def map(self, items: Iterable) -> list:
+        """The outputs of the last stage for every item, in order."""
+        return list(self.run(items))
+
+    def run(self, items: Iterable) -> Iterator:
+        """Yield the outputs of the last stage for every item, in order, as they are ready."""
+        queues = [queue.Queue(maxsize=self.max_queue) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        # Exceptions raised by the threads, in order; set before stop
+        failures: list[BaseException] = []
+        threads = [
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(self._feed, items, queues[0], stop, failures),
+                name=f"stream-{self.name}-feed", daemon=True,
+            )
+        ]
+        for i, (stage, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._work, stage, fn, queues[i], queues[i + 1], stop, failures),
+                name=f"stream-{self.name}-{stage}", daemon=True,
+            ))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                try:
+                    item = self._get(queues[-1], stop)
+                except _Stopped:
+                    # Only a failing thread stops the run while the caller reads it
+                    raise failures[0] from None
+                if item is _END:
+                    return
+                yield item
+        finally:
+            # Also when the caller stops early or a stage failed: unblock and end every thread
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _feed(self, items: Iterable, out: queue.Queue, stop: threading.Event, failures: list) -> None:
+        try:
+            for item in items:
+                self._put(out, item, stop)
+            self._put(out, _END, stop)
+        except _Stopped:
+            pass
+        except BaseException as exc:
+            self._fail(exc, stop, failures)
+
+    def _work(
+        self, stage: str, fn: Callable, inp: queue.Queue, out: queue.Queue, stop: threading.Event, failures: list,
+    ) -> None:
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = self._get(inp, stop)
+                WAIT_SECONDS.inc(time.perf_counter() - t0, executor=self.name, stage=stage, waiting_for="input")
+                if item is _END:
+                    self._put(out, item, stop)
+                    return
+                try:
+                    result = fn(item)
+                except BaseException as exc:
+                    self._fail(exc, stop, failures)
+                    return
+                t0 = time.perf_counter()
+                self._put(out, result, stop)
+                WAIT_SECONDS.inc(time.perf_counter() - t0, executor=self.name, stage=stage, waiting_for="output")
+        except _Stopped:
+            pass
+
+    @staticmethod
+    def _fail(exc: BaseException, stop: threading.Event, failures: list) -> None:
+        # Record the error for the caller (run() raises the first one), then stop every thread
+        failures.append(exc)
+        stop.set()
+
+    @staticmethod
+    def _get(q: queue.Queue, stop: threading.Event):
+        while True:
+            try:
+                return q.get(timeout=_POLL_S)
+            except queue.Empty:
+                if stop.is_set():
+                    raise _Stopped from None
+
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event) -> None:
+        while True:
+            try:
+                q.put(item, timeout=_POLL_S)
+                return
+            except queue.Full:
+                if stop.is_set():
+                    raise _Stopped from None
@@ -0,0 +1,156 @@
+"""
+Cache of NER predictions per chunk.
+
+Clinical notes repeat themselves: template sentences, headers and
+copy-forward paragraphs recur across visits and patients. The NER backends
+(v2 and v3) segment each document into sentence chunks (see
+:func:`app.utils.text_preprocessing.build_inference_chunks`) and predict each
+chunk on its own. So a chunk seen before can reuse its earlier predictions
+instead of going through the model.
+
+Entries are keyed by a hash of the model (its content fingerprint, backend and
+options; see :func:`cache_namespace`) and the chunk text. Values are the
+model's raw predictions, with offsets relative to the chunk. The NER model
+re-bases them onto the chunk's position in the new document as it does for
+fresh predictions, so a cached chunk may appear at any offset of any document.
+
+Two tiers:
+
+* memory: an LRU of ``NER_CHUNK_CACHE_SIZE`` entries per process;
+* disk (optional, ``NER_CHUNK_CACHE_DIR``): an SQLite file shared by the
+  processes of the node and kept across restarts (see
+  :class:`app.utils.disk_store.DiskStore`).
+
+Lookups are counted in ``ner_chunk_cache_total{model, result}``; ``result`` is
+``memory``, ``disk`` or ``miss``. The share of hits is the share of chunks the
+model skipped.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.config import NER_CHUNK_CACHE_DIR, NER_CHUNK_CACHE_DISK_MAX_ENTRIES, NER_CHUNK_CACHE_SIZE
+from app.metrics import counter
+from app.utils.disk_store import DiskStore
+from app.utils.fingerprint import model_fingerprint
+
+LOOKUPS = counter("ner_chunk_cache_total", "NER chunks looked up in the chunk cache, by model and result (memory, disk, miss)")
+
+DISK_NAME = "ner_chunks.sqlite"
+
+
+def cache_namespace(model_checkpoint: str | Path, backend: str, **options) -> str:
+    """
+    Identity of a NER model's predictions: its checkpoint content, the
+    *backend* serving it and the *options* that change its output (e.g. the
+    aggregation strategy or the precision).
+    """
+    opts = ",".join(f"{k}={v}" for k, v in sorted(options.items()))
+    return f"{backend}:{model_fingerprint(model_checkpoint)}:{opts}"
+
+
+def _key(namespace: str, text: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{text}".encode()).hexdigest()[:32]
+
+
+def _compact(preds: list[dict]) -> list[dict]:
+    # Only what NerModel._to_batch reads, as plain JSON types
+    return [
+        {
+            "entity_group": pred.get("entity_group", pred.get("entity")),
+            "score": float(pred.get("score", 0.0)),
+            "start": int(pred["start"]),
+            "end": int(pred["end"]),
+        }
+        for pred in preds
+    ]
+
+
+class ChunkCache:
+    """
+    Predictions per ``(namespace, chunk text)``.
+
+    Args:
+        max_entries: Entries of the in-memory LRU; 0 disables it.
+        disk:        Optional on-disk tier.
+    """
+
+    def __init__(self, max_entries: int, disk: Optional[DiskStore] = None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries: OrderedDict[str, list[dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, namespace: str, texts: list[str], model: str = "model") -> list[Optional[list[dict]]]:
+        """The cached predictions of each of *texts*, or None where there are none."""
+        keys = [_key(namespace, text) for text in texts]
+        found: list[Optional[list[dict]]] = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                preds = self._entries.get(key)
+                if preds is not None:
+                    self._entries.move_to_end(key)
+                    found[i] = preds
+        n_memory = sum(preds is not None for preds in found)
+
+        n_disk = 0
+        if self.disk is not None and n_memory < len(keys):
+            missing = [i for i, preds in enumerate(found) if preds is None]
+            stored = self.disk.get_many([keys[i] for i in missing])
+            for i in missing:
+                value = stored.get(keys[i])
+                if value is not None:
+                    found[i] = json.loads(value)
+                    n_disk += 1
+            if n_disk:
+                self._remember({keys[i]: found[i] for i in missing if found[i] is not None})
+
+        LOOKUPS.inc(n_memory, model=model, result="memory")
+        LOOKUPS.inc(n_disk, model=model, result="disk")
+        LOOKUPS.inc(len(keys) - n_memory - n_disk, model=model, result="miss")
+        return found
+
+    def put_many(self, namespace: str, texts: list[str], preds: list[list[dict]]) -> None:
+        """Store the predictions *preds* of *texts*."""
+        items = {_key(namespace, text): _compact(p) for text, p in zip(texts, preds)}
+        self._remember(items)
+        if self.disk is not None:
+            self.disk.put_many({key: json.dumps(p) for key, p in items.items()})
+
+    def _remember(self, items: dict[str, list[dict]]) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            for key, preds in items.items():
+                self._entries[key] = preds
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_cache: Optional[ChunkCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_chunk_cache() -> Optional[ChunkCache]:
+    """The process-wide chunk cache configured in :mod:`app.config`, or None when disabled."""
+    global _cache
+    if not NER_CHUNK_CACHE_SIZE and not NER_CHUNK_CACHE_DIR:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            disk = None
+            if NER_CHUNK_CACHE_DIR:
+                disk = DiskStore(Path(NER_CHUNK_CACHE_DIR) / DISK_NAME, max_entries=NER_CHUNK_CACHE_DISK_MAX_ENTRIES)
+            _cache = ChunkCache(NER_CHUNK_CACHE_SIZE, disk)
+        return _cache
@@ -0,0 +1,127 @@
+"""
+A small persistent key-value store in an SQLite file.
+
+Used for the on-disk caches (see :mod:`app.utils.chunk_cache` and
+:mod:`app.result_cache`). SQLite lets the serving and NER worker processes of
+a node share one file. Writes take a lock on the file, and readers are not
+blocked by a writer (WAL mode). Values are strings; callers serialize their
+own.
+
+The store is bounded by ``max_entries``: beyond it, the least recently written
+entries are deleted. With ``ttl_s``, entries older than that are not returned
+and are deleted too. Pruning runs every :data:`PRUNE_EVERY` writes, so the file
+may briefly hold a few more entries. A failing store (e.g. disk full, a locked
+file on a network filesystem) logs a warning and behaves as an empty one: a
+cache must never fail a request.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PRUNE_EVERY = 1000
+# SQLite's default limit of variables per statement is 999
+_MAX_PARAMS = 900
+
+
+class DiskStore:
+    """
+    Args:
+        path:        SQLite file, created with its parent directory if missing.
+        max_entries: Entries kept; 0 means unbounded.
+        ttl_s:       Seconds an entry stays valid after it is written; 0 means forever.
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = 0, ttl_s: float = 0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork: each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, written REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_written ON entries (written)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """The stored values of those *keys* that are present."""
+        found: dict[str, str] = {}
+        if not keys:
+            return found
+        oldest = time.time() - self.ttl_s if self.ttl_s else 0
+        try:
+            with self._lock:
+                conn = self._connection()
+                for i in range(0, len(keys), _MAX_PARAMS):
+                    part = keys[i:i + _MAX_PARAMS]
+                    rows = conn.execute(
+                        f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(part))}) AND written >= ?",
+                        [*part, oldest],
+                    )
+                    found.update(rows)
+        except sqlite3.Error as exc:
+            logger.warning("Cannot read the cache %s: %s", self.path, exc)
+        return found
+
+    def put_many(self, items: dict[str, str]) -> None:
+        """Store *items*, replacing existing values."""
+        if not items:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO entries (key, value, written) VALUES (?, ?, ?)",
+                        [(key, value, now) for key, value in items.items()],
+                    )
+                self._writes += len(items)
+                if (self.max_entries or self.ttl_s) and self._writes >= PRUNE_EVERY:
+                    self._writes = 0
+                    self._prune(conn)
+        except sqlite3.Error as exc:
+            logger.warning("Cannot write the cache %s: %s", self.path, exc)
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        if self.ttl_s:
+            conn.execute("DELETE FROM entries WHERE written < ?", (time.time() - self.ttl_s,))
+        if not self.max_entries:
+            return
+        (count,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY written LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        try:
+            with self._lock:
+                return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
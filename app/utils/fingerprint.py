@@ -0,0 +1,101 @@
+"""
+Content fingerprints of models, gazetteers and vector DBs.
+
+Two registry entries that point at identical content (e.g. the same NEL
+checkpoint downloaded once per language, or one gazetteer shared by several
+languages) get the same fingerprint. The model store and the model manager
+key resources by it, so that identical content is loaded, downloaded and
+embedded only once.
+
+A fingerprint is the SHA-256 of the content (of every file, for a model
+directory), truncated to :data:`DIGEST_CHARS` hex characters. File digests
+are cached in memory and, for model directories, in a
+:data:`CACHE_NAME` file inside the directory, keyed by size and mtime. A
+multi-GB checkpoint is therefore hashed once per node, normally by
+``python -m app.model_manager``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DIGEST_CHARS = 16
+CACHE_NAME = ".fingerprint.json"
+# Not part of the model: download caches, VCS data and derived exports (e.g. ONNX graphs)
+_IGNORED_DIRS = {".cache", ".git", "onnx"}
+
+_memo: dict[tuple, str] = {}
+_lock = threading.Lock()
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat_key(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_fingerprint(path: str | Path) -> str:
+    """Fingerprint of the file at *path*."""
+    path = Path(path).resolve()
+    key = (str(path), *_stat_key(path))
+    with _lock:
+        if key in _memo:
+            return _memo[key]
+    value = _sha256(path)[:DIGEST_CHARS]
+    with _lock:
+        _memo[key] = value
+    return value
+
+
+def model_fingerprint(directory: str | Path) -> str:
+    """Fingerprint of the model checkpoint in *directory* (every file but the ignored ones)."""
+    directory = Path(directory).resolve()
+    files = sorted(
+        p for p in directory.rglob("*")
+        if p.is_file() and p.name != CACHE_NAME and not _IGNORED_DIRS.intersection(p.relative_to(directory).parts[:-1])
+    )
+    stats = {p.relative_to(directory).as_posix(): _stat_key(p) for p in files}
+    key = (str(directory), tuple(sorted(stats.items())))
+    with _lock:
+        if key in _memo:
+            return _memo[key]
+
+    cache_path = directory / CACHE_NAME
+    try:
+        cached = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        cached = {}
+    digests, changed = {}, False
+    for rel, (size, mtime_ns) in stats.items():
+        entry = cached.get(rel)
+        if entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            digests[rel] = entry
+        else:
+            digests[rel] = {"size": size, "mtime_ns": mtime_ns, "sha256": _sha256(directory / rel)}
+            changed = True
+    if changed or set(cached) != set(digests):
+        try:
+            cache_path.write_text(json.dumps(digests, indent=1))
+        except OSError as exc:  # read-only model directories are fine, just slower
+            logger.debug("Cannot cache the fingerprint of %s: %s", directory, exc)
+
+    digest = hashlib.sha256()
+    for rel in sorted(digests):
+        digest.update(f"{rel}\0{digests[rel]['sha256']}\n".encode())
+    value = digest.hexdigest()[:DIGEST_CHARS]
+    with _lock:
+        _memo[key] = value
+    return value
@@ -1,9 +1,46 @@
+import threading
+import weakref
 import torch
 import numpy as np
 import pandas as pd
 from typing import List, Dict, Any, Union, Tuple, Optional
 from sentence_transformers import SentenceTransformer
-from app.config import device
+from app.config import NEL_MAX_BATCH_TOKENS, device
+from app.metrics import timed
+from app.utils.token_batching import TokenBudget
+
+
+_encoder_locks: "weakref.WeakKeyDictionary[SentenceTransformer, threading.Lock]" = weakref.WeakKeyDictionary()
+_encoder_budgets: "weakref.WeakKeyDictionary[SentenceTransformer, TokenBudget]" = weakref.WeakKeyDictionary()
+_encoder_locks_guard = threading.Lock()
+
+
+def encoder_lock(model: SentenceTransformer) -> threading.Lock:
+    """
+    Return the lock that serialises calls to *model*.
+
+    One encoder can back several retrievers (one per entity type, shared between
+    pipelines), and its fast tokenizer is not safe to call from several threads
+    at once, so the lock belongs to the model rather than to the retriever.
+    """
+    with _encoder_locks_guard:
+        lock = _encoder_locks.get(model)
+        if lock is None:
+            lock = _encoder_locks[model] = threading.Lock()
+        return lock
+
+
+def encoder_budget(model: SentenceTransformer) -> TokenBudget:
+    """
+    Return the token budget of *model*'s query batches (see
+    :mod:`app.utils.token_batching`). Like its lock, it belongs to the model,
+    so an out-of-memory error lowers it for every retriever sharing the model.
+    """
+    with _encoder_locks_guard:
+        budget = _encoder_budgets.get(model)
+        if budget is None:
+            budget = _encoder_budgets[model] = TokenBudget(NEL_MAX_BATCH_TOKENS, name="nel_encoder")
+        return budget
 
 
 ## Retriever for Linking Module
@@ -141,13 +178,8 @@ class DenseRetriever:
                 If `input_format` is not one of {"text", "vector"}.
         """
         if input_format == "text":
-            query_matrix: torch.Tensor = self.model.encode(
-                data,
-                show_progress_bar=True,
-                convert_to_tensor=True,
-                normalize_embeddings=self.normalize,
-                device=self.device
-            )
+            with timed("nel_encode"), encoder_lock(self.model):
+                query_matrix: torch.Tensor = self.encode_queries(data)
         elif input_format == "vector":
             raw_queries: torch.Tensor = data  # type: ignore
             query_matrix = (
@@ -156,11 +188,34 @@ class DenseRetriever:
         else:
             raise ValueError(f"input_format must be 'text' or 'vector', got '{input_format}'")
 
-        similarity_tensor: torch.Tensor = torch.mm(query_matrix, self.vector_db.T)
-        distances: np.ndarray = similarity_tensor.cpu().numpy()
-        indices: np.ndarray = distances.argsort(axis=1)[:, ::-1]
+        with timed("nel_search"):
+            # Queries may come from a reduced-precision encoder (see app/utils/precision.py)
+            similarity_tensor: torch.Tensor = torch.mm(query_matrix.to(self.vector_db.dtype), self.vector_db.T)
+            distances: np.ndarray = similarity_tensor.cpu().numpy()
+            indices: np.ndarray = distances.argsort(axis=1)[:, ::-1]
         return distances, indices
 
+    def encode_queries(self, queries: List[str]) -> torch.Tensor:
+        """
+        Encode *queries* into a tensor of shape (num_queries, embedding_dim),
+        in batches of similar length within the encoder's token budget (see
+        :func:`encoder_budget`). Callers hold :func:`encoder_lock`.
+        """
+        max_length = getattr(self.model, "max_seq_length", None) or 512
+        lengths = [min(len(ids), max_length) for ids in self.model.tokenizer(list(queries))["input_ids"]]
+        rows = encoder_budget(self.model).run(
+            queries, lengths,
+            lambda batch: list(self.model.encode(
+                batch,
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_tensor=True,
+                normalize_embeddings=self.normalize,
+                device=self.device
+            )),
+        )
+        return torch.stack(rows)
+
     def get_top_k_gazetteer(
         self,
         distances: np.ndarray,
@@ -0,0 +1,48 @@
+"""
+Reduced-precision inference for the torch encoders.
+
+``apply_precision(model, precision)`` converts a loaded model in place:
+
+* ``"fp32"``: unchanged;
+* ``"int8"``: dynamic int8 quantization of every ``nn.Linear`` (weights stored
+  as int8, activations quantized on the fly). CPU only;
+* ``"bf16"``: weights and activations in bfloat16, on CPUs with native bf16
+  support (AVX512-BF16 / AMX) and on CUDA devices that support it.
+
+A mode the device cannot run falls back to fp32 with a warning, so one
+configuration can be shared by heterogeneous nodes.
+"""
+
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def bf16_supported(device: str) -> bool:
+    if device.startswith("cuda"):
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def apply_precision(model: torch.nn.Module, precision: str, device: str = "cpu") -> torch.nn.Module:
+    """Return *model* converted to *precision* (see module docstring)."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}. Expected one of {PRECISIONS}.")
+    if precision == "int8":
+        if device != "cpu":
+            logger.warning("int8 dynamic quantization is CPU only; keeping fp32 on %s.", device)
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if precision == "bf16":
+        if not bf16_supported(device):
+            logger.warning("bf16 is not supported on this %s; keeping fp32.", device)
+            return model
+        return model.to(torch.bfloat16)
+    return model
@@ -1,4 +1,7 @@
-import numpy as np
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.src.annotations import AnnotationBatch
 
 # =============================================================================
 # V1 INFERENCE
@@ -56,11 +59,11 @@ def align_results(results_pre: list[dict], added_spaces: list[int], start_sent_o
 
 
 def merge_contiguous_entities(
-    entities: list[dict],
-    text: str,
+    batch: "AnnotationBatch",
+    texts: list[str],
     allow_space: bool = True,
     score_mode: str = "mean",
-) -> list[dict]:
+) -> "AnnotationBatch":
     """
     Merge adjacent predicted entities that share the same label into a single
     entity, updating the span text and aggregating scores.
@@ -70,49 +73,40 @@ def merge_contiguous_entities(
     single space (if *allow_space* is True).
 
     Args:
-        entities:    Flat list of entity dicts as produced by :func:`_predict_chunks`.
-                     Must contain keys: ``filename``, ``label``, ``start``, ``end``, ``score``.
-        text:        Original input text, used to recompute ``span`` after merging.
+        batch:       Entities of *texts* as built by :meth:`NerModel._to_batch`,
+                     sorted by ``start`` and ``end`` within each document.
+        texts:       Original input texts, used to recompute ``span`` after merging.
         allow_space: If True, entities separated by exactly one space character
                      are also merged. Defaults to True.
         score_mode:  How to aggregate scores of merged entities.
                      One of ``"mean"`` (default), ``"max"``, or ``"min"``.
 
     Returns:
-        A new list of entity dicts with contiguous same-label entities fused.
+        A new batch with contiguous same-label entities fused.
     """
-    if not entities:
-        return []
-
-    entities = sorted(entities, key=lambda e: (e["filename"], e["start"], e["end"]))
+    if not len(batch):
+        return batch
+    import numpy as np  # only the encoder backends merge; keeps `import app` light
 
-    def _aggregate(scores: list[float]) -> float:
+    def _aggregate(scores: np.ndarray) -> float:
         if score_mode == "max":
             return float(np.max(scores))
         if score_mode == "min":
             return float(np.min(scores))
         return float(np.mean(scores))
 
-    merged = []
-    current = {**entities[0], "_scores": [entities[0]["ner_score"]]}
-
-    for entity in entities[1:]:
-        same_doc   = entity["filename"] == current["filename"]
-        same_label = entity["ner_class"]    == current["ner_class"]
-        contiguous = entity["start"]    == current["end"]
-        space_gap  = allow_space and entity["start"] == current["end"] + 1
-
-        if same_doc and same_label and (contiguous or space_gap):
-            current["end"] = entity["end"]
-            current["span"] = text[current["start"]:current["end"]]
-            current["_scores"].append(entity["ner_score"])
-        else:
-            current["ner_score"] = _aggregate(current.pop("_scores"))
-            merged.append(current)
-            current = {**entity, "_scores": [entity["ner_score"]]}
-
-    current["ner_score"] = _aggregate(current.pop("_scores"))
-    merged.append(current)
+    # Entity k + 1 joins the group of entity k
+    doc = batch.doc_ids()
+    gap = batch.start[1:] - batch.end[:-1]
+    joins = (doc[1:] == doc[:-1]) & (batch.ner_class[1:] == batch.ner_class[:-1]) & ((gap == 0) | (allow_space & (gap == 1)))
+    heads = np.flatnonzero(np.concatenate(([True], ~joins)))
+    lasts = np.concatenate((heads[1:], [len(batch)])) - 1
+
+    merged = batch.take(heads)
+    merged.end = batch.end[lasts]
+    for k in np.flatnonzero(lasts > heads).tolist():
+        merged.ner_score[k] = _aggregate(batch.ner_score[heads[k]:lasts[k] + 1])
+        merged.span[k] = texts[doc[heads[k]]][merged.start[k]:merged.end[k]]
     return merged
 
 
@@ -134,3 +128,19 @@ def join_all_entities(results: list[list[list[dict]]]) -> list[list[dict]]:
         entities_all.append(entities_file)
     return entities_all
 
+
+def join_all_batches(results: list["AnnotationBatch"]) -> "AnnotationBatch":
+    """
+    :func:`join_all_entities` for the columnar results of several models over
+    the same documents: one batch with the entities of every model, sorted by
+    ``(start, -end)`` within each document (ties in model order).
+    """
+    import numpy as np
+    from app.src.annotations import AnnotationBatch
+
+    n_docs = results[0].n_docs
+    stacked = AnnotationBatch.concat(results)
+    doc = stacked.doc_ids() % n_docs if n_docs else stacked.doc_ids()
+    # lexsort is stable: entities of equal keys keep the order of the models
+    order = np.lexsort((-stacked.end, stacked.start, doc))
+    return stacked.select(order, doc[order], n_docs)
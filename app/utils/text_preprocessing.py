@@ -1,6 +1,34 @@
 import re
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Callable, Optional
+
 from nltk.tokenize import PunktSentenceTokenizer
 
+from app.metrics import counter, timed
+
+SKIPPED_SENTENCES = counter("ner_sentences_skipped_total", "Sentences not run through a NER model because they overlap no requested span")
+
+
+# --- Span selection ----------------------------------------------------------
+
+def make_overlap_test(spans: list[tuple[int, int]]) -> Callable[[int, int], bool]:
+    """
+    Return ``overlaps(start, end)``: whether ``[start, end)`` overlaps any of the
+    ``(start, end)`` *spans*. Each test is a binary search over the spans sorted
+    by start, against the furthest end reached so far.
+    """
+    spans = sorted(spans)
+    starts = [s for s, _ in spans]
+    reach = list(accumulate((e for _, e in spans), max))
+
+    def overlaps(start: int, end: int) -> bool:
+        i = bisect_left(starts, end)  # spans starting before *end*
+        return i > 0 and reach[i - 1] > start
+
+    return overlaps
+
+
 # =============================================================================
 # V1 INFERENCE
 # =============================================================================
@@ -83,6 +111,7 @@ def _split_sentence_into_chunks(
         - text        (str): the chunk substring
         - start       (int): inclusive start char offset relative to *sentence*
         - end         (int): exclusive end char offset relative to *sentence*
+        - n_tokens    (int): number of tokens, special tokens excluded
 
     Returns an empty list if *sentence* is empty or whitespace-only.
     """
@@ -103,7 +132,7 @@ def _split_sentence_into_chunks(
 
     # Sentence already fits — return as a single chunk
     if len(input_ids) <= safe_len:
-        return [{"text": sentence, "start": 0, "end": len(sentence)}]
+        return [{"text": sentence, "start": 0, "end": len(sentence), "n_tokens": len(input_ids)}]
 
     chunks = []
     start_tok = 0
@@ -112,13 +141,13 @@ def _split_sentence_into_chunks(
         char_start = offsets[start_tok][0]
         char_end = offsets[end_tok - 1][1]
         if char_end > char_start:
-            chunks.append({"text": sentence[char_start:char_end], "start": char_start, "end": char_end})
+            chunks.append({"text": sentence[char_start:char_end], "start": char_start, "end": char_end, "n_tokens": end_tok - start_tok})
         start_tok = end_tok
 
     return chunks
 
 
-def build_inference_chunks(text: str, tokenizer, max_length: int) -> list[dict]:
+def build_inference_chunks(text: str, tokenizer, max_length: int, spans: Optional[list[tuple[int, int]]] = None) -> list[dict]:
     """
     Segment *text* into inference-ready chunks, one per sentence (or per
     token-safe sub-sentence if a sentence is too long for the model).
@@ -132,32 +161,42 @@ def build_inference_chunks(text: str, tokenizer, max_length: int) -> list[dict]:
         - start    (int): inclusive start char offset in *text*
         - end      (int): exclusive end char offset in *text*
         - text     (str): the chunk substring
+        - n_tokens (int): number of tokens, special tokens excluded
 
-    Empty / whitespace-only chunks are discarded.
+    Empty / whitespace-only chunks are discarded. If *spans* is given, only the
+    sentences overlapping at least one ``(start, end)`` span are chunked.
     """
-    sentences = _split_sentences(text)
+    with timed("sentence_split"):
+        sentences = _split_sentences(text)
+    if spans is not None:
+        overlaps = make_overlap_test(spans)
+        kept = [s for s in sentences if overlaps(s["start"], s["end"])]
+        SKIPPED_SENTENCES.inc(len(sentences) - len(kept))
+        sentences = kept
     chunks = []
     chunk_id = 0
 
-    for sent in sentences:
-        sub_chunks = _split_sentence_into_chunks(
-            sentence=sent["text"],
-            tokenizer=tokenizer,
-            max_length=max_length,
-        )
-        for sub in sub_chunks:
-            # Convert offsets that are local to the sentence → global in *text*
-            global_start = sent["start"] + sub["start"]
-            global_end = sent["start"] + sub["end"]
-            chunk_text = text[global_start:global_end]
-            if chunk_text.strip():
-                chunks.append({
-                    "chunk_id": chunk_id,
-                    "sent_id": sent["sent_id"],
-                    "start": global_start,
-                    "end": global_end,
-                    "text": chunk_text,
-                })
-                chunk_id += 1
+    with timed("chunking"):
+        for sent in sentences:
+            sub_chunks = _split_sentence_into_chunks(
+                sentence=sent["text"],
+                tokenizer=tokenizer,
+                max_length=max_length,
+            )
+            for sub in sub_chunks:
+                # Convert offsets that are local to the sentence → global in *text*
+                global_start = sent["start"] + sub["start"]
+                global_end = sent["start"] + sub["end"]
+                chunk_text = text[global_start:global_end]
+                if chunk_text.strip():
+                    chunks.append({
+                        "chunk_id": chunk_id,
+                        "sent_id": sent["sent_id"],
+                        "start": global_start,
+                        "end": global_end,
+                        "text": chunk_text,
+                        "n_tokens": sub["n_tokens"],
+                    })
+                    chunk_id += 1
 
     return chunks
\ No newline at end of file
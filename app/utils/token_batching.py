@@ -0,0 +1,115 @@
+"""
+Batching by token budget for the NER and NEL encoders.
+
+Inputs are sorted by token length and grouped so that each padded batch
+(``len(batch) * longest input``) holds at most ``max_tokens`` tokens: many
+short inputs share a batch, a few long ones get their own. Memory per forward
+is therefore bounded by the budget, whatever the input lengths.
+
+When a batch still runs out of memory (e.g. the GPU is shared), the budget of
+that model is halved below the failed batch's size and the batch is split and
+retried; the lower budget is kept for the following calls. A single input that
+runs out of memory is a real error and is raised.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+from collections import deque
+from typing import Callable, Optional, Sequence
+
+from app.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+OOM_RETRIES = counter("token_budget_oom_total", "Batches split and retried after an out-of-memory error, by model")
+
+_OOM_MESSAGES = ("out of memory", "can't allocate memory", "failed to allocate memory")
+
+
+def is_out_of_memory(exc: BaseException) -> bool:
+    """Whether *exc* is an allocation failure of torch (CPU or CUDA) or ONNX Runtime."""
+    if isinstance(exc, MemoryError):
+        return True
+    return isinstance(exc, RuntimeError) and any(m in str(exc).lower() for m in _OOM_MESSAGES)
+
+
+def _release_cached_memory() -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class TokenBudget:
+    """
+    Token budget of one model's batches.
+
+    Args:
+        max_tokens: Maximum padded tokens per batch.
+        name:       Model name, for metrics and logs.
+    """
+
+    def __init__(self, max_tokens: int, name: str = "model"):
+        if max_tokens < 1:
+            raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+        self.max_tokens = max_tokens
+        self.name = name
+
+    def batches(self, lengths: Sequence[int], max_items: Optional[int] = None) -> list[list[int]]:
+        """
+        Group the indices of *lengths* (tokens per input) into batches within
+        the budget, longest inputs first. With *max_items*, batches also hold
+        at most that many inputs. An input longer than the budget is a batch
+        on its own.
+        """
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+            # Sorted by decreasing length: the first input sets the padded length
+            if batch and (
+                (len(batch) + 1) * max(1, lengths[batch[0]]) > self.max_tokens
+                or (max_items is not None and len(batch) >= max_items)
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def run(
+        self,
+        items: Sequence,
+        lengths: Sequence[int],
+        fn: Callable[[list], Sequence],
+        max_items: Optional[int] = None,
+    ) -> list:
+        """
+        Call *fn* on batches of *items* (see :meth:`batches`) and return its
+        per-item outputs in the order of *items*. *fn* takes a list of items
+        and returns one output per item.
+        """
+        results: list = [None] * len(items)
+        pending = deque(self.batches(lengths, max_items))
+        while pending:
+            batch = pending.popleft()
+            try:
+                outputs = fn([items[i] for i in batch])
+            except Exception as exc:
+                if len(batch) == 1 or not is_out_of_memory(exc):
+                    raise
+                _release_cached_memory()
+                padded = len(batch) * max(1, lengths[batch[0]])
+                self.max_tokens = max(1, min(self.max_tokens, padded) // 2)
+                OOM_RETRIES.inc(model=self.name)
+                logger.warning(
+                    "%s ran out of memory on a batch of %d inputs (%d padded tokens); "
+                    "token budget lowered to %d", self.name, len(batch), padded, self.max_tokens,
+                )
+                sub_lengths = [lengths[i] for i in batch]
+                pending.extendleft(reversed([[batch[j] for j in sub] for sub in self.batches(sub_lengths, max_items)]))
+                continue
+            for i, output in zip(batch, outputs):
+                results[i] = output
+        return results
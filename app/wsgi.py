@@ -0,0 +1,26 @@
+"""
+Production WSGI entry point.
+
+Importing this module builds and loads every pipeline listed in
+``PRELOAD_PIPELINES`` (see ``app/config.py``) before the server forks its
+workers, so model weights, gazetteers and vector DBs are loaded once in the
+master and shared copy-on-write by every worker::
+
+    gunicorn -c gunicorn.conf.py app.wsgi:application
+
+``GET /ready`` answers 503 until the warm-up has finished.
+
+Note that CUDA cannot be initialised before ``fork``: on GPU nodes run with
+``GUNICORN_PRELOAD=0`` so that every worker loads its own copy instead.
+"""
+
+import gc
+
+from app import app as application, warmup
+from app.config import PRELOAD_PIPELINES
+
+warmup(PRELOAD_PIPELINES)
+
+# Move everything allocated so far out of the collector's generations, so that
+# GC passes in the workers do not write to (and un-share) the preloaded pages.
+gc.freeze()
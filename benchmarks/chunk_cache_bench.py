@@ -0,0 +1,143 @@
+"""
+Benchmark of the NER chunk cache (see :mod:`app.utils.chunk_cache`).
+
+Tags a corpus once with the cache disabled and once with a cold in-memory
+cache, each in a fresh CPU-only process, feeding the documents in batches
+in corpus order as a backfill or a stream of requests would. Reports:
+
+* the share of chunks not run through the model: served from the cache, or
+  repeated within the same call;
+* docs/s with and without the cache;
+* agreement of the cached run with the uncached one (as in
+  :mod:`benchmarks.ner_bench`; expect a recall of 1 and no extra entities).
+
+The share of repeated chunks depends on the corpus: run it on real notes with
+``--corpus`` (a directory of ``.txt`` files or a ``.jsonl`` file, as for
+``app.batch``) and the models of ``REGISTRY_PATH``. Without ``--corpus`` it
+runs on the synthetic fixtures, whose sentences rarely repeat.
+
+::
+
+  uv run python -m benchmarks.chunk_cache_bench --corpus /data/notes.jsonl --lang es --entity disease -o cache.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures
+from benchmarks.ner_bench import compare_entities
+from benchmarks.pipeline_bench import _git_commit
+
+SCENARIOS = {"off": 0, "memory": 1_000_000}
+
+
+def _load_texts(corpus: str) -> list[str]:
+    # Same input formats as app.batch (the fixtures corpus is a .jsonl file too)
+    from app.batch import _iter_shard
+
+    return [text for _, text, _ in _iter_shard(Path(corpus), 0, 1)]
+
+
+def _run_scenario(name: str, corpus: str, lang: str, entity: str, version: int, batch_size: int) -> dict:
+    """Runs in a fresh process, configured by the environment set in main()."""
+    from app.model_manager.resolver import LocalResolver
+    from app.src.ner import encoder_inference, load_encoder_models
+    from app.src.ner.encoder_inference_v2 import CHUNKS
+    from app.utils.chunk_cache import LOOKUPS
+
+    model = load_encoder_models([LocalResolver().get_ner_path(lang, entity)[0]], version=version, lang=lang)
+    texts = _load_texts(corpus)
+
+    entities = []
+    t0 = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        for doc in encoder_inference(texts[i:i + batch_size], model, version=version, lang=lang)[0]:
+            entities.append([[e["start"], e["end"], e["ner_class"], e["ner_score"]] for e in doc])
+    wall = time.perf_counter() - t0
+
+    # Chunks looked up in the cache (all of them, when it is enabled) and run through the model
+    looked_up = sum(LOOKUPS.snapshot().values())
+    forwarded = sum(CHUNKS.snapshot().values())
+    chunks = looked_up or forwarded
+    return {
+        "cache": name,
+        "docs": len(texts),
+        "chunks": int(chunks),
+        "chunks_forwarded": int(forwarded),
+        "skipped_pct": round(100 * (1 - forwarded / chunks), 2) if chunks else 0.0,
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(len(texts) / wall, 2) if wall else 0.0,
+        "entities": entities,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measure the share of NER chunks served by the chunk cache (CPU only).")
+    parser.add_argument("--corpus", help="Directory of .txt files or .jsonl file (default: the synthetic fixtures)")
+    parser.add_argument("--lang", default=LANG, help="Language of --corpus")
+    parser.add_argument("--entity", default="disease", help="Entity type whose NER model is run")
+    parser.add_argument("--version", type=int, default=2, choices=[2, 3], help="NER backend")
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per encoder_inference call")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench"), help="Where fixtures are built and cached")
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs, help="Synthetic documents (without --corpus)")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    # Only the in-memory tier: a disk tier would be warm from earlier runs
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+    args = build_parser().parse_args(argv)
+
+    cfg = None
+    corpus = args.corpus
+    if corpus is None:
+        cfg = FixtureConfig(n_docs=args.docs)
+        manifest = build_fixtures(args.work_dir, cfg)
+        os.environ["REGISTRY_PATH"] = manifest["registry"]
+        corpus = manifest["corpus"]
+
+    runs = {}
+    for name, size in SCENARIOS.items():
+        os.environ["NER_CHUNK_CACHE_SIZE"] = str(size)  # inherited by the scenario process
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            runs[name] = pool.submit(_run_scenario, name, corpus, args.lang, args.entity, args.version, args.batch_size).result()
+    reference = runs["off"]["entities"]
+    for run in runs.values():
+        run.update(compare_entities(run.pop("entities"), reference))
+    results = list(runs.values())
+
+    print(f"{'cache':<8}{'docs':>7}{'chunks':>9}{'skipped':>10}{'docs/s':>9}{'recall':>8}{'extra':>7}")
+    for r in results:
+        print(
+            f"{r['cache']:<8}{r['docs']:>7}{r['chunks']:>9}{r['skipped_pct']:>9.1f}%{r['docs_per_s']:>9.1f}"
+            f"{r['recall_vs_reference']:>8.3f}{r['extra_entities']:>7}"
+        )
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {
+                **(asdict(cfg) if cfg else {"corpus": corpus}),
+                "lang": args.lang, "entity": args.entity, "version": args.version, "batch_size": args.batch_size,
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
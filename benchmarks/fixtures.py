@@ -0,0 +1,258 @@
+"""
+Synthetic, self-contained fixtures for the benchmarks.
+
+Builds, under one work directory, everything a pipeline needs so that every
+method can run offline and CPU-only:
+
+* a gazetteer of pseudo-clinical terms (``code``/``term`` TSV) per entity;
+* a corpus of synthetic clinical notes that mention those terms, with
+  negation (``no``, ``niega``, ``sin``) and uncertainty (``posible``,
+  ``probable``) cues;
+* tiny stand-in NER and negation taggers. Their weights are not trained but
+  *constructed*: attention and feed-forward outputs are zeroed so each token's
+  hidden state is its own embedding, and the embeddings are one-hot on the
+  label the token should get. The models therefore run a real BERT forward
+  pass while tagging gazetteer words deterministically;
+* a stand-in NEL encoder (randomly initialised 768-d BERT + mean pooling) and
+  the gazetteer vector DBs built with it;
+* a registry YAML pointing at all of the above (use it through the
+  ``REGISTRY_PATH`` environment variable).
+
+Fixtures are rebuilt only when their configuration changes.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import unicodedata
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+LANG = "es"
+ENTITY_LABELS = {"disease": "ENFERMEDAD", "symptoms": "SINTOMA"}
+NEGATION_CUES = ["no", "niega", "sin"]
+UNCERTAINTY_CUES = ["posible", "probable", "sospecha"]
+FILLER = (
+    "paciente de años acude a urgencias por refiere presenta desde hace días "
+    "se observa en la exploración con antecedentes y tratamiento previo al "
+    "ingreso se solicita analítica control evolución favorable el la los las "
+    "un una del para tras durante consulta alta domicilio"
+).split()
+SYLLABLES = [
+    "car", "neu", "gas", "hep", "ne", "pul", "der", "os", "ar", "mi", "to", "ri",
+    "la", "co", "fi", "bro", "sis", "tis", "al", "gia", "pa", "tia", "me", "ma",
+    "cro", "lin", "fa", "ton", "mo", "ple", "xia", "dro",
+]
+
+
+@dataclass(frozen=True)
+class FixtureConfig:
+    n_docs: int = 200
+    sentences_per_doc: int = 8
+    gazetteer_size: int = 2000
+    mentions_per_sentence: float = 1.0
+    ner_hidden_size: int = 128
+    ner_layers: int = 2
+    seed: int = 13
+
+
+def _strip(word: str) -> str:
+    # Mirror the BERT normaliser (lowercase, no accents) used by the stand-in tokenizer.
+    word = unicodedata.normalize("NFD", word.lower())
+    return "".join(c for c in word if unicodedata.category(c) != "Mn")
+
+
+def _pseudo_words(rng: random.Random, n: int) -> list[str]:
+    words: set[str] = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _gazetteer(rng: random.Random, words: list[str], size: int) -> list[str]:
+    terms: set[str] = set()
+    while len(terms) < size:
+        terms.add(" ".join(rng.sample(words, rng.randint(1, 3))))
+    return sorted(terms)
+
+
+def _documents(rng: random.Random, terms: list[str], cfg: FixtureConfig) -> list[str]:
+    docs = []
+    for _ in range(cfg.n_docs):
+        sentences = []
+        for _ in range(cfg.sentences_per_doc):
+            words = rng.sample(FILLER, rng.randint(6, 12))
+            n_mentions = int(cfg.mentions_per_sentence) + (rng.random() < cfg.mentions_per_sentence % 1)
+            for _ in range(n_mentions):
+                mention = rng.choice(terms)
+                roll = rng.random()
+                if roll < 0.2:
+                    mention = f"{rng.choice(NEGATION_CUES)} {mention}"
+                elif roll < 0.3:
+                    mention = f"{rng.choice(UNCERTAINTY_CUES)} {mention}"
+                words.insert(rng.randint(0, len(words)), mention)
+            sentence = " ".join(words)
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        docs.append(" ".join(sentences))
+    return docs
+
+
+def _save_tokenizer(vocab_words: list[str], out_dir: Path):
+    from tokenizers.implementations import BertWordPieceTokenizer
+    from transformers import PreTrainedTokenizerFast
+
+    specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    letters = sorted({c for w in vocab_words for c in w} | set("abcdefghijklmnopqrstuvwxyz0123456789.,;:()-"))
+    tokens = specials + letters + [f"##{c}" for c in letters] + sorted(set(vocab_words) - set(letters))
+    vocab = {tok: i for i, tok in enumerate(tokens)}
+
+    wordpiece = BertWordPieceTokenizer(vocab, lowercase=True, strip_accents=True)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=wordpiece._tokenizer,
+        unk_token="[UNK]", pad_token="[PAD]", cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]",
+        model_max_length=512,
+    )
+    tokenizer.save_pretrained(str(out_dir))
+    return vocab
+
+
+def _build_tagger(out_dir: Path, vocab_words: list[str], word_labels: dict[str, str], labels: list[str], cfg: FixtureConfig) -> None:
+    """Token classifier that tags each word in *word_labels* with its label and everything else as O."""
+    import torch
+    from transformers import BertConfig, BertForTokenClassification
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    vocab = _save_tokenizer(vocab_words, out_dir)
+    labels = ["O"] + labels
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=cfg.ner_hidden_size,
+        num_hidden_layers=cfg.ner_layers,
+        num_attention_heads=max(1, cfg.ner_hidden_size // 64),
+        intermediate_size=cfg.ner_hidden_size * 2,
+        max_position_embeddings=512,
+        id2label=dict(enumerate(labels)),
+        label2id={label: i for i, label in enumerate(labels)},
+    )
+    model = BertForTokenClassification(config)
+    with torch.no_grad():
+        embeddings = model.bert.embeddings
+        embeddings.word_embeddings.weight.zero_()
+        embeddings.position_embeddings.weight.zero_()
+        embeddings.token_type_embeddings.weight.zero_()
+        label_ids = {label: i for i, label in enumerate(labels)}
+        for token, token_id in vocab.items():
+            embeddings.word_embeddings.weight[token_id, label_ids[word_labels.get(token, "O")]] = 10.0
+        for layer in model.bert.encoder.layer:
+            for dense in (layer.attention.output.dense, layer.output.dense):
+                dense.weight.zero_()
+                dense.bias.zero_()
+        model.classifier.weight.zero_()
+        model.classifier.bias.zero_()
+        for i in range(len(labels)):
+            model.classifier.weight[i, i] = 1.0
+    model.save_pretrained(str(out_dir))
+
+
+def _build_nel_encoder(out_dir: Path, vocab_words: list[str], seed: int) -> None:
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel
+
+    torch.manual_seed(seed)
+    backbone_dir = out_dir / "backbone"
+    backbone_dir.mkdir(parents=True, exist_ok=True)
+    vocab = _save_tokenizer(vocab_words, backbone_dir)
+    # 768-d to match the vector DB layout (see app.utils.download_model)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=768, num_hidden_layers=1, num_attention_heads=12, intermediate_size=1024)
+    BertModel(config).save_pretrained(str(backbone_dir))
+
+    transformer = models.Transformer(str(backbone_dir), max_seq_length=64)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    SentenceTransformer(modules=[transformer, pooling], device="cpu").save(str(out_dir))
+
+
+def build_fixtures(work_dir: Path, cfg: FixtureConfig = FixtureConfig()) -> dict:
+    """Create (or reuse) the fixtures for *cfg* under *work_dir*.
+
+    Returns ``{"registry": path, "corpus": path, "entities": [...]}``.
+    """
+    work_dir = Path(work_dir).resolve()
+    stamp = work_dir / "fixtures.json"
+    manifest = {
+        "registry": str(work_dir / "registry.yaml"),
+        "corpus": str(work_dir / "corpus.jsonl"),
+        "entities": list(ENTITY_LABELS),
+    }
+    if stamp.exists() and json.loads(stamp.read_text())["config"] == asdict(cfg):
+        return manifest
+
+    import pandas as pd
+    import yaml
+    from sentence_transformers import SentenceTransformer
+
+    from app.utils.download_model import create_vector_db
+
+    rng = random.Random(cfg.seed)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    words = _pseudo_words(rng, max(200, cfg.gazetteer_size // 4))
+
+    gazetteers = {}
+    for entity in ENTITY_LABELS:
+        terms = _gazetteer(rng, words, cfg.gazetteer_size)
+        gazetteers[entity] = terms
+        pd.DataFrame({"code": [f"{entity[:3].upper()}{i:06d}" for i in range(len(terms))], "term": terms}).to_csv(
+            work_dir / f"gazetteer_{entity}.tsv", sep="\t", index=False
+        )
+
+    all_terms = [t for terms in gazetteers.values() for t in terms]
+    docs = _documents(rng, all_terms, cfg)
+    with open(manifest["corpus"], "w", encoding="utf-8") as fh:
+        for i, doc in enumerate(docs):
+            fh.write(json.dumps({"id": f"doc{i:05d}", "text": doc}, ensure_ascii=False) + "\n")
+
+    vocab_words = sorted({_strip(w) for w in FILLER + NEGATION_CUES + UNCERTAINTY_CUES + words})
+    for entity, label in ENTITY_LABELS.items():
+        word_labels = {}
+        for term in gazetteers[entity]:
+            first, *rest = _strip(term).split()
+            word_labels.setdefault(first, f"B-{label}")
+            for w in rest:
+                word_labels.setdefault(w, f"I-{label}")
+        _build_tagger(work_dir / "ner" / entity, vocab_words, word_labels, [f"B-{label}", f"I-{label}"], cfg)
+
+    # Negation stand-in: cues are triggers, and the words of every other
+    # gazetteer term fall in a negation scope.
+    neg_labels = {_strip(c): "B-NEG" for c in NEGATION_CUES} | {_strip(c): "B-UNC" for c in UNCERTAINTY_CUES}
+    for term in gazetteers["disease"][::2]:
+        for w in _strip(term).split():
+            neg_labels.setdefault(w, "B-NSCO")
+    _build_tagger(
+        work_dir / "ner" / "negation", vocab_words, neg_labels,
+        [f"{p}-{c}" for c in ("NEG", "NSCO", "UNC", "USCO") for p in ("B", "I")], cfg,
+    )
+
+    nel_dir = work_dir / "nel"
+    _build_nel_encoder(nel_dir, vocab_words, cfg.seed)
+    encoder = SentenceTransformer(str(nel_dir), device="cpu")
+    (work_dir / "vectorized_dbs").mkdir(exist_ok=True)
+    for entity, terms in gazetteers.items():
+        create_vector_db(terms, encoder, work_dir / "vectorized_dbs" / f"{entity}.pt")
+
+    registry = {
+        "ner": {LANG: {e: {"repo_id": None, "local_path": str(work_dir / "ner" / e)} for e in [*ENTITY_LABELS, "negation"]}},
+        "nel": {LANG: {"repo_id": None, "local_path": str(nel_dir)}},
+        "gazetteers": {LANG: {e: str(work_dir / f"gazetteer_{e}.tsv") for e in ENTITY_LABELS}},
+        "vectorized_dbs": {LANG: {e: str(work_dir / "vectorized_dbs" / f"{e}.pt") for e in ENTITY_LABELS}},
+    }
+    with open(manifest["registry"], "w", encoding="utf-8") as fh:
+        yaml.safe_dump(registry, fh, sort_keys=False)
+
+    stamp.write_text(json.dumps({"config": asdict(cfg)}, indent=2))
+    return manifest
+
+
+def load_corpus(path: str | Path) -> list[str]:
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line)["text"] for line in fh if line.strip()]
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for POST /annotate.
+
+Fires a fixed number of requests from a pool of concurrent clients and reports
+throughput and latency percentiles. Run it once against the development server
+and once against the production entry point to compare them:
+
+  # dev server
+  uv run flask run --port=5000
+  uv run benchmarks/load_test.py --url http://localhost:5000
+
+  # production
+  PRELOAD_PIPELINES='[{"method": "biencoder", "lang": "es", "entities": ["disease"]}]' \\
+      uv run gunicorn -c gunicorn.conf.py app.wsgi:application
+  uv run benchmarks/load_test.py --url http://localhost:5000 --wait-ready
+"""
+
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TEXTS = [
+    "el paciente presenta cáncer y dolor de cabeza intenso",
+    "diagnóstico: neumonía bilateral con consolidación",
+    "Paciente de 67 años con fiebre alta y tos persistente desde hace tres días.",
+    "No presenta náuseas ni vómitos. Refiere dolor abdominal agudo.",
+]
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def wait_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/ready", timeout=5).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(1)
+    sys.exit(f"{url}/ready did not report OK within {timeout:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for POST /annotate")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the running API server")
+    parser.add_argument("--requests", type=int, default=200, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--texts-per-request", type=int, default=1, help="Texts sent in each request")
+    parser.add_argument("--method", default="biencoder")
+    parser.add_argument("--lang", default="es")
+    parser.add_argument("--entities", nargs="+", default=["disease"])
+    parser.add_argument("--wait-ready", action="store_true", help="Poll GET /ready before starting")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    if args.wait_ready:
+        wait_ready(args.url, timeout=600)
+
+    body = {
+        "texts": [TEXTS[i % len(TEXTS)] for i in range(args.texts_per_request)],
+        "method": args.method,
+        "lang": args.lang,
+        "entities": args.entities,
+    }
+
+    # Warm-up request: the lazy dev server loads its models here.
+    requests.post(f"{args.url}/annotate", json=body).raise_for_status()
+
+    def one_request(_):
+        t0 = time.perf_counter()
+        r = requests.post(f"{args.url}/annotate", json=body)
+        return time.perf_counter() - t0, r.status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(args.requests)))
+    wall = time.perf_counter() - t0
+
+    latencies = [lat for lat, status in outcomes if status == 200]
+    summary = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": sum(1 for _, status in outcomes if status != 200),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(latencies) / wall, 2),
+        "docs_per_s": round(len(latencies) * args.texts_per_request / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            print(f"{key:<16}{value}")
+    return 0 if summary["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
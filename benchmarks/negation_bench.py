@@ -0,0 +1,188 @@
+"""
+Benchmark of the negation taggers.
+
+Runs the biencoder pipeline with negation three times per NER backend
+version, each in a fresh CPU-only process over the same synthetic corpus (see
+:mod:`benchmarks.fixtures`), built with few mentions per sentence so that most
+sentences hold no entity:
+
+* ``eager``: the negation model tags every sentence (``lazy_negation=False``);
+* ``lazy``:  the negation model tags only the sentences that contain an
+  entity (the default);
+* ``rules``: the rule-based :class:`NegexTagger` used by the lexical methods
+  replaces the model.
+
+Reported per run:
+
+* chunks forwarded through the negation model, and sentences skipped;
+* time spent tagging negation (``negation_ner`` or ``negation_rules``), and
+  overall docs/s;
+* against the eager run: whether the lazy run gave every entity the same
+  ``is_negated`` / ``is_uncertain`` attributes, and the share of entities on
+  which the rules agree with the model. The stand-in negation model only
+  scopes half of the disease terms, so that share measures the benchmark
+  fixtures more than the lexicon.
+
+::
+
+  uv run python -m benchmarks.negation_bench -o negation.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures, load_corpus
+from benchmarks.pipeline_bench import _git_commit, _stage_sums
+
+TAGGERS = ("eager", "lazy", "rules")
+
+
+def _counter_total(name: str, **labels) -> float:
+    from app.metrics import _registry
+
+    metric = _registry.get(name)
+    if metric is None:
+        return 0.0
+    wanted = set(labels.items())
+    return sum(value for key, value in metric.snapshot().items() if wanted <= set(key))
+
+
+class _RulesPipeline:
+    """Biencoder pipeline whose negation comes from the rule-based tagger."""
+
+    def __init__(self, **kwargs):
+        from app.src.pipelines import BiencoderPipeline
+
+        self.pipeline = BiencoderPipeline(**kwargs, negation=False)
+        self.negation_path = self.pipeline.resolver.get_ner_path(LANG, "negation")[0]
+
+    def load(self) -> None:
+        self.pipeline.load()
+        self.pipeline.negex = self.pipeline._acquire_negex(LANG)
+
+    def predict(self, texts: list[str]) -> list[list[dict]]:
+        return self.pipeline._negex_attributes(texts, self.pipeline.predict(texts))
+
+
+def _run_scenario(scenario: dict, corpus_path: str, batch_size: int) -> dict:
+    """Runs in a fresh process: load, warm up, then annotate the corpus once."""
+    from app.src.pipelines import BiencoderPipeline
+
+    kwargs = {"lang": LANG, "entities": scenario["entities"], "ner_version": scenario["ner_version"]}
+    if scenario["tagger"] == "rules":
+        pipeline, stage = _RulesPipeline(**kwargs), "negation_rules"
+    else:
+        pipeline = BiencoderPipeline(**kwargs, negation=True, lazy_negation=scenario["tagger"] == "lazy")
+        stage = "negation_ner"
+    pipeline.load()
+    negation_model = Path(pipeline.negation_path).name
+
+    texts = load_corpus(corpus_path)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    pipeline.predict(batches[0])  # warm-up, not timed
+
+    chunks_before = _counter_total("ner_chunks_total", model=negation_model)
+    skipped_before = _counter_total("ner_sentences_skipped_total")
+    stage_before = _stage_sums().get(stage, 0.0)
+
+    attributes = []
+    t0 = time.perf_counter()
+    for batch in batches:
+        for doc in pipeline.predict(batch):
+            attributes.append([[e["start"], e["end"], e["is_negated"], e["is_uncertain"]] for e in doc])
+    wall = time.perf_counter() - t0
+
+    return {
+        **scenario,
+        "docs": len(texts),
+        "mentions": sum(len(doc) for doc in attributes),
+        "negation_chunks": int(_counter_total("ner_chunks_total", model=negation_model) - chunks_before),
+        "sentences_skipped": int(_counter_total("ner_sentences_skipped_total") - skipped_before),
+        "negation_s": round(_stage_sums().get(stage, 0.0) - stage_before, 4),
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(len(texts) / wall, 2),
+        "attributes": attributes,
+    }
+
+
+def _agreement(attributes: list[list], reference: list[list]) -> float:
+    """Share of reference entities that got the same attributes."""
+    total = agree = 0
+    for doc, ref_doc in zip(attributes, reference):
+        by_span = {tuple(a[:2]): a for a in doc}
+        for ref in ref_doc:
+            total += 1
+            agree += by_span.get(tuple(ref[:2])) == ref
+    return agree / total if total else 1.0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare the negation taggers on synthetic data (CPU only).")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench/negation"), help="Where fixtures are built and cached")
+    parser.add_argument("--ner-versions", nargs="+", type=int, default=[1, 2], choices=[1, 2])
+    parser.add_argument("--entities", nargs="+", default=["disease"], choices=["disease", "symptoms"])
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs)
+    parser.add_argument("--sentences", type=int, default=FixtureConfig.sentences_per_doc, help="Sentences per document")
+    parser.add_argument("--mentions", type=float, default=0.2, help="Average entity mentions per sentence")
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per predict call")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    # Every chunk goes through the NER models (see benchmarks/chunk_cache_bench.py)
+    os.environ["NER_CHUNK_CACHE_SIZE"] = "0"
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    args = build_parser().parse_args(argv)
+
+    cfg = FixtureConfig(n_docs=args.docs, sentences_per_doc=args.sentences, mentions_per_sentence=args.mentions)
+    manifest = build_fixtures(args.work_dir, cfg)
+    os.environ["REGISTRY_PATH"] = manifest["registry"]
+
+    results = []
+    for version in args.ner_versions:
+        runs = {}
+        for tagger in TAGGERS:
+            scenario = {"ner_version": version, "tagger": tagger, "entities": args.entities}
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                runs[tagger] = pool.submit(_run_scenario, scenario, manifest["corpus"], args.batch_size).result()
+        eager = runs["eager"]["attributes"]
+        runs["lazy"]["same_attributes"] = runs["lazy"]["attributes"] == eager
+        runs["rules"]["agreement"] = _agreement(runs["rules"]["attributes"], eager)
+        for run in runs.values():
+            del run["attributes"]
+            results.append(run)
+
+    print(f"{'scenario':<14}{'neg chunks':>12}{'skipped':>10}{'neg s':>9}{'docs/s':>9}{'same':>6}{'agree':>8}")
+    for r in results:
+        same = "" if "same_attributes" not in r else ("yes" if r["same_attributes"] else "NO")
+        agree = f"{r['agreement']:.1%}" if "agreement" in r else ""
+        print(
+            f"{'v' + str(r['ner_version']) + '/' + r['tagger']:<14}{r['negation_chunks']:>12}"
+            f"{r['sentences_skipped']:>10}{r['negation_s']:>9.2f}{r['docs_per_s']:>9.1f}{same:>6}{agree:>8}"
+        )
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {**asdict(cfg), "batch_size": args.batch_size, "entities": args.entities},
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0 if all(r.get("same_attributes", True) for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
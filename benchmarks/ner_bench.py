@@ -0,0 +1,156 @@
+"""
+Benchmark of the NER inference backends.
+
+Runs every stand-in NER model of :mod:`benchmarks.fixtures` over the synthetic
+corpus with each ``encoder_inference`` version, each in a fresh CPU-only
+process, and reports:
+
+* model-load time (for v3 this includes the ONNX export on the first run);
+* chunks/s and docs/s of the forward pass;
+* agreement with v2, the reference: the share of v2 entities found with the
+  same offsets and class, the number of extra entities, and the largest
+  ``ner_score`` difference on the matching ones.
+
+::
+
+  uv run --extra onnx python -m benchmarks.ner_bench --versions 2 3 -o ner.json
+
+``--max-batch-tokens`` sets the token budget of the v2/v3 batches (see
+:mod:`app.utils.token_batching`), to compare budgets across runs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures, load_corpus
+from benchmarks.pipeline_bench import _git_commit
+
+REFERENCE = 2
+
+
+def _run_scenario(scenario: dict, corpus_path: str, batch_size: int) -> dict:
+    """Runs in a fresh process: load one model, warm up, then tag the corpus once."""
+    from app.model_manager.resolver import LocalResolver
+    from app.src.ner import encoder_inference, load_encoder_models
+    from app.src.ner.encoder_inference_v2 import CHUNKS
+
+    path = LocalResolver().get_ner_path(LANG, scenario["model"])[0]
+    t0 = time.perf_counter()
+    model = load_encoder_models([path], version=scenario["version"], lang=LANG)
+    load_s = time.perf_counter() - t0
+
+    texts = load_corpus(corpus_path)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    encoder_inference(batches[0], model, version=scenario["version"], lang=LANG)  # warm-up, not timed
+
+    chunks_before = sum(CHUNKS.snapshot().values())
+    entities = []
+    t0 = time.perf_counter()
+    for batch in batches:
+        for doc in encoder_inference(batch, model, version=scenario["version"], lang=LANG)[0]:
+            entities.append([[e["start"], e["end"], e["ner_class"], e["ner_score"]] for e in doc])
+    wall = time.perf_counter() - t0
+    chunks = sum(CHUNKS.snapshot().values()) - chunks_before
+
+    return {
+        **scenario,
+        "load_s": round(load_s, 3),
+        "chunks": int(chunks),
+        "wall_s": round(wall, 3),
+        "chunks_per_s": round(chunks / wall, 1),
+        "docs_per_s": round(len(texts) / wall, 2),
+        "entities": entities,
+    }
+
+
+def compare_entities(entities: list[list], reference: list[list]) -> dict:
+    """Agreement of *entities* with *reference*, both ``[doc][entity] = [start, end, class, score]``."""
+    total = found = extra = 0
+    max_score_diff = 0.0
+    for doc, ref_doc in zip(entities, reference):
+        by_key = {tuple(e[:3]): e[3] for e in doc}
+        ref_keys = set()
+        for start, end, label, score in ref_doc:
+            total += 1
+            ref_keys.add((start, end, label))
+            if (start, end, label) in by_key:
+                found += 1
+                max_score_diff = max(max_score_diff, abs(by_key[(start, end, label)] - score))
+        extra += sum(key not in ref_keys for key in by_key)
+    return {
+        "recall_vs_reference": round(found / total, 4) if total else 1.0,
+        "extra_entities": extra,
+        "max_score_diff": round(max_score_diff, 4),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare the NER inference backends on synthetic data (CPU only).")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench"), help="Where fixtures are built and cached")
+    parser.add_argument("--versions", nargs="+", type=int, default=[2, 3], choices=[1, 2, 3])
+    parser.add_argument("--models", nargs="+", default=["disease", "negation"], choices=["disease", "symptoms", "negation"])
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs)
+    parser.add_argument("--sentences", type=int, default=FixtureConfig.sentences_per_doc, help="Sentences per document")
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per encoder_inference call")
+    parser.add_argument("--max-batch-tokens", type=int, help="Token budget of a v2/v3 forward batch (default: NER_MAX_BATCH_TOKENS)")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    args = build_parser().parse_args(argv)
+    if args.max_batch_tokens is not None:
+        os.environ["NER_MAX_BATCH_TOKENS"] = str(args.max_batch_tokens)  # inherited by the scenario processes
+    # Every chunk goes through the NER models (see benchmarks/chunk_cache_bench.py)
+    os.environ["NER_CHUNK_CACHE_SIZE"] = "0"
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+
+    cfg = FixtureConfig(n_docs=args.docs, sentences_per_doc=args.sentences)
+    manifest = build_fixtures(args.work_dir, cfg)
+    os.environ["REGISTRY_PATH"] = manifest["registry"]
+
+    versions = [REFERENCE] + [v for v in args.versions if v != REFERENCE]
+    results = []
+    for model in args.models:
+        runs = {}
+        for version in versions:
+            scenario = {"model": model, "version": version}
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                runs[version] = pool.submit(_run_scenario, scenario, manifest["corpus"], args.batch_size).result()
+        reference = runs[REFERENCE]["entities"]
+        for run in runs.values():
+            run.update(compare_entities(run.pop("entities"), reference))
+            results.append(run)
+
+    print(f"{'scenario':<16}{'load s':>8}{'chunks/s':>10}{'docs/s':>9}{'recall':>8}{'extra':>7}{'Δscore':>8}")
+    for r in results:
+        print(
+            f"{r['model'] + '/v' + str(r['version']):<16}{r['load_s']:>8.2f}{r['chunks_per_s']:>10.1f}{r['docs_per_s']:>9.1f}"
+            f"{r['recall_vs_reference']:>8.3f}{r['extra_entities']:>7}{r['max_score_diff']:>8.4f}"
+        )
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {**asdict(cfg), "batch_size": args.batch_size, "reference_version": REFERENCE,
+                       "max_batch_tokens": int(os.environ.get("NER_MAX_BATCH_TOKENS", 8192))},
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Offline benchmark of every annotation pipeline.
+
+Builds synthetic clinical notes, gazetteers and tiny stand-in models (see
+:mod:`benchmarks.fixtures`), then runs each ``method2pipeline`` entry — and,
+for the NER-based methods, each NER backend version — in a fresh CPU-only
+process, measuring:
+
+* model-load time (``pipeline.load()``);
+* throughput (docs/s) and per-batch latency percentiles;
+* peak RSS of the process;
+* the time spent in each pipeline stage (from ``app.metrics``);
+* for ``cascade``, the mentions linked by each tier (exact, fuzzy, dense).
+
+Results are written as JSON (with the commit they were measured on) so runs
+can be compared across commits::
+
+  uv run python -m benchmarks.pipeline_bench -o bench-main.json
+  git switch my-branch
+  uv run python -m benchmarks.pipeline_bench -o bench-branch.json --compare bench-main.json
+
+Only relative numbers are meaningful: the stand-in models are much smaller
+than the real ones, so the benchmark mostly exercises the code around them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures, load_corpus
+
+# Methods that have no NER step
+NO_NER = {"lookup"}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def _stage_sums() -> dict[str, float]:
+    from app.metrics import STAGE_SECONDS
+
+    return {dict(labels)["stage"]: s["sum"] for labels, s in STAGE_SECONDS.snapshot().items()}
+
+
+def _cascade_hits() -> dict[str, float]:
+    from app.src.pipelines import CASCADE_MENTIONS
+
+    return {dict(labels)["tier"]: n for labels, n in CASCADE_MENTIONS.snapshot().items()}
+
+
+def _run_scenario(scenario: dict, corpus_path: str, batch_size: int, repeats: int) -> dict:
+    """Runs in a fresh process: import, load, warm up, then time every batch."""
+    t0 = time.perf_counter()
+    from app import method2pipeline
+    import_s = time.perf_counter() - t0
+
+    kwargs = {"lang": LANG, "entities": scenario["entities"]}
+    if scenario["ner_version"] is not None:
+        kwargs["ner_version"] = scenario["ner_version"]
+    if scenario["negation"]:
+        kwargs["negation"] = True
+    pipeline = method2pipeline[scenario["method"]](**kwargs)
+
+    t0 = time.perf_counter()
+    pipeline.load()
+    load_s = time.perf_counter() - t0
+
+    texts = load_corpus(corpus_path)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    pipeline.predict(batches[0])  # warm-up, not timed
+    stages_before = _stage_sums()
+    hits_before = _cascade_hits()
+
+    latencies, n_docs, n_mentions = [], 0, 0
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches:
+            b0 = time.perf_counter()
+            results = pipeline.predict(batch)
+            latencies.append(time.perf_counter() - b0)
+            n_docs += len(batch)
+            n_mentions += sum(len(doc) for doc in results)
+    wall = time.perf_counter() - t0
+
+    stages = {
+        stage: round(total - stages_before.get(stage, 0.0), 4)
+        for stage, total in _stage_sums().items()
+        if total - stages_before.get(stage, 0.0) > 0
+    }
+    tiers = {tier: int(n - hits_before.get(tier, 0)) for tier, n in _cascade_hits().items()}
+    return {
+        **scenario,
+        "import_s": round(import_s, 3),
+        "load_s": round(load_s, 3),
+        "docs": n_docs,
+        "mentions": n_mentions,
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(n_docs / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_rss_mb": round(_peak_rss_bytes() / 2**20, 1),
+        "stages_s": stages,
+        **({"cascade_tiers": tiers} if any(tiers.values()) else {}),
+    }
+
+
+def _scenarios(methods: list[str], ner_versions: list[int], entities: list[str], negation: bool) -> list[dict]:
+    scenarios = []
+    for method in methods:
+        for version in ([None] if method in NO_NER else ner_versions):
+            base = {"method": method, "ner_version": version, "entities": entities, "negation": False}
+            scenarios.append(base)
+            if negation:
+                scenarios.append({**base, "negation": True})
+    return scenarios
+
+
+def _label(result: dict) -> str:
+    label = result["method"]
+    if result["ner_version"] is not None:
+        label += f"/v{result['ner_version']}"
+    if result["negation"]:
+        label += "/neg"
+    return label
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_table(results: list[dict], baseline: dict[str, dict] | None) -> None:
+    header = f"{'scenario':<28}{'load s':>8}{'docs/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>9}"
+    if baseline:
+        header += f"{'Δ docs/s':>10}"
+    print(header)
+    for r in results:
+        line = (
+            f"{_label(r):<28}{r['load_s']:>8.2f}{r['docs_per_s']:>10.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['peak_rss_mb']:>9.0f}"
+        )
+        if baseline:
+            ref = baseline.get(_label(r))
+            line += f"{(r['docs_per_s'] / ref['docs_per_s'] - 1) * 100:>+9.1f}%" if ref else f"{'n/a':>10}"
+        print(line)
+    for r in results:
+        if "cascade_tiers" in r:
+            tiers = r["cascade_tiers"]
+            total = sum(tiers.values())
+            print(f"{_label(r)} mentions by tier: " + ", ".join(
+                f"{tier} {tiers.get(tier, 0)} ({tiers.get(tier, 0) / total:.0%})" for tier in ("exact", "fuzzy", "dense")
+            ))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from app import method2pipeline
+
+    parser = argparse.ArgumentParser(description="Benchmark every annotation pipeline on synthetic data (CPU only).")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench"), help="Where fixtures are built and cached")
+    parser.add_argument("--methods", nargs="+", default=list(method2pipeline), choices=list(method2pipeline))
+    parser.add_argument("--ner-versions", nargs="+", type=int, default=[1, 2], choices=[1, 2, 3])
+    parser.add_argument("--entities", nargs="+", default=["disease"], choices=["disease", "symptoms"])
+    parser.add_argument("--negation", action="store_true", help="Also run every method with negation")
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs)
+    parser.add_argument("--sentences", type=int, default=FixtureConfig.sentences_per_doc, help="Sentences per document")
+    parser.add_argument("--gazetteer-size", type=int, default=FixtureConfig.gazetteer_size)
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per predict call")
+    parser.add_argument("--repeats", type=int, default=1, help="Passes over the corpus per scenario")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="Earlier results file to report docs/s changes against")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    # CPU only, also for the fixture build; inherited by the scenario processes.
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    # Every chunk goes through the NER models (see benchmarks/chunk_cache_bench.py)
+    os.environ["NER_CHUNK_CACHE_SIZE"] = "0"
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    args = build_parser().parse_args(argv)
+
+    cfg = FixtureConfig(n_docs=args.docs, sentences_per_doc=args.sentences, gazetteer_size=args.gazetteer_size)
+    manifest = build_fixtures(args.work_dir, cfg)
+
+    os.environ["REGISTRY_PATH"] = manifest["registry"]
+
+    results = []
+    for scenario in _scenarios(args.methods, args.ner_versions, args.entities, args.negation):
+        # One process per scenario: isolated peak RSS and a cold model load.
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            result = pool.submit(_run_scenario, scenario, manifest["corpus"], args.batch_size, args.repeats).result()
+        results.append(result)
+        print(f"  {_label(result)}: {result['docs_per_s']} docs/s", file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        baseline = {_label(r): r for r in json.loads(args.compare.read_text())["results"]}
+    _print_table(results, baseline)
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+            "config": {**asdict(cfg), "batch_size": args.batch_size, "repeats": args.repeats, "entities": args.entities},
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
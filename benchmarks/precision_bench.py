@@ -0,0 +1,184 @@
+"""
+Benchmark of the reduced-precision encoders (``NER_PRECISION`` /
+``NEL_PRECISION``, see :mod:`app.utils.precision`).
+
+For each precision, in a fresh CPU-only process, loads the stand-in NER models
+of :mod:`benchmarks.fixtures` (``encoder_inference`` v2) and the NEL encoder,
+and reports:
+
+* load time and resident memory added by the models (RSS delta);
+* NER docs/s over the synthetic corpus and NEL mentions/s over a reference
+  set of gazetteer terms;
+* drift against fp32: NER agreement (as in :mod:`benchmarks.ner_bench`), NEL
+  top-1 accuracy on the reference set, top-1 agreement with fp32 and the
+  minimum cosine between the fp32 and reduced-precision query embeddings.
+
+::
+
+  uv run python -m benchmarks.precision_bench --precisions fp32 int8 bf16 -o precision.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures, load_corpus
+from benchmarks.ner_bench import compare_entities
+from benchmarks.pipeline_bench import _git_commit, _peak_rss_bytes
+
+REFERENCE = "fp32"
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return _peak_rss_bytes()
+
+
+def _run_scenario(precision: str, models: list[str], corpus_path: str, entity: str, n_queries: int, batch_size: int, seed: int) -> dict:
+    """Runs in a fresh process: load the encoders in *precision*, then time and record their outputs."""
+    import numpy as np
+    import pandas as pd
+
+    from app.model_manager.resolver import LocalResolver
+    from app.src.nel.biencoder import BiencoderModel, load_nel_encoder
+    from app.src.ner import encoder_inference, load_encoder_models
+    from app.utils.precision import bf16_supported
+
+    resolver = LocalResolver()
+    rss_before = _rss_bytes()
+    t0 = time.perf_counter()
+    ner_models = load_encoder_models(
+        [resolver.get_ner_path(LANG, m)[0] for m in models], version=2, lang=LANG, precision=precision
+    )
+    encoder = load_nel_encoder(resolver.get_nel_path(LANG)[0], precision=precision)
+    load_s = time.perf_counter() - t0
+    model_mb = (_rss_bytes() - rss_before) / 2**20
+
+    texts = load_corpus(corpus_path)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    encoder_inference(batches[0], ner_models, version=2, lang=LANG)  # warm-up, not timed
+    entities: list[list] = [[] for _ in models]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for m, docs in enumerate(encoder_inference(batch, ner_models, version=2, lang=LANG)):
+            entities[m].extend([[e["start"], e["end"], e["ner_class"], e["ner_score"]] for e in doc] for doc in docs)
+    ner_wall = time.perf_counter() - t0
+
+    gaz_pth = resolver.get_gaz_path(LANG, entity)
+    nel = BiencoderModel(gaz_pth, encoder, resolver.get_vector_db_path(LANG, entity)[0])
+    gazetteer = pd.read_csv(gaz_pth, sep="\t").drop_duplicates(subset=["term"])
+    sample = gazetteer.sample(n=min(n_queries, len(gazetteer)), random_state=seed)
+    queries = sample["term"].tolist()
+    nel.run_nel_inference(queries[:batch_size])  # warm-up, not timed
+    t0 = time.perf_counter()
+    candidates = nel.run_nel_inference(queries)
+    nel_wall = time.perf_counter() - t0
+    predicted = [str(candidates.loc[q, "code"]) for q in queries]
+    embeddings = encoder.encode(queries, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+
+    return {
+        "precision": precision,
+        "bf16_supported": bf16_supported("cpu"),
+        "load_s": round(load_s, 3),
+        "model_mb": round(model_mb, 1),
+        "ner_docs_per_s": round(len(texts) / ner_wall, 2),
+        "nel_mentions_per_s": round(len(queries) / nel_wall, 1),
+        "nel_top1_accuracy": round(float(np.mean([p == str(g) for p, g in zip(predicted, sample["code"])])), 4),
+        "entities": entities,
+        "predicted": predicted,
+        "embeddings": embeddings.tolist(),
+    }
+
+
+def _nel_drift(run: dict, reference: dict) -> dict:
+    import numpy as np
+
+    agreement = np.mean([p == r for p, r in zip(run["predicted"], reference["predicted"])])
+    cosines = (np.asarray(run["embeddings"]) * np.asarray(reference["embeddings"])).sum(axis=1)
+    return {"nel_top1_agreement": round(float(agreement), 4), "nel_min_cosine": round(float(cosines.min()), 4)}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare fp32, int8 and bf16 encoders on synthetic data (CPU only).")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench"), help="Where fixtures are built and cached")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "int8", "bf16"], choices=["fp32", "int8", "bf16"])
+    parser.add_argument("--models", nargs="+", default=["disease", "negation"], choices=["disease", "symptoms", "negation"])
+    parser.add_argument("--nel-entity", default="disease", choices=["disease", "symptoms"], help="Gazetteer of the NEL reference set")
+    parser.add_argument("--nel-queries", type=int, default=500, help="Gazetteer terms in the NEL reference set")
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs)
+    parser.add_argument("--sentences", type=int, default=FixtureConfig.sentences_per_doc, help="Sentences per document")
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per encoder_inference call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    # Every chunk goes through the NER models (see benchmarks/chunk_cache_bench.py)
+    os.environ["NER_CHUNK_CACHE_SIZE"] = "0"
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    args = build_parser().parse_args(argv)
+
+    cfg = FixtureConfig(n_docs=args.docs, sentences_per_doc=args.sentences)
+    manifest = build_fixtures(args.work_dir, cfg)
+    os.environ["REGISTRY_PATH"] = manifest["registry"]
+
+    precisions = [REFERENCE] + [p for p in args.precisions if p != REFERENCE]
+    runs = {}
+    for precision in precisions:
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            runs[precision] = pool.submit(
+                _run_scenario, precision, args.models, manifest["corpus"], args.nel_entity,
+                args.nel_queries, args.batch_size, args.seed,
+            ).result()
+
+    reference = runs[REFERENCE]
+    results = []
+    for run in runs.values():
+        ner_drift = {
+            model: compare_entities(entities, ref_entities)
+            for model, entities, ref_entities in zip(args.models, run["entities"], reference["entities"])
+        }
+        nel_drift = _nel_drift(run, reference)
+        results.append({**run, "ner_drift": ner_drift, **nel_drift})
+    for run in results:
+        for key in ("entities", "predicted", "embeddings"):
+            run.pop(key)
+
+    print(f"{'precision':<11}{'load s':>8}{'MB':>8}{'docs/s':>9}{'ment/s':>9}{'NER rec':>9}{'NEL acc':>9}{'NEL agr':>9}{'cos min':>9}")
+    for r in results:
+        recall = min(d["recall_vs_reference"] for d in r["ner_drift"].values())
+        print(
+            f"{r['precision']:<11}{r['load_s']:>8.2f}{r['model_mb']:>8.1f}{r['ner_docs_per_s']:>9.1f}{r['nel_mentions_per_s']:>9.1f}"
+            f"{recall:>9.3f}{r['nel_top1_accuracy']:>9.3f}{r['nel_top1_agreement']:>9.3f}{r['nel_min_cosine']:>9.4f}"
+        )
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {
+                **asdict(cfg), "batch_size": args.batch_size, "models": args.models,
+                "nel_entity": args.nel_entity, "nel_queries": args.nel_queries, "reference_precision": REFERENCE,
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Benchmark of the API's startup cost.
+
+In fresh interpreters (``python -X importtime``), measures:
+
+* the time to ``import app`` and to answer the first ``GET /`` (Flask test
+  client), and the heavy libraries loaded by then (none are needed to serve
+  the health endpoint);
+* the import cost attributed to each top-level package (sum of the modules'
+  own import times) and the slowest modules;
+* the extra cost of each backend module once ``app`` is imported, i.e. what a
+  deployment pays on first use of a method.
+
+Each measurement is the median over ``--repeats`` runs. With ``--budget-s``,
+the exit status is 1 when the first health response takes longer::
+
+  uv run python -m benchmarks.startup_bench -o startup.json --budget-s 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.pipeline_bench import _git_commit
+
+HEAVY = (
+    "torch", "transformers", "sentence_transformers", "spacy", "onnxruntime",
+    "pandas", "numpy", "nltk", "flashtext", "rapidfuzz", "rank_bm25",
+)
+BACKENDS = (
+    "app.src.nel.lookup",
+    "app.src.nel.fuzzy_match",
+    "app.src.nel.bm25",
+    "app.src.nel.biencoder",
+    "app.src.ner.encoder_inference_v1",
+    "app.src.ner.encoder_inference_v2",
+    "app.src.ner.encoder_inference_v3",
+)
+
+_STARTUP = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+status = app.app.test_client().get("/").status_code
+t2 = time.perf_counter()
+print(json.dumps({{"import_s": t1 - t0, "first_health_s": t2 - t0, "status": status,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_BACKEND = """
+import importlib, json, sys, time
+import app
+before = set(sys.modules)
+t0 = time.perf_counter()
+importlib.import_module({module!r})
+t1 = time.perf_counter()
+print(json.dumps({{"import_s": t1 - t0, "heavy": [m for m in {heavy!r} if m in sys.modules and m not in before]}}))
+"""
+
+
+def _run(code: str, importtime: bool = False) -> tuple[dict, str]:
+    cmd = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", code]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd[:3])} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+    """``{module: self import time in µs}`` from ``-X importtime`` output."""
+    self_us = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|", 2)
+        self_us[name.strip()] = int(own)
+    return self_us
+
+
+def _startup(repeats: int, top: int) -> dict:
+    runs, per_module = [], defaultdict(list)
+    for _ in range(repeats):
+        result, stderr = _run(_STARTUP.format(heavy=HEAVY), importtime=True)
+        runs.append(result)
+        for module, us in parse_importtime(stderr).items():
+            per_module[module].append(us)
+    modules = {module: statistics.median(us) / 1e6 for module, us in per_module.items()}
+    packages = defaultdict(float)
+    for module, seconds in modules.items():
+        packages[module.split(".")[0]] += seconds
+    return {
+        "import_s": round(statistics.median(r["import_s"] for r in runs), 4),
+        "first_health_s": round(statistics.median(r["first_health_s"] for r in runs), 4),
+        "status": runs[-1]["status"],
+        "heavy_loaded": runs[-1]["heavy"],
+        "packages_s": {p: round(s, 4) for p, s in sorted(packages.items(), key=lambda kv: -kv[1])[:top]},
+        "slowest_modules_s": {m: round(s, 4) for m, s in sorted(modules.items(), key=lambda kv: -kv[1])[:top]},
+    }
+
+
+def _backend(module: str, repeats: int) -> dict:
+    try:
+        runs = [_run(_BACKEND.format(module=module, heavy=HEAVY))[0] for _ in range(repeats)]
+    except RuntimeError as exc:  # e.g. an optional extra that is not installed
+        return {"module": module, "error": str(exc).splitlines()[-1]}
+    return {
+        "module": module,
+        "import_s": round(statistics.median(r["import_s"] for r in runs), 4),
+        "heavy_loaded": runs[-1]["heavy"],
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measure the import and first-response time of the API.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--backends", nargs="*", default=list(BACKENDS), help="Backend modules to time after `import app`")
+    parser.add_argument("--top", type=int, default=15, help="Packages and modules listed")
+    parser.add_argument("--budget-s", type=float, help="Exit with status 1 if the first health response is slower")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    args = build_parser().parse_args(argv)
+
+    startup = _startup(args.repeats, args.top)
+    backends = [_backend(module, args.repeats) for module in args.backends]
+
+    print(f"import app: {startup['import_s'] * 1000:.0f} ms, first GET /: {startup['first_health_s'] * 1000:.0f} ms "
+          f"(status {startup['status']})")
+    print(f"heavy libraries loaded: {', '.join(startup['heavy_loaded']) or 'none'}")
+    print(f"\n{'package':<32}{'import ms':>10}")
+    for package, seconds in startup["packages_s"].items():
+        print(f"{package:<32}{seconds * 1000:>10.1f}")
+    print(f"\n{'backend (after import app)':<36}{'import ms':>10}  heavy libraries")
+    for b in backends:
+        if "error" in b:
+            print(f"{b['module']:<36}{'n/a':>10}  {b['error']}")
+        else:
+            print(f"{b['module']:<36}{b['import_s'] * 1000:>10.0f}  {', '.join(b['heavy_loaded'])}")
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {"repeats": args.repeats, "python": sys.version.split()[0]},
+            "startup": startup,
+            "backends": backends,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.budget_s is not None and startup["first_health_s"] > args.budget_s:
+        print(f"\nfirst GET / took {startup['first_health_s']:.3f}s, over the {args.budget_s}s budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Benchmark of the CPU parallelism layout (see :mod:`app.parallelism`).
+
+For a given core count, runs one pipeline with every layout of ``W`` worker
+processes x ``T`` threads each (torch intra-op threads and rapidfuzz workers,
+``W * T = cores``) on the synthetic corpus of :mod:`benchmarks.fixtures`, and
+reports aggregate docs/s and batch latency percentiles. The workers share the
+cores, as gunicorn or ``app.batch`` workers do, and start tagging together
+once all of them are loaded. With ``--oversubscribed``, every worker count is
+also run with the library defaults (one torch thread per core in each worker)
+for comparison. With ``--ner-pool``, every worker count ``W`` is also run as
+a single process whose NER runs on a pool of ``W`` worker processes (see
+:mod:`app.src.ner.process_pool`).
+
+::
+
+  uv run python -m benchmarks.threads_bench --cores 8 --method biencoder -o threads.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.fixtures import LANG, FixtureConfig, build_fixtures, load_corpus
+from benchmarks.pipeline_bench import _git_commit, percentile
+
+
+def _available_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _run_worker(worker_id: int, layout: dict, cpus: list[int], scenario: dict, corpus_path: str, barrier) -> dict:
+    """Runs in a fresh process: apply the layout, load, warm up, wait for the others, then tag this worker's shard."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    from app import method2pipeline
+    from app.parallelism import configure_parallelism
+
+    settings = configure_parallelism(**layout["parallelism"])
+
+    kwargs = {"ner_workers": layout["ner_workers"]} if "ner_workers" in layout else {}
+    pipeline = method2pipeline[scenario["method"]](lang=LANG, entities=scenario["entities"], **kwargs)
+    pipeline.load()
+    texts = load_corpus(corpus_path)[worker_id::layout["workers"]]
+    batch_size = scenario["batch_size"]
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    pipeline.predict(batches[0])  # warm-up, not timed
+
+    barrier.wait()
+    latencies = []
+    start = time.time()
+    for _ in range(scenario["repeats"]):
+        for batch in batches:
+            b0 = time.perf_counter()
+            pipeline.predict(batch)
+            latencies.append(time.perf_counter() - b0)
+    return {"settings": settings, "docs": len(texts) * scenario["repeats"], "start": start, "end": time.time(), "latencies": latencies}
+
+
+def _run_layout(layout: dict, cpus: list[int], scenario: dict, corpus_path: str) -> dict:
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager, ProcessPoolExecutor(max_workers=layout["workers"], mp_context=ctx) as pool:
+        barrier = manager.Barrier(layout["workers"])
+        futures = [
+            pool.submit(_run_worker, worker_id, layout, cpus, scenario, corpus_path, barrier)
+            for worker_id in range(layout["workers"])
+        ]
+        runs = [f.result() for f in futures]
+
+    wall = max(r["end"] for r in runs) - min(r["start"] for r in runs)
+    latencies = [lat for r in runs for lat in r["latencies"]]
+    return {
+        **layout,
+        "settings": runs[0]["settings"],
+        "docs": sum(r["docs"] for r in runs),
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(sum(r["docs"] for r in runs) / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def _layouts(cores: int, workers: list[int], interop: int | None, oversubscribed: bool, ner_pool: bool) -> list[dict]:
+    layouts = []
+    for w in workers:
+        threads = max(1, cores // w)
+        parallelism = {"torch_threads": threads, "rapidfuzz_workers": threads, "tokenizers_parallelism": w == 1}
+        if interop is not None:
+            parallelism["torch_interop_threads"] = interop
+        layouts.append({"label": f"{w}x{threads}", "workers": w, "parallelism": parallelism})
+        if oversubscribed and threads < cores:
+            layouts.append({"label": f"{w}x default", "workers": w, "parallelism": {}})
+        if ner_pool and w > 1:
+            # One process; its NER pool splits the cores (cores / W threads per NER worker)
+            pool = {"torch_threads": cores, "rapidfuzz_workers": cores, "tokenizers_parallelism": False}
+            layouts.append({"label": f"1 + NER pool {w}x{threads}", "workers": 1, "ner_workers": w, "parallelism": pool})
+    return layouts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from app import method2pipeline
+
+    parser = argparse.ArgumentParser(description="Find the best worker x thread layout for a core count (CPU only).")
+    parser.add_argument("--work-dir", type=Path, default=Path(".bench"), help="Where fixtures are built and cached")
+    parser.add_argument("--cores", type=int, default=len(_available_cpus()), help="Cores the workers share")
+    parser.add_argument("--workers", nargs="+", type=int, help="Worker counts to try (default: powers of two up to --cores)")
+    parser.add_argument("--interop-threads", type=int, help="torch inter-op threads per worker (default: torch's)")
+    parser.add_argument("--oversubscribed", action="store_true", help="Also run every worker count with the library defaults")
+    parser.add_argument("--ner-pool", action="store_true", help="Also run every worker count as one process with a NER process pool")
+    parser.add_argument("--method", default="biencoder", choices=list(method2pipeline))
+    parser.add_argument("--entities", nargs="+", default=["disease"], choices=["disease", "symptoms"])
+    parser.add_argument("--docs", type=int, default=FixtureConfig.n_docs)
+    parser.add_argument("--sentences", type=int, default=FixtureConfig.sentences_per_doc, help="Sentences per document")
+    parser.add_argument("--batch-size", type=int, default=8, help="Documents per predict call")
+    parser.add_argument("--repeats", type=int, default=1, help="Passes over the corpus per layout")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    from app.parallelism import ENV_VARS
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    # Every chunk goes through the NER models (see benchmarks/chunk_cache_bench.py)
+    os.environ["NER_CHUNK_CACHE_SIZE"] = "0"
+    os.environ["NER_CHUNK_CACHE_DIR"] = ""
+    # Inherited by the workers: the layout under test, not the environment's, applies
+    for env_var in ENV_VARS.values():
+        os.environ.pop(env_var, None)
+    args = build_parser().parse_args(argv)
+
+    cpus = _available_cpus()
+    if not 1 <= args.cores <= len(cpus):
+        print(f"--cores must be between 1 and {len(cpus)}", file=sys.stderr)
+        return 2
+    cpus = cpus[:args.cores]
+    workers = args.workers or [w for w in (1, 2, 4, 8, 16, 32, 64) if w <= args.cores]
+
+    cfg = FixtureConfig(n_docs=args.docs, sentences_per_doc=args.sentences)
+    manifest = build_fixtures(args.work_dir, cfg)
+    os.environ["REGISTRY_PATH"] = manifest["registry"]
+
+    scenario = {"method": args.method, "entities": args.entities, "batch_size": args.batch_size, "repeats": args.repeats}
+    results = []
+    for layout in _layouts(args.cores, workers, args.interop_threads, args.oversubscribed, args.ner_pool):
+        result = _run_layout(layout, cpus, scenario, manifest["corpus"])
+        results.append(result)
+        print(f"  {layout['label']}: {result['docs_per_s']} docs/s", file=sys.stderr)
+
+    best = max(results, key=lambda r: r["docs_per_s"])
+    print(f"{'layout':<20}{'docs/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in results:
+        marker = "  <- best" if r is best else ""
+        print(f"{r['label']:<20}{r['docs_per_s']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{marker}")
+
+    if args.output:
+        report = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {**asdict(cfg), **scenario, "cores": args.cores},
+            "best": best["label"],
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
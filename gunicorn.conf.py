@@ -0,0 +1,45 @@
+"""
+Gunicorn settings for ``gunicorn -c gunicorn.conf.py app.wsgi:application``.
+
+Inference is CPU-bound and torch parallelises each forward pass internally, so
+the layout favours a few workers with several intra-op threads each over many
+single-threaded workers. Every value can be overridden from the environment.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+_cores = os.cpu_count() or 1
+
+# Default: one worker per 4 cores, each with 4 torch threads. Request threads
+# only queue for the worker's inference slots (INFERENCE_MAX_CONCURRENCY), so a
+# few of them keep parsing/serialisation overlapped with inference and let the
+# micro-batcher coalesce requests. The admission queue (INFERENCE_MAX_QUEUE)
+# defaults to fit in these threads, so that overload is answered with 503s.
+workers = int(os.environ.get("WEB_CONCURRENCY", max(1, _cores // 4)))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+# Per-worker CPU parallelism (see app/parallelism.py): TORCH_NUM_THREADS,
+# TORCH_INTEROP_THREADS, TOKENIZERS_PARALLELISM and RAPIDFUZZ_WORKERS, or the
+# registry's "runtime" section, override these defaults.
+parallelism = {
+    "torch_threads": max(1, _cores // workers),
+    "tokenizers_parallelism": workers == 1,
+    "rapidfuzz_workers": max(1, _cores // workers),
+}
+
+# Load models in the master and fork afterwards (copy-on-write sharing).
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+# Large batches can legitimately take minutes.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 600))
+graceful_timeout = 60
+keepalive = 5
+
+
+def post_fork(server, worker):
+    from app.parallelism import configure_parallelism
+
+    settings = configure_parallelism(**parallelism)
+    server.log.info("Worker %s: %s", worker.pid, settings)
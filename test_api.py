@@ -8,6 +8,7 @@ Usage:
   uv run test_api.py --url http://host:5000
 """
 
+import json
 import sys
 import argparse
 import tempfile
@@ -44,6 +45,18 @@ def test_health():
     check("GET / → 200", r.status_code == 200, r.status_code)
     check("body is 'OK'", r.text.strip() == "OK", repr(r.text))
 
+    r = requests.get(f"{BASE_URL}/ready")
+    check("GET /ready → 200 or 503", r.status_code in (200, 503), r.status_code)
+
+    r = requests.get(f"{BASE_URL}/admin/pipelines")
+    check("GET /admin/pipelines → 200", r.status_code == 200, r.status_code)
+    if r.status_code == 200:
+        check("lists pipelines and resources", {"pipelines", "resources", "budget"} <= set(r.json()), r.text[:200])
+
+    r = requests.get(f"{BASE_URL}/metrics")
+    check("GET /metrics → 200", r.status_code == 200, r.status_code)
+    check("Prometheus text format", r.text.startswith("# HELP"), r.text[:200])
+
 
 def test_annotate_validation():
     print(f"\n{BOLD}POST /annotate (single text) — validation{RESET}")
@@ -66,8 +79,17 @@ def test_annotate_validation():
     r = requests.post(f"{BASE_URL}/annotate", json={**base, "entities": []})
     check("empty entities list → 400", r.status_code == 400, r.text)
 
-    r = requests.post(f"{BASE_URL}/annotate", json={**base, "negation": True, "method": "bm25"})
-    check("negation=True with non-biencoder → 400", r.status_code == 400, r.text)
+    r = requests.post(f"{BASE_URL}/annotate", json={**base, "negation": True, "method": "bm25", "lang": "xx"})
+    check("negation=True with non-biencoder, no lexicon for lang → 400", r.status_code == 400, r.text)
+
+    r = requests.post(f"{BASE_URL}/annotate", json={**base, "profile": "bogus"})
+    check("unknown profile mode → 400", r.status_code == 400, r.text)
+
+    r = requests.post(f"{BASE_URL}/annotate", json={**base, "previous": {"annotations": []}})
+    check("previous without its text → 400", r.status_code == 400, r.text)
+
+    r = requests.post(f"{BASE_URL}/annotate", json={**base, "output_format": "csv"})
+    check("unknown output_format → 400", r.status_code == 400, r.text)
 
 
     print(f"\n{BOLD}POST /annotate (text list) — validation{RESET}")
@@ -87,6 +109,9 @@ def test_annotate_validation():
     r = requests.post(f"{BASE_URL}/annotate", json={**base, "metadatas": [None, None]})
     check("metadatas length mismatch → 400", r.status_code == 400, r.text)
 
+    r = requests.post(f"{BASE_URL}/annotate", json={**base, "previous": [None, None]})
+    check("previous length mismatch → 400", r.status_code == 400, r.text)
+
 
 def test_directory_validation():
     print(f"\n{BOLD}POST /annotate_dir — validation{RESET}")
@@ -104,8 +129,8 @@ def test_directory_validation():
         r = requests.post(f"{BASE_URL}/annotate_dir", json={**base, "input_dir": empty_dir})
         check("empty dir (no .txt files) → 400", r.status_code == 400, r.text)
 
-    r = requests.post(f"{BASE_URL}/annotate_dir", json={**base, "negation": True, "method": "bm25"})
-    check("negation=True with non-biencoder → 400", r.status_code == 400, r.text)
+    r = requests.post(f"{BASE_URL}/annotate_dir", json={**base, "negation": True, "method": "bm25", "lang": "xx"})
+    check("negation=True with non-biencoder, no lexicon for lang → 400", r.status_code == 400, r.text)
 
 
 # ---------------------------------------------------------------------------
@@ -142,6 +167,47 @@ def test_annotate_full():
     r = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[0], **PARAMS, "negation": True})
     check("negation=True → 200", r.status_code == 200, r.text[:200])
 
+    # With rule-based negation (non-biencoder)
+    r = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[0], **PARAMS, "method": "lookup", "negation": True})
+    check("lookup with negation=True → 200", r.status_code == 200, r.text[:200])
+    if r.status_code == 200:
+        anns = r.json().get("annotations", [])
+        check("annotations carry is_negated", all("is_negated" in a for a in anns), anns[:1])
+
+    # Cascade: same output schema as biencoder
+    r = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[0], **PARAMS, "method": "cascade"})
+    check("cascade → 200", r.status_code == 200, r.text[:200])
+    anns = r.json().get("annotations", []) if r.status_code == 200 else []
+    if r.status_code == 200:
+        check("cascade annotations carry code", all("code" in a for a in anns), anns[:1])
+    r = requests.get(f"{BASE_URL}/metrics")
+    check("metrics count cascade tiers", "nel_cascade_mentions_total" in r.text or not anns, r.text[:200])
+
+    # With a per-stage timing breakdown
+    r = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[0], **PARAMS, "timings": True})
+    check("timings=True → 200", r.status_code == 200, r.text[:200])
+    server_timing = r.headers.get("Server-Timing", "")
+    # A document served from the result cache (RESULT_CACHE_DIR) skips the pipeline
+    check("Server-Timing header has ner_forward", "ner_forward;dur=" in server_timing or "result_cache;dur=" in server_timing, server_timing)
+
+    # Resending an unchanged document returns the same annotations (from the result cache, if enabled)
+    first = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[1], **PARAMS})
+    again = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[1], **PARAMS})
+    check("resent document → same annotations", first.status_code == again.status_code == 200
+          and first.json()["annotations"] == again.json()["annotations"], again.text[:200])
+    r = requests.get(f"{BASE_URL}/metrics")
+    hits = [float(line.split()[-1]) for line in r.text.splitlines() if line.startswith('result_cache_total{result="hit"}')]
+    if hits:
+        check("metrics count result cache hits", hits[0] > 0, hits)
+
+    # Re-annotating an edited document from its previous result matches a full run
+    if first.status_code == 200:
+        edited = f"{TEXTS[0]} {TEXTS[1]}"
+        full = requests.post(f"{BASE_URL}/annotate", json={"text": edited, **PARAMS})
+        incremental = requests.post(f"{BASE_URL}/annotate", json={"text": edited, **PARAMS, "previous": first.json()})
+        check("incremental edit → same annotations as a full run", full.status_code == incremental.status_code == 200
+              and full.json()["annotations"] == incremental.json()["annotations"], incremental.text[:200])
+
     # Save to output_dir
     with tempfile.TemporaryDirectory() as tmpdir:
         r = requests.post(f"{BASE_URL}/annotate", json={"text": TEXTS[0], **PARAMS, "output_dir": tmpdir})
@@ -182,6 +248,19 @@ def test_annotate_full():
             saved_files = list(Path(tmpdir).glob("*.json"))
             check("2 json files on disk", len(saved_files) == 2, str(saved_files))
 
+    # Save to a single JSONL file
+    with tempfile.TemporaryDirectory() as tmpdir:
+        r = requests.post(f"{BASE_URL}/annotate", json={"texts": TEXTS, **PARAMS, "output_dir": tmpdir, "output_format": "jsonl"})
+        check("output_format=jsonl → 200", r.status_code == 200, r.text[:200])
+        if r.status_code == 200:
+            body = r.json()
+            check("count is 2 results", body.get("count") == 2)
+            saved_files = list(Path(tmpdir).iterdir())
+            check("1 jsonl file on disk", len(saved_files) == 1 and saved_files[0].suffix == ".jsonl", str(saved_files))
+            if len(saved_files) == 1:
+                lines = saved_files[0].read_text(encoding="utf-8").splitlines()
+                check("one result per line", len(lines) == 2 and all("annotations" in json.loads(line) for line in lines))
+
 
 def test_annotate_directory_full():
     print(f"\n{BOLD}POST /annotate_dir — full pipeline{RESET}")
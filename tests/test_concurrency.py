@@ -0,0 +1,73 @@
+"""Tests of admission control in the API (``python -m unittest discover tests``)."""
+
+import importlib.util
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app as api
+from app import config
+from app.concurrency import InferenceLimiter
+
+REQUEST = {"text": "Tiene gripe.", "lang": "es", "method": "lookup", "entities": ["disease"]}
+
+
+def _default_config():
+    """app.config as loaded without any of the GUNICORN_* and INFERENCE_* variables."""
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("GUNICORN_", "INFERENCE_"))}
+    with mock.patch.dict(os.environ, env, clear=True):
+        spec = importlib.util.spec_from_file_location("_default_config", config.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+class BlockingPredictor:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def predict(self, texts):
+        self.release.wait(10)
+        return [[] for _ in texts]
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_overload_answers_503_with_default_settings(self):
+        defaults = _default_config()
+        limiter = InferenceLimiter(
+            max_concurrency=defaults.INFERENCE_MAX_CONCURRENCY,
+            max_queue=defaults.INFERENCE_MAX_QUEUE,
+            retry_after=defaults.INFERENCE_RETRY_AFTER_S,
+        )
+        predictor = BlockingPredictor()
+        client = api.app.test_client()
+        statuses = []
+
+        def post():
+            statuses.append(client.post("/annotate", json=REQUEST).status_code)
+
+        with mock.patch.object(api, "_limiter", limiter), \
+                mock.patch.object(api, "_result_cache", None), \
+                mock.patch.object(api, "_build_predictor", lambda **params: predictor):
+            # Every request thread of a worker but one is busy with a request
+            busy = [threading.Thread(target=post) for _ in range(defaults.GUNICORN_THREADS - 1)]
+            for thread in busy:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while limiter.admitted < len(busy) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            response = client.post("/annotate", json=REQUEST)
+            predictor.release.set()
+            for thread in busy:
+                thread.join()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(defaults.INFERENCE_RETRY_AFTER_S))
+        self.assertEqual(statuses, [200] * len(busy))
+
+
+if __name__ == "__main__":
+    unittest.main()
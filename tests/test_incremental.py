@@ -0,0 +1,99 @@
+"""Tests of app.incremental (``python -m unittest discover tests``)."""
+
+import re
+import unittest
+from unittest import mock
+
+from app import incremental
+from app.concurrency import InferenceLimiter, LimitedPredictor
+from app.incremental import predict_incremental
+from app.microbatch import MicroBatcher
+
+SYMPTOMS = {"dolor", "fiebre", "tos"}
+
+
+def _sentence_spans(text):
+    # Stands in for the Punkt segmentation: one sentence per period
+    return [m.span() for m in re.finditer(r"[^.\s][^.]*\.", text)]
+
+
+class FakePredictor:
+    """Tags the symptoms ending a sentence, merging touching ones like the NER backends."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, texts):
+        self.calls.append(list(texts))
+        return [self._annotate(text) for text in texts]
+
+    def _annotate(self, text):
+        annotations = []
+        for m in re.finditer(r"(\w+)\.", text):
+            if m.group(1) not in SYMPTOMS:
+                continue
+            if annotations and m.start() - annotations[-1]["end"] <= 1:
+                annotations[-1]["end"] = m.end()
+            else:
+                annotations.append({"start": m.start(), "end": m.end(), "ner_class": "SINTOMA"})
+        for ann in annotations:
+            ann["span"] = text[ann["start"]:ann["end"]]
+        return annotations
+
+
+@mock.patch.object(incremental, "sentence_spans", _sentence_spans)
+@mock.patch.object(incremental, "NER_VERSION", 2)
+class PredictIncrementalTest(unittest.TestCase):
+    def _edit(self, old_text, new_text):
+        predictor = FakePredictor()
+        previous = {"text": old_text, "annotations": predictor.predict([old_text])[0]}
+        predictor.calls.clear()
+        result = predict_incremental(predictor, [new_text], [previous])
+        return result[0], predictor
+
+    def test_unchanged_sentences_are_reused(self):
+        old_text = "Tiene dolor. Sin alergias. Refiere tos."
+        new_text = "Tiene dolor. Sin alergias conocidas. Refiere tos."
+        result, predictor = self._edit(old_text, new_text)
+        self.assertEqual(result, FakePredictor().predict([new_text])[0])
+        self.assertEqual(predictor.calls, [["Sin alergias conocidas."]])
+
+    def test_edited_run_touching_reused_entity_falls_back(self):
+        old_text = "Refiere dolor. Estable."
+        new_text = "Refiere dolor. fiebre."
+        result, predictor = self._edit(old_text, new_text)
+        self.assertEqual(result, FakePredictor().predict([new_text])[0])
+        self.assertEqual(len(result), 1)
+        self.assertEqual(predictor.calls[-1], [new_text])
+
+    def test_deletion_joining_reused_entities_falls_back(self):
+        # A X B -> A B: no sentence to annotate, but the entities ending A and
+        # starting B now touch, and a full run merges them
+        old_text = "Refiere dolor. Estable. tos."
+        new_text = "Refiere dolor. tos."
+        result, predictor = self._edit(old_text, new_text)
+        self.assertEqual(result, FakePredictor().predict([new_text])[0])
+        self.assertEqual(result[0]["span"], "dolor. tos.")
+        self.assertEqual(predictor.calls, [[new_text]])
+
+    def test_v1_pipeline_is_annotated_in_full(self):
+        # spaCy windows do not follow the sentences, whatever NER_VERSION says
+        predictor = FakePredictor()
+        predictor.ner_version = 1
+        old_text = "Tiene dolor. Sin alergias. Refiere tos."
+        new_text = "Tiene dolor. Sin alergias conocidas. Refiere tos."
+        previous = {"text": old_text, "annotations": FakePredictor().predict([old_text])[0]}
+        result = predict_incremental(predictor, [new_text], [previous])
+        self.assertEqual(result, FakePredictor().predict([new_text]))
+        self.assertEqual(predictor.calls, [[new_text]])
+
+    def test_wrapped_pipeline_exposes_its_backend(self):
+        pipeline = FakePredictor()
+        pipeline.ner_version = 1
+        limited = LimitedPredictor(pipeline, InferenceLimiter())
+        self.assertEqual(limited.ner_version, 1)
+        self.assertEqual(MicroBatcher(limited).ner_version, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+"""Tests of the readiness probe (``python -m unittest discover tests``)."""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app as api
+
+SPEC = {"method": "lookup", "lang": "es", "entities": ["disease"]}
+
+
+class ReadyTest(unittest.TestCase):
+    def test_server_without_wsgi_warms_up_on_first_request(self):
+        loaded = threading.Event()
+        client = api.app.test_client()
+        with mock.patch.object(api, "PRELOAD_PIPELINES", [SPEC]), \
+                mock.patch.object(api, "_ready", threading.Event()), \
+                mock.patch.object(api, "_warmup_started", False), \
+                mock.patch.object(api, "_build_pipeline", lambda **params: loaded.wait(5)):
+            self.assertEqual(client.get("/ready").status_code, 503)
+            loaded.set()
+            deadline = time.monotonic() + 5
+            while client.get("/ready").status_code != 200 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(client.get("/ready").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
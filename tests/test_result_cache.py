@@ -0,0 +1,66 @@
+"""Tests of app.result_cache (``python -m unittest discover tests``)."""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from app.result_cache import ResultCache
+
+
+class FakeResolver:
+    """Registers one gazetteer and one NER model directory, under ``root``."""
+
+    root: Path
+
+    def get_gaz_path(self, lang, entity):
+        return self.root / f"{entity}.tsv"
+
+    def get_ner_path(self, lang, entity):
+        return self.root / f"ner-{entity}", None
+
+    def get_nel_path(self, lang):
+        raise KeyError(lang)
+
+    def get_vector_db_path(self, lang, entity):
+        raise KeyError(entity)
+
+
+class NamespaceTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.cache = ResultCache(self.root / "results.sqlite")
+        (self.root / "disease.tsv").write_text("code\tterm\n1\tgripe\n")
+        (self.root / "ner-disease").mkdir()
+        (self.root / "ner-disease" / "model.bin").write_bytes(b"v1")
+        resolver = mock.patch("app.model_manager.resolver.LocalResolver", type("R", (FakeResolver,), {"root": self.root}))
+        resolver.start()
+        self.addCleanup(resolver.stop)
+
+    def _namespace(self):
+        return self.cache.namespace("biencoder", "es", ["disease"], False)
+
+    def _rewrite(self, path, data):
+        stat = path.stat()
+        path.write_bytes(data)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_stable_while_resources_are_unchanged(self):
+        self.assertEqual(self._namespace(), self._namespace())
+
+    def test_updated_gazetteer_changes_namespace(self):
+        before = self._namespace()
+        self._rewrite(self.root / "disease.tsv", b"code\tterm\n1\tgripe\n2\tcatarro\n")
+        self.assertNotEqual(self._namespace(), before)
+
+    def test_retrained_model_changes_namespace(self):
+        before = self._namespace()
+        self._rewrite(self.root / "ner-disease" / "model.bin", b"v2")
+        self.assertNotEqual(self._namespace(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Tests of app.streaming.StagedExecutor (``python -m unittest discover tests``)."""
+
+import threading
+import time
+import unittest
+
+from app.streaming import StagedExecutor
+
+
+def _fail_on(bad):
+    def stage(x):
+        if x == bad:
+            raise ValueError(f"bad item {x}")
+        return x
+    return stage
+
+
+def _slow(x):
+    time.sleep(0.5)
+    return x
+
+
+class StagedExecutorTest(unittest.TestCase):
+    def test_results_in_order(self):
+        executor = StagedExecutor([("double", lambda x: 2 * x), ("inc", lambda x: x + 1)], max_queue=1)
+        self.assertEqual(executor.map(range(20)), [2 * x + 1 for x in range(20)])
+
+    def test_stage_error_reaches_caller_while_later_stage_is_busy(self):
+        # The failing stage stops the run while "nel" is still working on an earlier item
+        executor = StagedExecutor([("ner", _fail_on(1)), ("nel", _slow), ("neg", lambda x: x)])
+        with self.assertRaisesRegex(ValueError, "bad item 1"):
+            executor.map(range(4))
+
+    def test_error_in_last_stage(self):
+        executor = StagedExecutor([("ner", lambda x: x), ("neg", _fail_on(2))])
+        with self.assertRaisesRegex(ValueError, "bad item 2"):
+            executor.map(range(4))
+
+    def test_error_while_iterating_items(self):
+        def items():
+            yield 0
+            raise KeyError("input")
+
+        executor = StagedExecutor([("ner", _slow)])
+        with self.assertRaises(KeyError):
+            executor.map(items())
+
+    def test_threads_end_after_error(self):
+        before = threading.active_count()
+        executor = StagedExecutor([("ner", _fail_on(0)), ("nel", _slow)])
+        with self.assertRaises(ValueError):
+            executor.map(range(10))
+        self.assertEqual(threading.active_count(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()